@@ -9,12 +9,19 @@
 
 from .utils import *
 from ._response import *
+from ._cache import *
+from ._retry import *
+from ._breaker import *
+from ._hedge import *
+from ._balancer import *
 from .sync_requests import *
 from .aio_requests import *
 from .aio_jrpclient import *
 from .sanic_jsonrpc import *
 
 
-__all__ = ("AIORequests", "SyncRequests", "Response", "Singleton", "AIOJRPClient", "SanicJsonRPC")
+__all__ = ("AIORequests", "SyncRequests", "Response", "StreamResponse", "AIOStreamResponse", "Singleton",
+           "AIOJRPClient", "SanicJsonRPC", "HttpCache", "RetryPolicy", "RetryBudget", "CircuitBreaker",
+           "HedgePolicy", "LoadBalancer", "Endpoint")
 
 __version__ = "1.0.0b2"
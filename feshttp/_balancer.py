@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午7:30
+jrpc client的多地址负载均衡
+"""
+import asyncio
+import itertools
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import aelog
+
+from .err import FuncArgsError
+
+__all__ = ("Endpoint", "LoadBalancer")
+
+# 负载均衡策略
+ROUND_ROBIN = "round_robin"  # 轮询
+LEAST_OUTSTANDING = "least_outstanding"  # 正在执行的请求最少
+P2C_EWMA = "p2c_ewma"  # 随机选两个,选择EWMA耗时乘以正在执行请求数较小的
+
+# 地址的健康状态
+HEALTHY = "healthy"  # 正常
+SLOW_START = "slow_start"  # 刚恢复,流量逐渐增加
+EJECTED = "ejected"  # 连续错误或者耗时异常被剔除
+UNHEALTHY = "unhealthy"  # 主动健康检查失败
+
+
+class _EndpointCall(object):
+    """
+    一次对地址的调用,统计正在执行的请求数、耗时和错误
+    """
+    __slots__ = ["_balancer", "_endpoint", "_start"]
+
+    def __init__(self, balancer: 'LoadBalancer', endpoint: 'Endpoint'):
+        self._balancer = balancer
+        self._endpoint = endpoint
+        self._start = 0.0
+
+    def __enter__(self, ) -> 'Endpoint':
+        self._endpoint.in_flight += 1
+        self._start = time.monotonic()
+        return self._endpoint
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._endpoint.in_flight -= 1
+        # 取消的请求没有结果,不统计
+        if exc_val is None:
+            self._balancer.on_success(self._endpoint, time.monotonic() - self._start)
+        elif isinstance(exc_val, Exception):
+            self._balancer.on_error(self._endpoint)
+
+
+class Endpoint(object):
+    """
+    jrpc server的一个地址
+    """
+    __slots__ = ["url", "address", "in_flight", "ewma", "calls", "errors", "consecutive_errors", "ejected_until",
+                 "ejection_count", "readmitted_at", "healthy", "probe_failures", "_alpha"]
+
+    def __init__(self, url: str, address: str = None, *, alpha: float = 0.3):
+        """
+        jrpc server的一个地址
+        Args:
+            url: 请求的URL
+            address: 地址,host:port
+            alpha: EWMA耗时的平滑系数,越大越偏向最近的耗时
+        """
+        self.url = url
+        self.address = address or url
+        self.in_flight = 0
+        self.ewma: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        # 剔除到什么时候,0为没有被剔除
+        self.ejected_until = 0.0
+        self.ejection_count = 0
+        # 恢复的时间,用于慢启动
+        self.readmitted_at: Optional[float] = None
+        # 主动健康检查的结果
+        self.healthy = True
+        self.probe_failures = 0
+        self._alpha = alpha
+
+    def record(self, latency: float):
+        """
+        记录成功调用的耗时
+        Args:
+            latency: 耗时,单位秒
+        Returns:
+
+        """
+        self.calls += 1
+        self.consecutive_errors = 0
+        self.ewma = latency if self.ewma is None else self._alpha * latency + (1 - self._alpha) * self.ewma
+
+    def readmit(self, now: float):
+        """
+        恢复地址,重新统计耗时,开始慢启动
+        Args:
+            now: 当前时间
+        Returns:
+
+        """
+        self.ejected_until = 0.0
+        self.readmitted_at = now
+        self.consecutive_errors = 0
+        self.calls = 0
+        self.ewma = None
+
+    def score(self, ) -> float:
+        """
+        p2c_ewma策略的负载,越小越优先,没有耗时记录的地址优先
+        Args:
+
+        Returns:
+
+        """
+        return (self.ewma or 0.0) * (self.in_flight + 1)
+
+    def snapshot(self, ) -> Dict[str, Any]:
+        """
+        地址的统计信息
+        Args:
+
+        Returns:
+
+        """
+        return {"url": self.url, "in_flight": self.in_flight, "ewma": self.ewma, "calls": self.calls,
+                "errors": self.errors, "consecutive_errors": self.consecutive_errors,
+                "ejection_count": self.ejection_count}
+
+
+class LoadBalancer(object):
+    """
+    jrpc server多个地址的负载均衡
+
+    支持round_robin轮询、least_outstanding选择正在执行请求最少的地址
+    和p2c_ewma随机选两个地址后选择EWMA耗时乘以正在执行请求数较小的地址.
+
+    被动异常检测: 连续错误达到consecutive_errors次,或者EWMA耗时超过其他地址中位数的latency_factor倍时剔除地址,
+    剔除时间从base_ejection_time开始每次翻倍,最多max_ejection_time, 同时被剔除的地址不超过max_ejection_percent,
+    恢复后每保持ejection_decay_interval时间没有被剔除,剔除次数减一.
+    主动健康检查: 设置health_check_interval后在后台定时TCP连接每个地址,连续失败unhealthy_threshold次时不再选择.
+    恢复的地址在slow_start时间内流量逐渐增加. 所有地址都不可用时忽略健康状态,在所有地址中选择.
+    只在asyncio的事件循环中使用,不是线程安全的
+    """
+    STRATEGIES = (ROUND_ROBIN, LEAST_OUTSTANDING, P2C_EWMA)
+
+    def __init__(self, endpoints: Iterable[Endpoint], strategy: str = ROUND_ROBIN, *,
+                 consecutive_errors: int = 5, latency_factor: float = 3.0, min_calls: int = 20,
+                 base_ejection_time: float = 30, max_ejection_time: float = 300, max_ejection_percent: float = 0.5,
+                 slow_start: float = 30, health_check_interval: float = None, health_check_timeout: float = 1,
+                 unhealthy_threshold: int = 2, ejection_decay_interval: float = 300):
+        """
+        jrpc server多个地址的负载均衡
+        Args:
+            endpoints: 地址
+            strategy: 负载均衡策略, round_robin, least_outstanding或者p2c_ewma
+            consecutive_errors: 连续错误多少次时剔除地址, 0为不按照错误剔除
+            latency_factor: EWMA耗时超过其他地址中位数的多少倍时剔除地址, 0为不按照耗时剔除
+            min_calls: 按照耗时剔除时地址的最少成功调用数
+            base_ejection_time: 第一次剔除的时间,单位秒,之后每次剔除时间翻倍
+            max_ejection_time: 最长的剔除时间,单位秒
+            max_ejection_percent: 同时被剔除的地址的最大比例
+            slow_start: 恢复的地址流量逐渐增加的时间,单位秒, 0为立即恢复全部流量
+            health_check_interval: 主动健康检查的间隔,单位秒,默认不检查
+            health_check_timeout: 主动健康检查TCP连接的超时时间,单位秒
+            unhealthy_threshold: 主动健康检查连续失败多少次时不再选择地址
+            ejection_decay_interval: 地址恢复后每隔多少秒没有被剔除,剔除次数减一,单位秒, 0为不减少
+        """
+        if strategy not in self.STRATEGIES:
+            raise FuncArgsError("strategy must be one of {}".format(", ".join(self.STRATEGIES)))
+        self.endpoints: List[Endpoint] = list(endpoints)
+        if not self.endpoints:
+            raise FuncArgsError("endpoints can not be empty")
+        self.strategy = strategy
+        self.consecutive_errors = consecutive_errors
+        self.latency_factor = latency_factor
+        self.min_calls = min_calls
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_ejection_percent = max_ejection_percent
+        self.slow_start = slow_start
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.unhealthy_threshold = unhealthy_threshold
+        self.ejection_decay_interval = ejection_decay_interval
+        self._counter = itertools.count()
+        self._health_check_task: Optional[asyncio.Future] = None
+
+    def track(self, endpoint: Endpoint) -> _EndpointCall:
+        """
+        统计一次对地址的调用
+        Args:
+            endpoint: 地址
+        Returns:
+            上下文管理器,with中的异常记录为错误
+        """
+        return _EndpointCall(self, endpoint)
+
+    def state(self, endpoint: Endpoint, now: float = None) -> str:
+        """
+        地址的健康状态,剔除时间到期的地址在这里恢复
+        Args:
+            endpoint: 地址
+            now: 当前时间
+        Returns:
+            healthy, slow_start, ejected或者unhealthy
+        """
+        now = time.monotonic() if now is None else now
+        if endpoint.ejected_until and now >= endpoint.ejected_until:
+            endpoint.readmit(now)
+        return self.peek_state(endpoint, now)
+
+    def peek_state(self, endpoint: Endpoint, now: float = None) -> str:
+        """
+        地址的健康状态,不修改地址的状态,剔除时间到期但还没有恢复的地址按照现在恢复计算
+        Args:
+            endpoint: 地址
+            now: 当前时间
+        Returns:
+            healthy, slow_start, ejected或者unhealthy
+        """
+        now = time.monotonic() if now is None else now
+        readmitted_at = endpoint.readmitted_at
+        if endpoint.ejected_until:
+            if now < endpoint.ejected_until:
+                return EJECTED
+            readmitted_at = now
+        if not endpoint.healthy:
+            return UNHEALTHY
+        if readmitted_at is not None and now - readmitted_at < self.slow_start:
+            return SLOW_START
+        return HEALTHY
+
+    def _weight(self, endpoint: Endpoint, now: float) -> float:
+        """
+        慢启动时地址的流量比例,从10%线性增加到100%
+        Args:
+            endpoint: 地址
+            now: 当前时间
+        Returns:
+
+        """
+        return max((now - endpoint.readmitted_at) / self.slow_start, 0.1)
+
+    def pick(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        """
+        选择一个地址
+        Args:
+            exclude: 尽量不选择的地址,比如对冲请求时已经请求过的地址,所有地址都被排除时忽略这个参数
+        Returns:
+
+        """
+        now = time.monotonic()
+        available = []
+        for endpoint in self.endpoints:
+            state = self.state(endpoint, now)
+            # 慢启动的地址按照流量比例随机选择
+            if state == HEALTHY or (state == SLOW_START and random.random() < self._weight(endpoint, now)):
+                available.append(endpoint)
+        candidates = [endpoint for endpoint in available if endpoint not in exclude] or available or [
+            endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == ROUND_ROBIN:
+            return candidates[next(self._counter) % len(candidates)]
+        if self.strategy == LEAST_OUTSTANDING:
+            # 正在执行的请求数相同时轮询
+            start = next(self._counter) % len(candidates)
+            return min(candidates[start:] + candidates[:start], key=lambda endpoint: endpoint.in_flight)
+        first, second = random.sample(candidates, 2)
+        return first if (first.score(), first.in_flight) <= (second.score(), second.in_flight) else second
+
+    def on_success(self, endpoint: Endpoint, latency: float):
+        """
+        记录成功的调用,EWMA耗时异常时剔除地址
+        Args:
+            endpoint: 地址
+            latency: 耗时,单位秒
+        Returns:
+
+        """
+        endpoint.record(latency)
+        if not self.latency_factor or endpoint.calls < self.min_calls or endpoint.ejected_until:
+            return
+        others = sorted(other.ewma for other in self.endpoints
+                        if other is not endpoint and other.ewma is not None and not other.ejected_until)
+        if others:
+            median = others[len(others) // 2]
+            if median > 0 and endpoint.ewma > median * self.latency_factor:
+                self._eject(endpoint, "latency {:.3f}s is {:.1f}x of median".format(endpoint.ewma,
+                                                                                   endpoint.ewma / median))
+
+    def on_error(self, endpoint: Endpoint):
+        """
+        记录失败的调用,连续错误时剔除地址
+        Args:
+            endpoint: 地址
+        Returns:
+
+        """
+        endpoint.errors += 1
+        endpoint.consecutive_errors += 1
+        if (self.consecutive_errors and endpoint.consecutive_errors >= self.consecutive_errors and
+                not endpoint.ejected_until):
+            self._eject(endpoint, "{} consecutive errors".format(endpoint.consecutive_errors))
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        """
+        剔除地址,剔除时间按照剔除次数指数增长
+        Args:
+            endpoint: 地址
+            reason: 剔除的原因
+        Returns:
+
+        """
+        now = time.monotonic()
+        ejected = sum(1 for other in self.endpoints if self.peek_state(other, now) == EJECTED)
+        if len(self.endpoints) < 2 or ejected + 1 > max(int(len(self.endpoints) * self.max_ejection_percent), 1):
+            return
+        if endpoint.ejection_count and endpoint.readmitted_at is not None and self.ejection_decay_interval:
+            # 恢复后保持正常的时间越长,剔除次数越少,之前的一次集中错误不会一直延长之后的剔除时间
+            decay = int((now - endpoint.readmitted_at) / self.ejection_decay_interval)
+            endpoint.ejection_count = max(endpoint.ejection_count - decay, 0)
+        ejection_time = min(self.base_ejection_time * 2 ** endpoint.ejection_count, self.max_ejection_time)
+        endpoint.ejection_count += 1
+        endpoint.ejected_until = now + ejection_time
+        aelog.warning("eject jrpc endpoint {} for {}s: {}".format(endpoint.address, ejection_time, reason))
+
+    def start_health_check(self, ):
+        """
+        在当前的事件循环中启动主动健康检查,已经启动或者没有配置时不做任何事
+        Args:
+
+        Returns:
+
+        """
+        if self.health_check_interval and (self._health_check_task is None or self._health_check_task.done()):
+            self._health_check_task = asyncio.ensure_future(self._health_check())
+
+    def close(self, ):
+        """
+        停止主动健康检查
+        Args:
+
+        Returns:
+
+        """
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+
+    async def _health_check(self, ):
+        """
+        定时检查所有地址
+        Args:
+
+        Returns:
+
+        """
+        while True:
+            await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(self.health_check_interval)
+
+    async def _probe(self, endpoint: Endpoint):
+        """
+        TCP连接地址检查是否可用
+        Args:
+            endpoint: 地址
+        Returns:
+
+        """
+        url = urlsplit(endpoint.url)
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(
+                url.hostname, url.port or (443 if url.scheme == "https" else 80)), self.health_check_timeout)
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            endpoint.probe_failures += 1
+            if endpoint.healthy and endpoint.probe_failures >= self.unhealthy_threshold:
+                endpoint.healthy = False
+                aelog.warning("jrpc endpoint {} is unhealthy".format(endpoint.address))
+        else:
+            endpoint.probe_failures = 0
+            if not endpoint.healthy:
+                endpoint.healthy = True
+                endpoint.readmit(time.monotonic())
+
+    def snapshot(self, ) -> List[Dict[str, Any]]:
+        """
+        所有地址的健康状态和统计信息
+        Args:
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        snapshot = []
+        for endpoint in self.endpoints:
+            data = endpoint.snapshot()
+            data["state"] = self.peek_state(endpoint, now)
+            data["ejected_for"] = max(endpoint.ejected_until - now, 0)
+            snapshot.append(data)
+        return snapshot
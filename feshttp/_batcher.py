@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午8:50
+合并不同协程的调用批量发送
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+__all__ = ("MicroBatcher",)
+
+
+class MicroBatcher(object):
+    """
+    微批处理
+
+    收集window时间内或者达到max_size个的调用,使用send一次发送,再把结果按照顺序分发给每个调用方.
+    调用方在发送前被取消时从批次中删除,发送后被取消时只丢弃结果
+    """
+
+    def __init__(self, send: Callable[[List[Any]], Awaitable[List[Any]]], *, window: float = 0.002,
+                 max_size: int = 100):
+        """
+        微批处理
+        Args:
+            send: 批量发送的函数,参数为调用的列表,返回顺序对应的结果列表
+            window: 收集调用的时间窗口,单位秒
+            max_size: 每批最多的调用数
+        """
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Handle] = None
+        # 统计计数
+        self.calls = 0
+        self.batches = 0
+
+    async def submit(self, item: Any) -> Any:
+        """
+        提交一个调用,等待批量发送后的结果
+        Args:
+            item: 调用
+        Returns:
+            调用对应的结果
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        entry = (item, future)
+        self._pending.append(entry)
+        self.calls += 1
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if entry in self._pending:
+                self._pending.remove(entry)
+            raise
+
+    def flush(self, ):
+        """
+        立即发送已经收集的调用
+        Args:
+
+        Returns:
+
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            asyncio.ensure_future(self._send_batch(batch))
+
+    async def _send_batch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """
+        发送一批调用并分发结果,发送失败时所有调用方都收到同一个异常
+        Args:
+            batch: [(调用, 结果的future)]
+        Returns:
+
+        """
+        try:
+            results = await self.send([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        except BaseException:
+            # 发送的task被取消时取消所有等待的调用方,否则调用方会一直等待
+            for _, future in batch:
+                future.cancel()
+            raise
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
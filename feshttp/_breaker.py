@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午5:20
+按照host熔断,同步和异步的请求共用
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+from .err import CircuitOpenError, ClientConnectionError, ClientResponseError
+
+__all__ = ("CircuitBreaker",)
+
+# 熔断器的状态
+CLOSED = "closed"  # 正常请求,统计失败率和慢调用率
+OPEN = "open"  # 快速失败,不发送请求
+HALF_OPEN = "half_open"  # 允许少量探测请求,根据探测结果关闭或者重新打开
+
+
+def _is_failure(error: BaseException) -> bool:
+    """
+    默认的失败判断,连接异常、超时和5xx响应是失败,4xx响应是调用方的问题,不算失败
+    Args:
+        error: 请求的异常
+    Returns:
+
+    """
+    if isinstance(error, ClientConnectionError):
+        return True
+    return isinstance(error, ClientResponseError) and (error.status_code or 0) >= 500
+
+
+class _HostCircuit(object):
+    """
+    单个host的熔断状态
+    """
+    __slots__ = ["state", "generation", "results", "opened_at", "probes", "probe_results", "rejected",
+                 "open_count"]
+
+    def __init__(self, window_size: int):
+        self.state = CLOSED
+        # 状态每次变化时加一,状态变化之前发出的请求的结果不再统计
+        self.generation = 0
+        # 最近的请求结果,(是否失败, 是否慢调用)
+        self.results = deque(maxlen=window_size)
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_results = []
+        self.rejected = 0
+        self.open_count = 0
+
+
+class _CircuitCall(object):
+    """
+    一次受熔断器保护的调用,进入时检查熔断状态,退出时记录结果
+    """
+    __slots__ = ["_breaker", "_url", "_host", "_circuit", "_generation", "_start"]
+
+    def __init__(self, breaker: 'CircuitBreaker', url: str):
+        self._breaker = breaker
+        self._url = url
+        self._host = breaker.host_of(url)
+        self._circuit = None
+        self._generation = 0
+        self._start = 0.0
+
+    def __enter__(self, ) -> '_CircuitCall':
+        self._circuit, self._generation = self._breaker._acquire(self._host, self._url)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._breaker._release(self._circuit, self._generation, exc_val, time.monotonic() - self._start)
+
+
+class CircuitBreaker(object):
+    """
+    按照host熔断
+
+    关闭状态下统计每个host最近window_size个请求,请求数达到minimum_calls并且失败率或者慢调用率超过阈值时打开,
+    打开状态下对这个host的请求直接抛出CircuitOpenError, 不占用连接和等待超时,
+    open_duration后进入半开状态,允许half_open_max_calls个探测请求,探测结果没有超过阈值时关闭,否则重新打开.
+    熔断器是线程安全的,同一个实例可以同时给AIORequests和SyncRequests使用.
+    """
+
+    def __init__(self, *, failure_rate_threshold: float = 0.5, slow_call_rate_threshold: float = 1.0,
+                 slow_call_duration: float = 60, window_size: int = 100, minimum_calls: int = 20,
+                 open_duration: float = 30, half_open_max_calls: int = 5,
+                 is_failure: Callable[[BaseException], bool] = None):
+        """
+        按照host熔断
+        Args:
+            failure_rate_threshold: 失败率阈值,失败率大于等于这个值时打开熔断器
+            slow_call_rate_threshold: 慢调用率阈值,慢调用率大于等于这个值时打开熔断器
+            slow_call_duration: 慢调用的时间,单位秒,调用时间超过这个值时是慢调用
+            window_size: 统计最近请求的个数
+            minimum_calls: 开始计算失败率的最少请求数
+            open_duration: 熔断器打开的时间,单位秒,之后进入半开状态
+            half_open_max_calls: 半开状态下允许的探测请求数
+            is_failure: 判断异常是否是失败,默认连接异常、超时和5xx响应是失败
+        """
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.window_size = window_size
+        self.minimum_calls = minimum_calls
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or _is_failure
+        self._circuits: Dict[str, _HostCircuit] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        """
+        获取熔断的key, URL的host和端口,不是URL时原样返回
+        Args:
+            url: 请求的URL或者host
+        Returns:
+
+        """
+        return urlsplit(url).netloc or url
+
+    def call(self, url: str) -> _CircuitCall:
+        """
+        受熔断器保护的调用,熔断器打开时进入就会抛出CircuitOpenError
+        Args:
+            url: 请求的URL
+        Returns:
+            上下文管理器,with中的异常按照is_failure记录为失败
+        """
+        return _CircuitCall(self, url)
+
+    def _acquire(self, host: str, url: str):
+        """
+        检查熔断状态,打开或者半开状态下没有探测名额时抛出CircuitOpenError
+        Args:
+            host: 熔断的key
+            url: 请求的URL
+        Returns:
+            (host的熔断状态, 状态的版本)
+        """
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                circuit = self._circuits[host] = _HostCircuit(self.window_size)
+            if circuit.state == OPEN:
+                remaining = circuit.opened_at + self.open_duration - time.monotonic()
+                if remaining > 0:
+                    circuit.rejected += 1
+                    raise CircuitOpenError(url, host=host, retry_after=remaining,
+                                           message="circuit breaker for {} is open".format(host))
+                self._transition(circuit, HALF_OPEN)
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_max_calls:
+                    circuit.rejected += 1
+                    raise CircuitOpenError(url, host=host, retry_after=0,
+                                           message="circuit breaker for {} is half open".format(host))
+                circuit.probes += 1
+            return circuit, circuit.generation
+
+    def _release(self, circuit: _HostCircuit, generation: int, error: Optional[BaseException], duration: float):
+        """
+        记录调用的结果,取消等既不是成功也不是失败的调用只释放探测名额
+        Args:
+            circuit: host的熔断状态
+            generation: 调用开始时状态的版本
+            error: 调用的异常,成功时为None
+            duration: 调用的时间
+        Returns:
+
+        """
+        if error is None:
+            failed = False
+        elif isinstance(error, Exception):
+            failed = self.is_failure(error)
+        else:
+            failed = None
+        with self._lock:
+            if circuit.generation != generation:
+                return
+            if circuit.state == HALF_OPEN:
+                if failed is None:
+                    circuit.probes -= 1
+                    return
+                circuit.probe_results.append((failed, duration >= self.slow_call_duration))
+                if len(circuit.probe_results) >= self.half_open_max_calls:
+                    self._transition(circuit, OPEN if self._tripped(circuit.probe_results) else CLOSED)
+            elif circuit.state == CLOSED and failed is not None:
+                circuit.results.append((failed, duration >= self.slow_call_duration))
+                if len(circuit.results) >= self.minimum_calls and self._tripped(circuit.results):
+                    self._transition(circuit, OPEN)
+
+    def _tripped(self, results) -> bool:
+        """
+        失败率或者慢调用率是否超过阈值
+        Args:
+            results: 调用结果
+        Returns:
+
+        """
+        total = len(results)
+        failures = sum(1 for failed, _ in results if failed)
+        slow_calls = sum(1 for _, slow in results if slow)
+        return failures / total >= self.failure_rate_threshold or slow_calls / total >= self.slow_call_rate_threshold
+
+    @staticmethod
+    def _transition(circuit: _HostCircuit, state: str):
+        """
+        切换熔断状态,调用方需要持有锁
+        Args:
+            circuit: host的熔断状态
+            state: 新的状态
+        Returns:
+
+        """
+        circuit.state = state
+        circuit.generation += 1
+        circuit.probes = 0
+        circuit.probe_results = []
+        if state == OPEN:
+            circuit.opened_at = time.monotonic()
+            circuit.open_count += 1
+        elif state == CLOSED:
+            circuit.results.clear()
+
+    def state(self, url: str) -> str:
+        """
+        host当前的熔断状态
+        Args:
+            url: 请求的URL或者host
+        Returns:
+            closed, open或者half_open
+        """
+        with self._lock:
+            circuit = self._circuits.get(self.host_of(url))
+            if circuit is None:
+                return CLOSED
+            if circuit.state == OPEN and time.monotonic() >= circuit.opened_at + self.open_duration:
+                return HALF_OPEN
+            return circuit.state
+
+    def snapshot(self, ) -> Dict[str, Dict]:
+        """
+        所有host的熔断状态和统计信息
+        Args:
+
+        Returns:
+            {host: {"state": 状态, "calls": 统计的请求数, "failure_rate": 失败率, "slow_call_rate": 慢调用率,
+            "rejected": 拒绝的请求数, "open_count": 打开的次数, "retry_after": 打开状态剩余的秒数}}
+        """
+        now = time.monotonic()
+        snapshot = {}
+        with self._lock:
+            for host, circuit in self._circuits.items():
+                results = circuit.probe_results if circuit.state == HALF_OPEN else circuit.results
+                total = len(results)
+                remaining = circuit.opened_at + self.open_duration - now if circuit.state == OPEN else 0
+                snapshot[host] = {
+                    "state": HALF_OPEN if circuit.state == OPEN and remaining <= 0 else circuit.state,
+                    "calls": total,
+                    "failure_rate": sum(1 for failed, _ in results if failed) / total if total else 0.0,
+                    "slow_call_rate": sum(1 for _, slow in results if slow) / total if total else 0.0,
+                    "rejected": circuit.rejected,
+                    "open_count": circuit.open_count,
+                    "retry_after": max(remaining, 0)}
+        return snapshot
+
+    def reset(self, url: str = None):
+        """
+        重置熔断状态
+        Args:
+            url: 请求的URL或者host,默认重置所有host
+        Returns:
+
+        """
+        with self._lock:
+            if url is None:
+                self._circuits.clear()
+            else:
+                self._circuits.pop(self.host_of(url), None)
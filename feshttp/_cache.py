@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午2:10
+HTTP响应缓存,同步和异步的请求共用
+"""
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Union
+from urllib.parse import urlencode
+
+from ._response import Response
+
+__all__ = ("HttpCache",)
+
+# 缓存查询的结果
+FRESH = "fresh"  # 缓存新鲜,直接返回
+STALE = "stale"  # 缓存过期但在stale-while-revalidate时间内,返回缓存并在后台重新校验
+REVALIDATE = "revalidate"  # 缓存过期,需要带条件请求重新校验
+MISS = "miss"  # 没有缓存
+# 包含这些请求头的请求是某个用户私有的,不使用缓存
+_PRIVATE_HEADERS = frozenset({"authorization", "cookie"})
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    解析Cache-Control头
+    Args:
+        value: Cache-Control头的值
+    Returns:
+        {指令: 参数}, 没有参数的指令值为None
+    """
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, arg = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+def _parse_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    解析秒数,格式错误时返回None
+    Args:
+        value: 秒数
+    Returns:
+
+    """
+    try:
+        return max(float(value), 0) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    """
+    解析HTTP日期为时间戳,格式错误时返回None
+    Args:
+        value: HTTP日期
+    Returns:
+
+    """
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class _CacheEntry(object):
+    """
+    缓存项
+    """
+    __slots__ = ["response", "size", "vary", "stored_at", "max_age", "stale_while_revalidate", "etag",
+                 "last_modified", "revalidating"]
+
+    def __init__(self, response: Response, size: int, vary: Dict[str, Optional[str]]):
+        self.response = response
+        self.size = size
+        self.vary = vary
+        self.stored_at = 0.0
+        self.max_age = 0.0
+        self.stale_while_revalidate = 0.0
+        self.etag = None
+        self.last_modified = None
+        # 是否正在后台重新校验,防止同一个缓存项同时发起多个校验请求
+        self.revalidating = False
+
+    def update_freshness(self, headers: Mapping):
+        """
+        根据响应头更新缓存的新鲜度和校验信息
+        Args:
+            headers: 200或者304的响应头
+        Returns:
+
+        """
+        now = time.time()
+        cache_control = _parse_cache_control(headers.get("Cache-Control"))
+        age = _parse_seconds(headers.get("Age")) or 0
+        max_age = _parse_seconds(cache_control.get("max-age"))
+        if max_age is None:
+            expires = _parse_http_date(headers.get("Expires"))
+            date = _parse_http_date(headers.get("Date")) or now
+            max_age = max(expires - date, 0) if expires is not None else 0
+        if "no-cache" in cache_control:
+            max_age = 0
+
+        self.stored_at = time.monotonic() - age
+        self.max_age = max_age
+        if "must-revalidate" in cache_control:
+            self.stale_while_revalidate = 0
+        else:
+            self.stale_while_revalidate = _parse_seconds(cache_control.get("stale-while-revalidate")) or 0
+        self.etag = headers.get("ETag") or self.etag
+        self.last_modified = headers.get("Last-Modified") or self.last_modified
+
+    def state(self, ) -> str:
+        """
+        缓存项当前的状态
+        Args:
+
+        Returns:
+
+        """
+        age = time.monotonic() - self.stored_at
+        if age < self.max_age:
+            return FRESH
+        if age < self.max_age + self.stale_while_revalidate:
+            return STALE
+        return REVALIDATE
+
+
+class HttpCache(object):
+    """
+    HTTP响应的内存缓存
+
+    只缓存没有请求体、认证信息和cookie的GET请求的200响应,按照LRU淘汰,同时限制缓存项个数和总字节数.
+    支持Cache-Control的max-age、no-cache、no-store、must-revalidate和stale-while-revalidate以及Expires,
+    有ETag或者Last-Modified时过期后使用If-None-Match和If-Modified-Since重新校验.
+    缓存是线程安全的,同一个实例可以同时给AIORequests和SyncRequests使用,
+    缓存命中时返回的是同一个Response对象,调用方不应该修改其中的内容.
+    """
+
+    def __init__(self, maxsize: int = 64 * 1024 * 1024, maxentries: int = 1024):
+        """
+        HTTP响应的内存缓存
+        Args:
+            maxsize: 缓存的最大总字节数
+            maxentries: 缓存的最大个数
+        """
+        self.maxsize = maxsize
+        self.maxentries = maxentries
+        self._entries: Dict[str, _CacheEntry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # 统计计数
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Union[Mapping, Sequence, None] = None) -> str:
+        """
+        生成缓存的key
+        Args:
+            method: 请求方法
+            url: 请求的URL
+            params: 查询参数
+        Returns:
+
+        """
+        if params:
+            items = sorted(params.items()) if isinstance(params, Mapping) else list(params)
+            url = "{}{}{}".format(url, "&" if "?" in url else "?", urlencode(items, doseq=True))
+        return "{} {}".format(method.upper(), url)
+
+    @staticmethod
+    def is_cacheable_request(method: str, headers: Optional[Mapping], **kwargs) -> bool:
+        """
+        请求是否可以使用缓存,带认证信息或者cookie的请求不使用缓存,防止不同用户之间共享响应
+        Args:
+            method: 请求方法
+            headers: 请求头
+            kwargs: 请求的其他参数,包括data、json、auth和cookies
+        Returns:
+
+        """
+        if method.upper() != "GET":
+            return False
+        if any(kwargs.get(name) for name in ("data", "json", "auth", "cookies")):
+            return False
+        return not any(name.lower() in _PRIVATE_HEADERS for name in (headers or {}))
+
+    def lookup(self, key: str, headers: Optional[Mapping] = None) -> Tuple[str, Optional[_CacheEntry]]:
+        """
+        查询缓存
+        Args:
+            key: 缓存的key
+            headers: 请求头, 用于匹配响应的Vary
+        Returns:
+            (状态, 缓存项)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._match_vary(entry, headers):
+                self.misses += 1
+                return MISS, None
+            self._entries.move_to_end(key)
+            state = entry.state()
+            if state == FRESH:
+                self.hits += 1
+            elif state == STALE:
+                self.stale_hits += 1
+                # 已经在后台校验时不需要重复校验
+                if entry.revalidating:
+                    return FRESH, entry
+                entry.revalidating = True
+            elif entry.etag is None and entry.last_modified is None:
+                # 没有校验信息时无法重新校验
+                self.misses += 1
+                return MISS, None
+            return state, entry
+
+    @staticmethod
+    def conditional_headers(entry: _CacheEntry, headers: Optional[Mapping] = None) -> Dict:
+        """
+        生成重新校验的请求头
+        Args:
+            entry: 缓存项
+            headers: 原始的请求头
+        Returns:
+
+        """
+        headers = dict(headers or {})
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def store(self, key: str, response: Response, headers: Optional[Mapping] = None) -> Response:
+        """
+        保存响应,不可缓存的响应会删除已有的缓存
+        Args:
+            key: 缓存的key
+            response: 响应
+            headers: 请求头, 用于记录响应的Vary
+        Returns:
+            保存的响应
+        """
+        cache_control = _parse_cache_control(response.headers.get("Cache-Control"))
+        vary_names = [name.strip() for name in response.headers.get("Vary", "").split(",") if name.strip()]
+        size = len(response.content) + sum(len(k) + len(v) for k, v in response.headers.items())
+        if response.status_code != 200 or "no-store" in cache_control or "*" in vary_names or size > self.maxsize:
+            self.discard(key)
+            return response
+
+        entry = _CacheEntry(response, size, {name.lower(): self._get_header(headers, name) for name in vary_names})
+        entry.update_freshness(response.headers)
+        if entry.max_age == 0 and entry.etag is None and entry.last_modified is None:
+            self.discard(key)
+            return response
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._entries and (self._size > self.maxsize or len(self._entries) > self.maxentries):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self.evictions += 1
+        return response
+
+    def revalidated(self, key: str, entry: _CacheEntry, response: Response,
+                    headers: Optional[Mapping] = None) -> Response:
+        """
+        处理重新校验的响应,304时更新缓存的新鲜度并返回缓存的响应,否则保存新的响应
+        Args:
+            key: 缓存的key
+            entry: 重新校验的缓存项
+            response: 重新校验的响应
+            headers: 请求头
+        Returns:
+
+        """
+        with self._lock:
+            self.revalidations += 1
+            entry.revalidating = False
+            if response.status_code == 304:
+                self.not_modified += 1
+                entry.update_freshness(response.headers)
+                return entry.response
+        return self.store(key, response, headers)
+
+    def revalidate_failed(self, entry: _CacheEntry):
+        """
+        后台重新校验失败,允许下次请求再次校验
+        Args:
+            entry: 重新校验的缓存项
+        Returns:
+
+        """
+        with self._lock:
+            entry.revalidating = False
+
+    def discard(self, key: str):
+        """
+        删除缓存
+        Args:
+            key: 缓存的key
+        Returns:
+
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def clear(self, ):
+        """
+        清空缓存
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计信息
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+                    "revalidations": self.revalidations, "not_modified": self.not_modified,
+                    "evictions": self.evictions, "entries": len(self._entries), "size": self._size}
+
+    @staticmethod
+    def _get_header(headers: Optional[Mapping], name: str) -> Optional[str]:
+        """
+        大小写不敏感的获取请求头
+        Args:
+            headers: 请求头
+            name: 请求头名称
+        Returns:
+
+        """
+        name = name.lower()
+        for key, value in (headers or {}).items():
+            if key.lower() == name:
+                return value
+        return None
+
+    def _match_vary(self, entry: _CacheEntry, headers: Optional[Mapping]) -> bool:
+        """
+        请求头是否和缓存响应的Vary一致
+        Args:
+            entry: 缓存项
+            headers: 请求头
+        Returns:
+
+        """
+        return all(self._get_header(headers, name) == value for name, value in entry.vary.items())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午6:40
+异步请求的对冲策略,AIORequests和AIOJRPClient共用
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from ._retry import RetryBudget, RetryPolicy
+
+__all__ = ("HedgePolicy",)
+
+
+def _consume_result(task: asyncio.Future):
+    """
+    取消的对冲请求完成时获取异常,防止出现异常没有被获取的警告
+    Args:
+        task: 对冲的请求
+    Returns:
+
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgePolicy(object):
+    """
+    请求对冲策略
+
+    请求在delay时间内没有响应时再发起一次相同的请求,使用最先返回的响应并取消其他请求,用来降低慢副本造成的长尾延迟.
+    没有指定delay时使用最近成功请求耗时的percentile分位数,样本不足min_samples时使用initial_delay.
+    对冲会增加下游的负载,所有使用同一个策略的请求共用一个对冲预算,默认对冲请求最多占正常请求的5%.
+    默认只对冲幂等的请求方法
+    """
+
+    def __init__(self, delay: float = None, *, percentile: float = 0.95, initial_delay: float = 0.1,
+                 min_delay: float = 0.005, window_size: int = 1000, min_samples: int = 20, max_hedges: int = 1,
+                 methods: Iterable[str] = RetryPolicy.IDEMPOTENT_METHODS, budget: RetryBudget = None):
+        """
+        请求对冲策略
+        Args:
+            delay: 固定的对冲等待时间,单位秒,默认按照请求耗时的分位数计算
+            percentile: 计算对冲等待时间的分位数,默认p95
+            initial_delay: 样本不足时的对冲等待时间,单位秒
+            min_delay: 对冲等待时间的最小值,单位秒
+            window_size: 统计最近成功请求耗时的个数
+            min_samples: 按照分位数计算等待时间的最少样本数
+            max_hedges: 每个请求最多额外发起的对冲请求数
+            methods: 可以对冲的请求方法
+            budget: 对冲预算,默认每个请求存入0.05个令牌,每秒补充1个令牌,最多10个令牌
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.methods = frozenset(method.upper() for method in methods)
+        self.budget = budget if budget is not None else RetryBudget(ratio=0.05, min_per_second=1, max_tokens=10)
+        self._latencies = deque(maxlen=window_size)
+        self._samples = 0
+        self._observed_delay: Optional[float] = None
+        # 统计计数
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def is_hedgeable(self, method: str, data: Any = None) -> bool:
+        """
+        请求是否可以对冲,流式的请求体不能重复发送
+        Args:
+            method: 请求方法
+            data: 请求体
+        Returns:
+
+        """
+        return method.upper() in self.methods and RetryPolicy.is_replayable(data)
+
+    def record(self, latency: float):
+        """
+        记录成功请求的耗时
+        Args:
+            latency: 耗时,单位秒
+        Returns:
+
+        """
+        self._latencies.append(latency)
+        self._samples += 1
+        # 每16个样本重新计算一次分位数,避免每次请求都排序
+        if self._samples % 16 == 0:
+            self._observed_delay = None
+
+    def hedge_delay(self, ) -> float:
+        """
+        当前的对冲等待时间
+        Args:
+
+        Returns:
+
+        """
+        if self.delay is not None:
+            return self.delay
+        if len(self._latencies) < self.min_samples:
+            return self.initial_delay
+        if self._observed_delay is None:
+            latencies = sorted(self._latencies)
+            self._observed_delay = max(latencies[int(self.percentile * (len(latencies) - 1))], self.min_delay)
+        return self._observed_delay
+
+    async def _timed(self, attempt: Awaitable) -> Any:
+        """
+        执行一次请求并记录成功请求的耗时
+        Args:
+            attempt: 请求
+        Returns:
+
+        """
+        start = time.monotonic()
+        result = await attempt
+        self.record(time.monotonic() - start)
+        return result
+
+    async def run(self, attempt: Callable[[int], Awaitable]) -> Any:
+        """
+        对冲执行请求
+        Args:
+            attempt: 参数为第几次请求,返回请求的awaitable, 0是原始请求,对冲请求可以据此选择其他的地址
+        Returns:
+            最先成功的请求的结果,所有请求都失败时抛出最后一个异常
+        """
+        self.requests += 1
+        self.budget.deposit()
+        tasks = [asyncio.ensure_future(self._timed(attempt(0)))]
+        primary = tasks[0]
+        can_hedge = self.max_hedges > 0
+        try:
+            while True:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay() if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 没有预算时不再对冲,继续等待已经发出的请求
+                    if self.budget.withdraw():
+                        self.hedges += 1
+                        tasks.append(asyncio.ensure_future(self._timed(attempt(len(tasks)))))
+                    can_hedge = self.budget.tokens >= 1 and len(tasks) <= self.max_hedges
+                    continue
+                error = None
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not tasks:
+                    raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+                task.add_done_callback(_consume_result)
+
+    def stats(self, ) -> Dict[str, Any]:
+        """
+        对冲的统计信息
+        Args:
+
+        Returns:
+
+        """
+        return {"requests": self.requests, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "delay": self.hedge_delay(), "samples": len(self._latencies)}
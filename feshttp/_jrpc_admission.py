@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午12:10
+jsonrpc服务端的准入控制,过载时排队或者拒绝调用
+"""
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional
+
+__all__ = ("AdmissionController", "OverloadedError")
+
+# 方法的优先级,critical不受限制,其他优先级排队时按照优先级顺序执行,队列满时先拒绝低优先级的调用
+CRITICAL = "critical"
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+_PRIORITY_RANKS = {CRITICAL: 0, HIGH: 1, NORMAL: 2, LOW: 3}
+
+
+class OverloadedError(Exception):
+    """
+    调用因为过载被拒绝
+    """
+
+    def __init__(self, method: str, reason: str):
+        super().__init__("{} rejected: {}".format(method, reason))
+        self.method = method
+        self.reason = reason
+
+
+class _Waiter(object):
+    """
+    排队等待执行的调用
+    """
+    __slots__ = ["method", "rank", "seq", "future", "timer"]
+
+    def __init__(self, method: str, rank: int, seq: int, future: asyncio.Future):
+        self.method = method
+        self.rank = rank
+        self.seq = seq
+        self.future = future
+        self.timer: Optional[asyncio.Handle] = None
+
+
+class _Admission(object):
+    """
+    一次准入的调用,退出时释放执行名额
+    """
+    __slots__ = ["_controller", "_method", "_counted"]
+
+    def __init__(self, controller: 'AdmissionController', method: str, counted: bool):
+        self._controller = controller
+        self._method = method
+        self._counted = counted
+
+    def __enter__(self, ) -> '_Admission':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._counted:
+            self._controller._release(self._method)
+
+
+class AdmissionController(object):
+    """
+    准入控制
+
+    整个服务和每个方法可以分别限制同时执行的调用数,超过限制的调用进入有界的等待队列,
+    等待超过queue_timeout或者队列已满时拒绝调用,抛出OverloadedError, 避免过载时所有调用的耗时一起增加直到客户端超时.
+    方法可以设置优先级,队列中按照优先级和到达顺序执行,队列满时高优先级的调用会挤掉队列中最低优先级的调用,
+    critical优先级的调用不受限制,适用于健康检查等必须响应的方法.
+    没有设置任何限制时不做任何处理
+    """
+
+    def __init__(self, max_in_flight: int = None, *, max_queue: int = 100, queue_timeout: float = 1):
+        """
+        准入控制
+        Args:
+            max_in_flight: 整个服务同时执行的调用数,默认不限制
+            max_queue: 等待队列的长度
+            queue_timeout: 在队列中最多等待的时间,单位秒
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.method_limits: Dict[str, int] = {}
+        self.priorities: Dict[str, str] = {}
+        self.in_flight = 0
+        self._method_in_flight: Dict[str, int] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # 统计计数
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {}
+
+    def configure(self, method: str, *, priority: str = None, max_in_flight: int = None):
+        """
+        设置方法的优先级和同时执行的调用数
+        Args:
+            method: jsonrpc方法名
+            priority: critical, high, normal或者low,默认normal
+            max_in_flight: 方法同时执行的调用数,默认不限制
+        Returns:
+
+        """
+        if priority is not None:
+            if priority not in _PRIORITY_RANKS:
+                raise ValueError("priority must be one of {}".format(", ".join(_PRIORITY_RANKS)))
+            self.priorities[method] = priority
+        if max_in_flight is not None:
+            self.method_limits[method] = max_in_flight
+
+    @property
+    def enabled(self, ) -> bool:
+        return self.max_in_flight is not None or bool(self.method_limits)
+
+    def _admissible(self, method: str) -> bool:
+        """
+        方法当前是否可以执行
+        Args:
+            method: jsonrpc方法名
+        Returns:
+
+        """
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return False
+        limit = self.method_limits.get(method)
+        return limit is None or self._method_in_flight.get(method, 0) < limit
+
+    def _admit(self, method: str):
+        """
+        占用执行名额
+        Args:
+            method: jsonrpc方法名
+        Returns:
+
+        """
+        self.in_flight += 1
+        self._method_in_flight[method] = self._method_in_flight.get(method, 0) + 1
+        self.admitted += 1
+
+    def _release(self, method: str):
+        """
+        释放执行名额并唤醒队列中可以执行的调用
+        Args:
+            method: jsonrpc方法名
+        Returns:
+
+        """
+        self.in_flight -= 1
+        self._method_in_flight[method] -= 1
+        for waiter in sorted(self._waiters, key=lambda w: (w.rank, w.seq)):
+            if waiter.future.done():
+                self._remove(waiter)
+            elif self._admissible(waiter.method):
+                self._remove(waiter)
+                self._admit(waiter.method)
+                waiter.future.set_result(None)
+
+    def _reject(self, method: str, reason: str) -> OverloadedError:
+        """
+        记录拒绝的调用
+        Args:
+            method: jsonrpc方法名
+            reason: 拒绝的原因
+        Returns:
+
+        """
+        self.rejected[method] = self.rejected.get(method, 0) + 1
+        return OverloadedError(method, reason)
+
+    def _remove(self, waiter: _Waiter):
+        """
+        从队列中删除调用
+        Args:
+            waiter: 排队的调用
+        Returns:
+
+        """
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+
+    def _expire(self, waiter: _Waiter):
+        """
+        排队超时
+        Args:
+            waiter: 排队的调用
+        Returns:
+
+        """
+        self._remove(waiter)
+        if not waiter.future.done():
+            waiter.future.set_exception(self._reject(waiter.method, "queue timeout"))
+
+    async def acquire(self, method: str) -> _Admission:
+        """
+        获取执行名额,没有名额时排队等待
+        Args:
+            method: jsonrpc方法名
+        Returns:
+            上下文管理器,退出时释放执行名额,过载时抛出OverloadedError
+        """
+        if not self.enabled:
+            return _Admission(self, method, False)
+        priority = self.priorities.get(method, NORMAL)
+        if priority == CRITICAL or self._admissible(method):
+            self._admit(method)
+            return _Admission(self, method, True)
+
+        rank = _PRIORITY_RANKS[priority]
+        if len(self._waiters) >= self.max_queue:
+            # 队列满时挤掉优先级更低的最后到达的调用,没有时拒绝当前调用
+            lowest = max(self._waiters, key=lambda w: (w.rank, w.seq), default=None)
+            if lowest is None or lowest.rank <= rank:
+                raise self._reject(method, "queue full")
+            self._remove(lowest)
+            if not lowest.future.done():
+                lowest.future.set_exception(self._reject(lowest.method, "evicted by higher priority call"))
+
+        loop = asyncio.get_event_loop()
+        waiter = _Waiter(method, rank, next(self._seq), loop.create_future())
+        waiter.timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._remove(waiter)
+            # 已经分配了名额之后被取消,释放名额
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._release(method)
+            raise
+        return _Admission(self, method, True)
+
+    def snapshot(self, ) -> Dict[str, Any]:
+        """
+        准入控制的状态和统计信息
+        Args:
+
+        Returns:
+
+        """
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "queued": len(self._waiters),
+                "max_queue": self.max_queue, "admitted": self.admitted, "total_queued": self.queued,
+                "rejected": dict(self.rejected),
+                "methods": {method: {"in_flight": self._method_in_flight.get(method, 0),
+                                     "max_in_flight": self.method_limits.get(method),
+                                     "priority": self.priorities.get(method, NORMAL)}
+                            for method in set(self.method_limits) | set(self.priorities)}}
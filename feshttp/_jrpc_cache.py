@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午11:20
+jsonrpc服务端幂等方法的结果缓存
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import aelog
+
+from ._json import dumps, loads
+
+__all__ = ("JsonRPCCache",)
+
+
+class JsonRPCCache(object):
+    """
+    jsonrpc方法结果的缓存
+
+    按照方法名和参数缓存方法的结果,在内存中按照LRU淘汰,过期时间为ttl.
+    同一个key同时有多个调用没有命中时只执行一次方法,其他调用等待同一个结果,方法出错时结果不缓存.
+    设置path后结果同时保存在这个目录中,多个sanic worker进程共享,每个key一个文件,先写临时文件再替换,
+    读取时不会读到写了一半的内容,目录放在/dev/shm等内存文件系统中可以避免磁盘IO.
+    结果需要可以json序列化,缓存命中时返回的是同一个对象,方法不应该修改返回值
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024, path: str = None):
+        """
+        jsonrpc方法结果的缓存
+        Args:
+            ttl: 缓存的时间,单位秒
+            maxsize: 内存中最多缓存的结果数
+            path: 多进程共享的缓存目录,默认只缓存在内存中
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self._entries: Dict[str, Tuple[float, Any]] = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(method: str, params: Any) -> str:
+        """
+        生成缓存的key,关键字参数的顺序不影响key
+        Args:
+            method: jsonrpc方法名
+            params: jsonrpc参数
+        Returns:
+
+        """
+        return "{}:{}".format(method, dumps(params, sort_keys=True))
+
+    async def get_or_call(self, key: str, func: Callable[[], Awaitable]) -> Any:
+        """
+        获取缓存的结果,没有命中时执行func并缓存结果,同一个key同时只执行一次
+        Args:
+            key: 缓存的key
+            func: 没有命中时执行的函数,返回awaitable,抛出异常时结果不缓存,所有等待的调用都收到这个异常
+        Returns:
+
+        """
+        found, result = self._get_memory(key)
+        if not found:
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._load(key, func))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda fut: self._in_flight_done(key, fut))
+            # 个别调用方被取消时不影响其他等待的调用方
+            found, result = await asyncio.shield(task)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return result
+
+    async def _load(self, key: str, func: Callable[[], Awaitable]) -> Tuple[bool, Any]:
+        """
+        查询共享目录,没有命中时执行方法并缓存结果,文件读写在线程池中执行,不阻塞事件循环
+        Args:
+            key: 缓存的key
+            func: 执行的函数
+        Returns:
+            (是否命中, 结果)
+        """
+        loop = asyncio.get_event_loop()
+        if self.path is not None:
+            expires_at, result = await loop.run_in_executor(None, self._read_file, key)
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                self._set_memory(key, result, remaining)
+                return True, result
+        result = await func()
+        self._set_memory(key, result, self.ttl)
+        if self.path is not None:
+            await loop.run_in_executor(None, self._write_file, key, result)
+        return False, result
+
+    def _in_flight_done(self, key: Hashable, task: asyncio.Future):
+        """
+        执行结束后删除正在执行的记录
+        Args:
+            key: 缓存的key
+            task: 执行的task
+        Returns:
+
+        """
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # 所有调用方都被取消时获取异常,防止出现异常没有被获取的警告
+            task.exception()
+
+    def _get_memory(self, key: str) -> Tuple[bool, Any]:
+        """
+        查询内存缓存
+        Args:
+            key: 缓存的key
+        Returns:
+            (是否命中, 结果)
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return True, entry[1]
+            del self._entries[key]
+        return False, None
+
+    def _read_file(self, key: str) -> Tuple[float, Any]:
+        """
+        读取共享目录中的结果,在线程池中执行
+        Args:
+            key: 缓存的key
+        Returns:
+            (过期时间, 结果),文件不存在或者读取出错时过期时间为0
+        """
+        try:
+            with open(self._file_path(key), "rb") as f:
+                expires_at, result = loads(f.read())
+        except FileNotFoundError:
+            return 0, None
+        except (OSError, ValueError) as e:
+            aelog.exception(e)
+            return 0, None
+        return expires_at, result
+
+    def _write_file(self, key: str, result: Any):
+        """
+        保存结果到共享目录,先写临时文件再替换,在线程池中执行
+        Args:
+            key: 缓存的key
+            result: 方法的结果
+        Returns:
+
+        """
+        tmp_path = None
+        try:
+            content = dumps([time.time() + self.ttl, result]).encode()
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, self._file_path(key))
+        except (OSError, TypeError, ValueError) as e:
+            aelog.exception(e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _set_memory(self, key: str, result: Any, ttl: float):
+        """
+        保存结果到内存缓存,超过maxsize时淘汰最久没有使用的结果
+        Args:
+            key: 缓存的key
+            result: 方法的结果
+            ttl: 缓存的时间
+        Returns:
+
+        """
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _file_path(self, key: str) -> str:
+        """
+        key在共享目录中的文件路径
+        Args:
+            key: 缓存的key
+        Returns:
+
+        """
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest())
+
+    async def clear(self, ):
+        """
+        清空缓存,包括共享目录中的文件,文件在线程池中删除
+        Args:
+
+        Returns:
+
+        """
+        self._entries.clear()
+        if self.path is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._remove_files)
+
+    def _remove_files(self, ):
+        """
+        删除共享目录中的文件
+        Args:
+
+        Returns:
+
+        """
+        for name in os.listdir(self.path):
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计信息
+        Args:
+
+        Returns:
+
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午10:50
+jsonrpc服务端每个方法的调用统计
+"""
+import bisect
+import time
+from typing import Any, Dict, Optional, Sequence
+
+__all__ = ("JsonRPCMetrics",)
+
+# 耗时直方图默认的桶,单位秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _MethodMetrics(object):
+    """
+    单个方法的统计
+    """
+    __slots__ = ["calls", "errors", "in_flight", "latency_sum", "latency_max", "buckets", "error_codes"]
+
+    def __init__(self, bucket_count: int):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # 最后一个桶是+Inf
+        self.buckets = [0] * (bucket_count + 1)
+        self.error_codes: Dict[int, int] = {}
+
+
+class _MethodCall(object):
+    """
+    一次方法调用,进入时增加执行中的调用数,退出时记录耗时和结果
+    """
+    __slots__ = ["_metrics", "_method", "_start", "_error_code"]
+
+    def __init__(self, metrics: 'JsonRPCMetrics', method: str):
+        self._metrics = metrics
+        self._method = method
+        self._start = 0.0
+        self._error_code: Optional[int] = None
+
+    def fail(self, code: int):
+        """
+        标记调用返回了jsonrpc错误
+        Args:
+            code: jsonrpc错误码
+        Returns:
+
+        """
+        self._error_code = code
+
+    def __enter__(self, ) -> '_MethodCall':
+        self._metrics._get(self._method).in_flight += 1
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self._error_code is None:
+            # 取消等异常也记录为错误,错误码使用Internal error
+            self._error_code = -32603
+        self._metrics._record(self._method, time.monotonic() - self._start, self._error_code)
+
+
+class JsonRPCMetrics(object):
+    """
+    jsonrpc方法的调用统计
+
+    每个方法统计调用数、错误数和各个错误码的次数、正在执行的调用数以及耗时直方图,
+    直方图的桶和prometheus一样是累计的,每个桶是耗时小于等于上界的调用数
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        jsonrpc方法的调用统计
+        Args:
+            buckets: 耗时直方图的上界,单位秒
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._methods: Dict[str, _MethodMetrics] = {}
+
+    def _get(self, method: str) -> _MethodMetrics:
+        """
+        获取方法的统计,第一次调用时创建
+        Args:
+            method: jsonrpc方法名
+        Returns:
+
+        """
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = self._methods[method] = _MethodMetrics(len(self.buckets))
+        return metrics
+
+    def track(self, method: str) -> _MethodCall:
+        """
+        统计一次方法调用
+        Args:
+            method: jsonrpc方法名
+        Returns:
+            上下文管理器,with中的异常或者调用fail时记录为错误
+        """
+        return _MethodCall(self, method)
+
+    def _record(self, method: str, latency: float, error_code: Optional[int]):
+        """
+        记录一次调用的结果
+        Args:
+            method: jsonrpc方法名
+            latency: 耗时,单位秒
+            error_code: jsonrpc错误码,成功时为None
+        Returns:
+
+        """
+        metrics = self._get(method)
+        metrics.in_flight -= 1
+        metrics.calls += 1
+        metrics.latency_sum += latency
+        metrics.latency_max = max(metrics.latency_max, latency)
+        metrics.buckets[bisect.bisect_left(self.buckets, latency)] += 1
+        if error_code is not None:
+            metrics.errors += 1
+            metrics.error_codes[error_code] = metrics.error_codes.get(error_code, 0) + 1
+
+    def snapshot(self, method: str = None) -> Dict[str, Dict[str, Any]]:
+        """
+        方法的调用统计
+        Args:
+            method: jsonrpc方法名,默认所有方法
+        Returns:
+            {method: {"calls": 调用数, "errors": 错误数, "error_codes": {错误码: 次数}, "in_flight": 正在执行的调用数,
+            "latency_avg": 平均耗时, "latency_max": 最大耗时, "latency_sum": 总耗时,
+            "histogram": {上界: 耗时小于等于上界的调用数}}}
+        """
+        snapshot = {}
+        for name, metrics in self._methods.items():
+            if method is not None and name != method:
+                continue
+            histogram, count = {}, 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), metrics.buckets):
+                count += bucket
+                histogram[str(bound)] = count
+            snapshot[name] = {
+                "calls": metrics.calls,
+                "errors": metrics.errors,
+                "error_codes": dict(metrics.error_codes),
+                "in_flight": metrics.in_flight,
+                "latency_avg": metrics.latency_sum / metrics.calls if metrics.calls else 0.0,
+                "latency_max": metrics.latency_max,
+                "latency_sum": metrics.latency_sum,
+                "histogram": histogram}
+        return snapshot
+
+    def reset(self, ):
+        """
+        清空统计,正在执行的调用数保留
+        Args:
+
+        Returns:
+
+        """
+        for name, metrics in list(self._methods.items()):
+            in_flight = metrics.in_flight
+            metrics = self._methods[name] = _MethodMetrics(len(self.buckets))
+            metrics.in_flight = in_flight
@@ -9,14 +9,16 @@
 
 import codecs
 import io
+import re
 import uuid
 from datetime import date, datetime
 from time import gmtime
+from typing import Any, Callable, Dict, Optional
 
 import simplejson as json
 
 __all__ = ['dump', 'dumps', 'load', 'loads', 'htmlsafe_dump',
-           'htmlsafe_dumps', 'JSONDecoder', 'JSONEncoder', ]
+           'htmlsafe_dumps', 'JSONDecoder', 'JSONEncoder', 'register_backend', 'use_backend', 'get_backend']
 
 # Figure out if simplejson escapes slashes.  This behavior was changed
 # from one version to another without reason.
@@ -68,6 +70,22 @@ def http_date(timestamp=None):
     return _dump_date(timestamp, ' ')
 
 
+def _default(o):
+    """Convert ``datetime``, ``date``, ``UUID`` and ``Markup`` objects, shared
+    by :class:`JSONEncoder` and the backends which accept a ``default``
+    function instead of an encoder class.
+    """
+    if isinstance(o, datetime):
+        return http_date(o.utctimetuple())
+    if isinstance(o, date):
+        return http_date(o.timetuple())
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError('Object of type {} is not JSON serializable'.format(o.__class__.__name__))
+
+
 class JSONEncoder(json.JSONEncoder):
     """The default Flask JSON encoder.  This one extends the default simplejson
     encoder by also supporting ``datetime`` objects, ``UUID`` as well as
@@ -93,15 +111,10 @@ class JSONEncoder(json.JSONEncoder):
                     return list(iterable)
                 return JSONEncoder.default(self, o)
         """
-        if isinstance(o, datetime):
-            return http_date(o.utctimetuple())
-        if isinstance(o, date):
-            return http_date(o.timetuple())
-        if isinstance(o, uuid.UUID):
-            return str(o)
-        if hasattr(o, '__html__'):
-            return str(o.__html__())
-        return json.JSONEncoder.default(self, o)
+        try:
+            return _default(o)
+        except TypeError:
+            return json.JSONEncoder.default(self, o)
 
 
 class JSONDecoder(json.JSONDecoder):
@@ -112,9 +125,85 @@ class JSONDecoder(json.JSONDecoder):
     """
 
 
+class _JSONBackend(object):
+    """A registered json backend.
+
+    ``dumps(obj, sort_keys)`` must return a ``str`` and raise ``TypeError``
+    for objects it can not serialize, ``loads(s)`` must accept ``str`` or
+    UTF-8 ``bytes`` and raise ``ValueError`` for invalid documents.
+    """
+    __slots__ = ['name', 'dumps', 'loads']
+
+    def __init__(self, name: str, dumps: Callable[[Any, bool], str], loads: Callable[[Any], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+_backends: Dict[str, _JSONBackend] = {}
+# 按照优先级排列, auto时选择第一个已经注册的backend
+_backend_priority = ('orjson', 'ujson', 'simplejson')
+_backend: Optional[_JSONBackend] = None
+_sort_keys = True
+# 快速后端不支持的对象交给simplejson时使用和快速后端相同的紧凑格式,输出格式不随内容变化
+_compact_separators = (',', ':')
+
+
+def register_backend(name: str, dumps: Callable[[Any, bool], str], loads: Callable[[Any], Any]):
+    """Register a json backend which can be selected by :func:`use_backend`.
+
+    :param name: backend name.
+    :param dumps: ``dumps(obj, sort_keys) -> str``, datetime, date, UUID and
+        ``__html__`` objects must be serialized like :class:`JSONEncoder`.
+    :param loads: ``loads(s) -> obj``, ``s`` is ``str`` or UTF-8 ``bytes``.
+    """
+    _backends[name] = _JSONBackend(name, dumps, loads)
+
+
+def _resolve_backend(name: Optional[str]) -> _JSONBackend:
+    """Return the registered backend called ``name``, ``None`` is the
+    process default and ``'auto'`` the fastest installed one.
+    """
+    if name is None:
+        return _backend
+    if name == 'auto':
+        name = next(backend_name for backend_name in _backend_priority if backend_name in _backends)
+    backend = _backends.get(name)
+    if backend is None:
+        raise ValueError('json backend {} is not registered or not installed'.format(name))
+    return backend
+
+
+def use_backend(name: Optional[str] = None, *, sort_keys: Optional[bool] = None):
+    """Select the process default json backend used by :func:`dumps` and
+    :func:`loads` when no ``backend`` argument is given.
+
+    The default is simplejson.  Clients created with ``json_backend`` pass
+    their own backend explicitly and are not affected by this setting.
+
+    :param name: backend name, ``'auto'`` selects the fastest installed one
+        (orjson, ujson, simplejson), ``None`` keeps the current backend.
+    :param sort_keys: whether :func:`dumps` sorts keys by default, ``None``
+        keeps the current setting.
+    """
+    global _backend, _sort_keys
+
+    if name is not None:
+        _backend = _resolve_backend(name)
+    if sort_keys is not None:
+        _sort_keys = sort_keys
+
+
+def get_backend(name: Optional[str] = None) -> str:
+    """Return the name of the json backend ``name`` resolves to, by default
+    the process default backend.
+    """
+    return _resolve_backend(name).name
+
+
 def _dump_arg_defaults(kwargs):
     """Inject default arguments for dump functions."""
-    kwargs.setdefault('sort_keys', True)
+    kwargs.setdefault('sort_keys', _sort_keys)
     kwargs.setdefault('cls', JSONEncoder)
     kwargs.setdefault('ensure_ascii', False)
 
@@ -167,7 +256,7 @@ def detect_encoding(data):
     return 'utf-8'
 
 
-def dumps(obj, **kwargs):
+def dumps(obj, *, backend: Optional[str] = None, **kwargs):
     """Serialize ``obj`` to a JSON formatted ``str`` by using the application's
     configured encoder (:attr:`~flask.Flask.json_encoder`) if there is an
     application on the stack.
@@ -176,7 +265,19 @@ def dumps(obj, **kwargs):
     default which coerce into unicode strings automatically.  That behavior by
     default is controlled by the ``JSON_AS_ASCII`` configuration variable
     and can be overridden by the simplejson ``ensure_ascii`` parameter.
+
+    :param backend: json backend name, ``None`` uses the process default.
     """
+    if kwargs.get('sort_keys', _sort_keys) is None:
+        kwargs.pop('sort_keys')
+    json_backend = _resolve_backend(backend)
+    if json_backend.name != 'simplejson' and (not kwargs or kwargs.keys() == {'sort_keys'}):
+        sort_keys = kwargs.get('sort_keys', _sort_keys)
+        try:
+            return json_backend.dumps(obj, sort_keys)
+        except TypeError:
+            # 有些对象只有simplejson支持,比如Decimal和超过64位的整数,使用相同的紧凑格式交给simplejson处理
+            kwargs = {'sort_keys': sort_keys, 'separators': _compact_separators}
     _dump_arg_defaults(kwargs)
     encoding = kwargs.pop('encoding', None)
     rv = json.dumps(obj, **kwargs)
@@ -194,11 +295,17 @@ def dump(obj, fp, **kwargs):
     json.dump(obj, fp, **kwargs)
 
 
-def loads(s, **kwargs):
+def loads(s, *, backend: Optional[str] = None, **kwargs):
     """Unserialize a JSON object from a string ``s`` by using the application's
     configured decoder (:attr:`~flask.Flask.json_decoder`) if there is an
     application on the stack.
+
+    :param backend: json backend name, ``None`` uses the process default.
     """
+    json_backend = _resolve_backend(backend)
+    if json_backend.name != 'simplejson' and not kwargs and (
+            isinstance(s, str) or detect_encoding(s) == 'utf-8'):
+        return json_backend.loads(s)
     _load_arg_defaults(kwargs)
     if isinstance(s, bytes):
         encoding = kwargs.pop('encoding', None)
@@ -254,3 +361,52 @@ def htmlsafe_dumps(obj, **kwargs):
 def htmlsafe_dump(obj, fp, **kwargs):
     """Like :func:`htmlsafe_dumps` but writes into a file object."""
     fp.write(str(htmlsafe_dumps(obj, **kwargs)))
+
+
+def _simplejson_loads(s):
+    if isinstance(s, bytes):
+        s = s.decode(detect_encoding(s))
+    return json.loads(s, cls=JSONDecoder)
+
+
+register_backend('simplejson', lambda obj, sort_keys: json.dumps(
+    obj, sort_keys=sort_keys, cls=JSONEncoder, ensure_ascii=False), _simplejson_loads)
+
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    def _orjson_dumps(obj, sort_keys):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+
+
+    # orjson把超过64位的整数解析为float,包含可能超过64位的整数时交给simplejson解析,保证精度
+    _long_int_bytes = re.compile(rb'\d{19}')
+    _long_int_str = re.compile(r'\d{19}')
+
+
+    def _orjson_loads(s):
+        if (_long_int_str if isinstance(s, str) else _long_int_bytes).search(s):
+            return _simplejson_loads(s)
+        return orjson.loads(s)
+
+
+    register_backend('orjson', _orjson_dumps, _orjson_loads)
+
+try:
+    import ujson
+
+    # 旧版本的ujson不支持default参数,并且会把时间序列化为时间戳
+    ujson.dumps(date.today(), default=_default)
+except (ImportError, TypeError):
+    pass
+else:
+    register_backend('ujson', lambda obj, sort_keys: ujson.dumps(
+        obj, sort_keys=sort_keys, ensure_ascii=False, escape_forward_slashes=False, default=_default), ujson.loads)
+
+# 默认使用simplejson,和之前的版本行为一致,快速的后端需要通过use_backend或者客户端的json_backend显式选择
+use_backend('simplejson')
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 上午10:20
+上传数据源的公共处理,同步和异步的上传共用
+"""
+import os
+from typing import Any, Iterable, Iterator, Optional
+
+__all__ = ("is_path", "is_file", "is_buffer", "upload_length", "iter_buffer", "iter_source", "SizedIterator")
+
+
+def is_path(source: Any) -> bool:
+    """
+    数据源是否是文件路径
+    Args:
+        source: 上传的数据源
+    Returns:
+
+    """
+    return isinstance(source, (str, os.PathLike))
+
+
+def is_file(source: Any) -> bool:
+    """
+    数据源是否是打开的真实文件,只有真实文件才能获取大小和使用sendfile
+    Args:
+        source: 上传的数据源
+    Returns:
+
+    """
+    if not hasattr(source, "read") or not hasattr(source, "fileno"):
+        return False
+    try:
+        source.fileno()
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def is_buffer(source: Any) -> bool:
+    """
+    数据源是否是支持buffer协议的对象,比如bytes、bytearray、memoryview和mmap
+    Args:
+        source: 上传的数据源
+    Returns:
+
+    """
+    try:
+        memoryview(source).release()
+    except TypeError:
+        return False
+    return True
+
+
+def upload_length(source: Any) -> Optional[int]:
+    """
+    获取数据源剩余的字节数,生成器等无法获取大小的返回None
+    Args:
+        source: 上传的数据源
+    Returns:
+
+    """
+    if is_path(source):
+        return os.path.getsize(source)
+    if is_file(source):
+        return max(os.fstat(source.fileno()).st_size - source.tell(), 0)
+    if is_buffer(source):
+        with memoryview(source) as view:
+            return view.nbytes
+    return None
+
+
+def iter_buffer(buffer: Any, chunk_size: int) -> Iterator[memoryview]:
+    """
+    按块迭代buffer对象,使用memoryview切片不会复制数据,mmap不会整体读入内存
+    Args:
+        buffer: 支持buffer协议的对象
+        chunk_size: 每块的字节数
+    Returns:
+
+    """
+    with memoryview(buffer) as view:
+        view = view.cast("B")
+        for offset in range(0, view.nbytes, chunk_size):
+            yield view[offset: offset + chunk_size]
+
+
+def iter_source(source: Any, chunk_size: int) -> Iterator[bytes]:
+    """
+    按块迭代文件路径以外的同步数据源
+    Args:
+        source: 打开的文件或者类文件对象、buffer对象、同步的可迭代对象
+        chunk_size: 每块的字节数,可迭代对象按照其本身的块大小
+    Returns:
+
+    """
+    if is_buffer(source):
+        return iter_buffer(source, chunk_size)
+    if hasattr(source, "read"):
+        return iter(lambda: source.read(chunk_size), b"")
+    return iter(source)
+
+
+class SizedIterator(object):
+    """
+    已知总长度的迭代器,发送时使用Content-Length而不是chunked编码
+    """
+    __slots__ = ["_iterable", "_length"]
+
+    def __init__(self, iterable: Iterable[bytes], length: int):
+        """
+
+        Args:
+            iterable: 数据块的迭代器
+            length: 总字节数
+        """
+        self._iterable = iterable
+        self._length = length
+
+    def __iter__(self, ) -> Iterator[bytes]:
+        return iter(self._iterable)
+
+    def __len__(self, ) -> int:
+        return self._length
@@ -6,6 +6,9 @@
 @software: PyCharm
 @time: 2020/3/2 下午1:48
 """
+from contextlib import ExitStack
+from typing import ContextManager, Dict, Mapping, Sequence, Tuple, Union
+
 from feshttp.err import FuncArgsError
 
 __all__ = ("BaseRequestsMixIn",)
@@ -54,3 +57,36 @@ class BaseRequestsMixIn(object):
         else:
             if not isinstance(self.app, Flask):
                 raise FuncArgsError("app type must be Flask.")
+
+    @staticmethod
+    def _parse_request_spec(spec: Union[Mapping, Sequence]) -> Tuple[str, str, Dict]:
+        """
+        解析批量请求中单个请求的描述
+
+        支持{"method": "GET", "url": url, "params": {...}}的字典形式,method默认为GET,
+        以及(method, url)或者(method, url, kwargs)的元组形式
+        Args:
+            spec: 请求描述
+        Returns:
+            method, url, kwargs
+        """
+        if isinstance(spec, Mapping):
+            kwargs = dict(spec)
+            try:
+                url = kwargs.pop("url")
+            except KeyError:
+                raise FuncArgsError("request spec must have url.")
+            return kwargs.pop("method", "GET"), url, kwargs
+        if isinstance(spec, Sequence) and not isinstance(spec, str) and len(spec) in (2, 3):
+            return spec[0], spec[1], dict(spec[2]) if len(spec) == 3 else {}
+        raise FuncArgsError("request spec must be a dict or a tuple of (method, url[, kwargs]).")
+
+    def _circuit(self, url: str) -> ContextManager:
+        """
+        请求的熔断保护,没有配置熔断器时返回空的上下文管理器
+        Args:
+            url: 请求的URL
+        Returns:
+
+        """
+        return self.circuit_breaker.call(url) if self.circuit_breaker is not None else ExitStack()
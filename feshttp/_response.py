@@ -6,30 +6,77 @@
 @software: PyCharm
 @time: 2020/3/2 下午1:16
 """
-from typing import Dict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
 
-__all__ = ("Response",)
+from ._json import loads
+
+__all__ = ("Response", "StreamResponse", "AIOStreamResponse")
+
+_MISSING = object()
 
 
 class Response(object):
     """
     响应对象,需要重新封装对象
+
+    只保存原始的响应体,json和text在第一次访问时才解析并缓存,没有访问响应体的调用不会有解析的开销
     """
-    __slots__ = ["status_code", "reason", "headers", "cookies", "resp_body", "content"]
+    __slots__ = ["status_code", "reason", "headers", "cookies", "content", "encoding", "json_backend", "_resp_body",
+                 "_text"]
 
-    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *, resp_body: Dict,
-                 content: bytes):
+    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *, resp_body: Any = _MISSING,
+                 content: bytes = b"", encoding: Optional[str] = None, json_backend: Optional[str] = None):
         """
 
         Args:
-
+            resp_body: 已经解析后的响应体,没有提供时根据content解析
+            content: 原始的响应体
+            encoding: 响应体的编码,没有提供时使用utf-8
+            json_backend: 解析响应体的json后端,默认使用进程默认的后端
         """
         self.status_code = status_code
         self.reason = reason
         self.headers = headers
         self.cookies = cookies
-        self.resp_body = resp_body
         self.content = content
+        self.encoding = encoding
+        self.json_backend = json_backend
+        self._resp_body = resp_body
+        self._text = None
+
+    @property
+    def text(self, ) -> str:
+        """
+        响应体的文本,第一次访问时解码
+        Args:
+
+        Returns:
+
+        """
+        if self._text is None:
+            self._text = self.content.decode(self.encoding or "utf-8", errors="replace")
+        return self._text
+
+    @property
+    def resp_body(self, ) -> Any:
+        """
+        解析后的响应体,第一次访问时解析
+
+        优先按照json解析,失败后按照文本解码,都失败时说明是二进制内容,返回空字符串
+        Args:
+
+        Returns:
+
+        """
+        if self._resp_body is _MISSING:
+            try:
+                self._resp_body = loads(self.content, backend=self.json_backend)
+            except (ValueError, TypeError):
+                try:
+                    self._resp_body = self.content.decode(self.encoding or "utf-8")
+                except (UnicodeDecodeError, LookupError):
+                    self._resp_body = ""
+        return self._resp_body
 
     def json(self, ):
         """
@@ -40,3 +87,67 @@ class Response(object):
 
         """
         return self.resp_body
+
+
+class StreamResponse(object):
+    """
+    流式响应对象,响应体按块读取,不在内存中整体缓存
+    """
+    __slots__ = ["status_code", "reason", "headers", "cookies", "_chunks", "_close"]
+
+    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *,
+                 chunks: Iterator[bytes], close: Callable):
+        """
+
+        Args:
+            chunks: 响应体的迭代器
+            close: 释放连接的函数
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.cookies = cookies
+        self._chunks = chunks
+        self._close = close
+
+    def __iter__(self, ) -> Iterator[bytes]:
+        return self._chunks
+
+    def __enter__(self, ) -> 'StreamResponse':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self, ):
+        """
+        释放连接,响应体没有读取完毕时会关闭连接
+        Args:
+
+        Returns:
+
+        """
+        self._close()
+
+
+class AIOStreamResponse(object):
+    """
+    异步流式响应对象,响应体按块读取,不在内存中整体缓存
+    """
+    __slots__ = ["status_code", "reason", "headers", "cookies", "_chunks"]
+
+    def __init__(self, status_code: int, reason: str, headers: Dict, cookies: Dict, *,
+                 chunks: AsyncIterator[bytes]):
+        """
+
+        Args:
+            chunks: 响应体的异步迭代器
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.cookies = cookies
+        self._chunks = chunks
+
+    def __aiter__(self, ) -> AsyncIterator[bytes]:
+        return self._chunks
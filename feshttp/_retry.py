@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午4:05
+请求重试策略,同步和异步的请求以及jrpc client共用
+"""
+import random
+import threading
+import time
+from typing import Any, Iterable, Mapping, Optional
+
+from ._cache import _parse_http_date
+from .err import ClientConnectionError, ClientResponseError, Error
+
+__all__ = ("RetryBudget", "RetryPolicy")
+
+
+class RetryBudget(object):
+    """
+    令牌桶形式的重试预算,限制重试占正常请求的比例,防止下游故障时重试放大流量
+
+    每个请求存入ratio个令牌,每次重试取出一个令牌,没有令牌时不再重试;
+    另外每秒固定补充min_per_second个令牌,保证请求量很小时也能重试
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 10, max_tokens: float = 100):
+        """
+        令牌桶形式的重试预算
+        Args:
+            ratio: 每个请求存入的令牌数,也就是重试请求最多占正常请求的比例
+            min_per_second: 每秒固定补充的令牌数
+            max_tokens: 令牌桶的容量
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, ):
+        """
+        按照时间补充令牌,调用方需要持有锁
+        Args:
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self, ):
+        """
+        请求时存入令牌
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self, ) -> bool:
+        """
+        重试时取出令牌
+        Args:
+
+        Returns:
+            是否还有重试的预算
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self, ) -> float:
+        """
+        当前的令牌数
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RetryPolicy(object):
+    """
+    请求重试策略
+
+    默认只重试幂等的请求方法,连接异常和retry_statuses中的响应状态码会重试,
+    重试间隔使用full jitter的指数退避, 响应中有Retry-After时按照Retry-After等待,
+    所有使用同一个策略的请求共用一个重试预算.
+    jsonrpc请求都是POST,如果调用的方法是幂等的可以使用RetryPolicy(methods=("POST",))
+    """
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, max_retries: int = 3, *, backoff_base: float = 0.1, backoff_max: float = 10,
+                 retry_statuses: Iterable[int] = (429, 502, 503, 504), methods: Iterable[str] = IDEMPOTENT_METHODS,
+                 respect_retry_after: bool = True, retry_after_max: float = 60, budget: RetryBudget = None):
+        """
+        请求重试策略
+        Args:
+            max_retries: 最大重试次数,不包括第一次请求
+            backoff_base: 指数退避的基数,单位秒,第n次重试的等待时间为0到backoff_base * 2 ** n之间的随机数
+            backoff_max: 指数退避的最大等待时间,单位秒
+            retry_statuses: 需要重试的响应状态码
+            methods: 需要重试的请求方法
+            respect_retry_after: 是否按照响应中的Retry-After等待
+            retry_after_max: Retry-After超过这个时间时不再重试,单位秒
+            budget: 重试预算,默认每个策略单独使用一个RetryBudget
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.respect_retry_after = respect_retry_after
+        self.retry_after_max = retry_after_max
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def on_request(self, ):
+        """
+        每个请求第一次发送前调用,存入重试预算
+        Args:
+
+        Returns:
+
+        """
+        self.budget.deposit()
+
+    @staticmethod
+    def is_replayable(data: Any) -> bool:
+        """
+        请求体是否可以重复发送,文件、生成器等流式的请求体发送一次后就被消耗了,不能重试
+        Args:
+            data: 请求体
+        Returns:
+
+        """
+        return data is None or isinstance(data, (str, bytes, bytearray, Mapping))
+
+    def is_retryable(self, method: str, error: Error) -> bool:
+        """
+        请求方法和异常是否可以重试
+        Args:
+            method: 请求方法
+            error: 请求的异常
+        Returns:
+
+        """
+        if method.upper() not in self.methods:
+            return False
+        if isinstance(error, ClientConnectionError):
+            return True
+        return isinstance(error, ClientResponseError) and error.status_code in self.retry_statuses
+
+    def should_retry(self, method: str, error: Error, attempt: int) -> bool:
+        """
+        是否进行重试,可以重试时会消耗一次重试预算
+        Args:
+            method: 请求方法
+            error: 请求的异常
+            attempt: 已经重试的次数
+        Returns:
+
+        """
+        if attempt >= self.max_retries or not self.is_retryable(method, error):
+            return False
+        retry_after = self.retry_after(error)
+        if retry_after is not None and retry_after > self.retry_after_max:
+            return False
+        return self.budget.withdraw()
+
+    def retry_after(self, error: Error) -> Optional[float]:
+        """
+        获取响应中Retry-After要求的等待时间
+        Args:
+            error: 请求的异常
+        Returns:
+            等待的秒数,没有Retry-After时返回None
+        """
+        headers = getattr(error, "headers", None)
+        if not self.respect_retry_after or not headers:
+            return None
+        value = headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            retry_at = _parse_http_date(value)
+            return None if retry_at is None else max(retry_at - time.time(), 0)
+
+    def backoff(self, attempt: int, error: Error = None) -> float:
+        """
+        第attempt次重试前需要等待的时间
+        Args:
+            attempt: 已经重试的次数
+            error: 请求的异常
+        Returns:
+
+        """
+        retry_after = self.retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午9:40
+jrpc client的websocket传输,多个调用复用同一个连接
+"""
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Union
+
+import aelog
+import aiohttp
+
+from ._json import dumps, loads
+from .aio_requests import AIORequests
+from .err import ClientConnectionError
+
+__all__ = ("WSTransport",)
+
+
+class _WSConnection(object):
+    """
+    一个websocket连接,按照id把响应分发给对应的调用
+    """
+
+    def __init__(self, url: str, json_backend: str = None):
+        """
+        一个websocket连接
+        Args:
+            url: websocket的URL
+            json_backend: 序列化和解析消息的json后端,默认使用进程默认的后端
+        """
+        self.url = url
+        self.json_backend = json_backend
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader: Optional[asyncio.Future] = None
+        # 当前连接上等待响应的调用,每次重新连接时使用新的dict,旧连接的读取协程只处理旧连接上的调用
+        self._pending: Dict[Any, asyncio.Future] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def closed(self, ) -> bool:
+        return self.ws is None or self.ws.closed
+
+    async def ensure_connected(self, session: aiohttp.ClientSession, heartbeat: float = None):
+        """
+        连接断开时重新连接,同时只有一个协程在连接
+        Args:
+            session: aiohttp的session
+            heartbeat: 心跳间隔,单位秒
+        Returns:
+
+        """
+        if not self.closed:
+            return
+        async with self._lock:
+            if not self.closed:
+                return
+            try:
+                self.ws = await session.ws_connect(self.url, heartbeat=heartbeat)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                raise ClientConnectionError(url=self.url, message=str(e))
+            self._pending = {}
+            self._reader = asyncio.ensure_future(self._read(self.ws, self._pending))
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse, pending: Dict[Any, asyncio.Future]):
+        """
+        读取响应并分发,连接断开时这个连接上所有等待中的调用都失败
+        Args:
+            ws: websocket连接
+            pending: 这个连接上等待响应的调用
+        Returns:
+
+        """
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    data = loads(msg.data, backend=self.json_backend)
+                except ValueError as e:
+                    aelog.exception(e)
+                    continue
+                for response in data if isinstance(data, list) else [data]:
+                    future = pending.pop(response.get("id"), None)
+                    if future is not None and not future.done():
+                        future.set_result(response)
+        finally:
+            futures = list(pending.values())
+            pending.clear()
+            for future in futures:
+                if not future.done():
+                    future.set_exception(ClientConnectionError(url=self.url, message="websocket closed"))
+
+    async def call(self, jrpc_body: Dict, timeout: float = None) -> Dict:
+        """
+        发送一个请求并等待对应id的响应
+        Args:
+            jrpc_body: 单个jsonrpc请求
+            timeout: 超时时间,单位秒
+        Returns:
+
+        """
+        jrpc_id = jrpc_body["id"]
+        future = asyncio.get_event_loop().create_future()
+        pending = self._pending
+        pending[jrpc_id] = future
+        try:
+            await self.send(jrpc_body)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ClientConnectionError(url=self.url, message="jsonrpc call timed out after {}s".format(timeout))
+        finally:
+            if pending.get(jrpc_id) is future:
+                del pending[jrpc_id]
+
+    async def send(self, jrpc_body: Dict):
+        """
+        发送一个请求或者通知,不等待响应
+        Args:
+            jrpc_body: 单个jsonrpc请求
+        Returns:
+
+        """
+        if self.closed:
+            raise ClientConnectionError(url=self.url, message="websocket closed")
+        try:
+            await self.ws.send_str(dumps(jrpc_body, backend=self.json_backend))
+        except (aiohttp.ClientError, ConnectionError, RuntimeError) as e:
+            raise ClientConnectionError(url=self.url, message=str(e))
+
+    async def close(self, ):
+        """
+        关闭连接
+        Args:
+
+        Returns:
+
+        """
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+
+class WSTransport(object):
+    """
+    jsonrpc的websocket传输
+
+    每个地址保持connections个websocket连接,轮流使用,每个连接上可以同时有多个调用,按照id对应响应.
+    连接断开时等待中的调用抛出ClientConnectionError, 下次调用时自动重新连接.
+    服务端一个消息只处理一个请求,所以批量请求拆分为多个消息发送
+    """
+
+    def __init__(self, aio_requests: AIORequests, *, connections: int = 1, timeout: float = None,
+                 heartbeat: float = 30):
+        """
+        jsonrpc的websocket传输
+        Args:
+            aio_requests: AIORequests实例,使用其中的session建立连接
+            connections: 每个地址的连接数
+            timeout: 每个调用的超时时间,单位秒,默认使用aio_requests的超时时间
+            heartbeat: 心跳间隔,单位秒
+        """
+        self.aio_requests = aio_requests
+        self.connections = max(connections, 1)
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self._pools: Dict[str, List[_WSConnection]] = {}
+        self._counter = itertools.count()
+
+    async def _get_connection(self, url: str) -> _WSConnection:
+        """
+        轮流选择地址的一个连接,断开时重新连接
+        Args:
+            url: websocket的URL
+        Returns:
+
+        """
+        pool = self._pools.get(url)
+        if pool is None:
+            pool = self._pools[url] = [_WSConnection(url, self.aio_requests.json_backend)
+                                       for _ in range(self.connections)]
+        connection = pool[next(self._counter) % len(pool)]
+        await connection.ensure_connected(self.aio_requests.session, self.heartbeat)
+        return connection
+
+    async def request(self, url: str, jrpc_body: Union[Dict, List[Dict]]) -> Union[Dict, List[Dict], None]:
+        """
+        发送单个或者批量的jsonrpc请求
+        Args:
+            url: websocket的URL
+            jrpc_body: json rpc request body
+        Returns:
+            和http请求相同格式的响应,只有通知时返回None
+        """
+        connection = await self._get_connection(url)
+        timeout = self.aio_requests.timeout if self.timeout is None else self.timeout
+        bodies = jrpc_body if isinstance(jrpc_body, list) else [jrpc_body]
+        results = await asyncio.gather(*(
+            connection.call(body, timeout) if "id" in body else connection.send(body) for body in bodies))
+        results = [result for body, result in zip(bodies, results) if "id" in body]
+        if not results:
+            return None
+        return results if isinstance(jrpc_body, list) else results[0]
+
+    async def close(self, ):
+        """
+        关闭所有连接
+        Args:
+
+        Returns:
+
+        """
+        pools, self._pools = self._pools, {}
+        await asyncio.gather(*(connection.close() for pool in pools.values() for connection in pool),
+                             return_exceptions=True)
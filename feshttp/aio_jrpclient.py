@@ -6,9 +6,19 @@
 @software: PyCharm
 @time: 2020/2/21 上午10:17
 """
-import uuid
-from typing import Any, Dict, List, NoReturn, Tuple, Union
+import asyncio
+import itertools
+from typing import Any, Dict, List, NoReturn, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit
 
+import aelog
+
+from ._balancer import Endpoint, LoadBalancer, ROUND_ROBIN
+from ._batcher import MicroBatcher
+from ._hedge import HedgePolicy
+from ._json import dumps
+from ._retry import RetryPolicy
+from ._ws_transport import WSTransport
 from .aio_requests import AIORequests
 from .err import FuncArgsError, JsonRPCError
 
@@ -19,27 +29,111 @@ class AIOJRPClient(object):
     """
     async json rpc client
 
-    暂时不支持单个和批量的通知调用
+    支持单个和批量的通知调用,通知没有id,不等待结果,
+    设置notify_queue_size后可以使用notify_nowait在后台队列中发送通知,关闭前调用flush发送队列中剩余的通知,
+    调用init_app后在sanic的before_server_stop中自动flush并close.
+    id使用进程内递增的整数,http传输时请求体直接拼接为bytes发送,每个方法的前缀只序列化一次
     """
     aio_requests: AIORequests = None
     jrpc_router: str = None
-    jrpc_server_maps: Dict = {}
+    jrpc_server_maps: Dict[str, LoadBalancer] = {}
+    retry_policy: RetryPolicy = None
+    hedge_policy: HedgePolicy = None
+    batch_window: float = None
+    batch_max_size: int = 100
+    split_batch_size: int = None
+    _batchers: Dict[str, MicroBatcher] = {}
+    notify_queue_size: int = 0
+    notify_flush_timeout: float = 5
+    _notify_queue: Optional[asyncio.Queue] = None
+    _notify_worker: Optional[asyncio.Future] = None
+    transport: str = "http"
+    jrpc_ws_router: str = "/api/jrpc/ws"
+    ws_connections: int = 1
+    _ws_transport: Optional[WSTransport] = None
+    _id_counter = itertools.count(1)
+    # 方法名到请求体前缀的缓存,方法名一般是有限的,超过上限后不再缓存
+    _envelope_prefixes: Dict[str, bytes] = {}
+    _envelope_prefixes_max: int = 1024
 
-    def __init__(self, aio_requests: AIORequests, jrpc_server: str = None, jrpc_router: str = "/api/jrpc/post"):
+    def __init__(self, aio_requests: AIORequests, jrpc_server: str = None, jrpc_router: str = "/api/jrpc/post",
+                 retry_policy: RetryPolicy = None, hedge_policy: HedgePolicy = None, batch_window: float = None,
+                 batch_max_size: int = None, notify_queue_size: int = None, transport: str = None,
+                 jrpc_ws_router: str = None, ws_connections: int = None, split_batch_size: int = None):
         """
         async json rpc client
         Args:
             aio_requests: AIORequests class
             jrpc_server: jrpc server name
             jrpc_router: jrpc router
+            retry_policy: jsonrpc请求的重试策略,jsonrpc请求都是POST,只有策略的methods中包含POST时才会重试,
+                默认使用aio_requests的重试策略
+            hedge_policy: done调用的对冲策略,设置后所有的调用都会对冲,只适用于幂等的jsonrpc方法,
+                对冲策略的methods对jsonrpc调用不生效
+            batch_window: 自动合并的时间窗口,单位秒,设置后不同协程对同一个jrpc server的单个方法调用
+                在这个时间内合并为一个批量请求发送,默认不合并
+            batch_max_size: 自动合并时每批最多的调用数,默认100
+            notify_queue_size: 后台通知队列的大小,大于0时可以使用notify_nowait,队列满时丢弃通知,默认0
+            transport: 传输方式, http每个请求一个POST, ws使用复用的websocket长连接, 默认http
+            jrpc_ws_router: jrpc websocket router
+            ws_connections: ws传输时每个地址的websocket连接数,默认1
+            split_batch_size: done()的批量调用超过这个数量时拆分为多个批量请求并发发送,默认不拆分
         """
         if self.__class__.aio_requests is None:
             self.__class__.aio_requests = aio_requests
         if self.__class__.jrpc_router is None:
             self.__class__.jrpc_router = jrpc_router
+        if retry_policy is not None:
+            self.__class__.retry_policy = retry_policy
+        if hedge_policy is not None:
+            self.__class__.hedge_policy = hedge_policy
+        if batch_window is not None:
+            self.__class__.batch_window = batch_window
+        if batch_max_size is not None:
+            self.__class__.batch_max_size = batch_max_size
+        if notify_queue_size is not None:
+            self.__class__.notify_queue_size = notify_queue_size
+        if transport is not None:
+            if transport not in ("http", "ws"):
+                raise FuncArgsError("transport must be http or ws")
+            self.__class__.transport = transport
+        if jrpc_ws_router is not None:
+            self.__class__.jrpc_ws_router = jrpc_ws_router
+        if ws_connections is not None:
+            self.__class__.ws_connections = ws_connections
+        if split_batch_size is not None:
+            if split_batch_size < 1:
+                raise FuncArgsError("split_batch_size must be greater than 0")
+            self.__class__.split_batch_size = split_batch_size
         self.jrpc_server: str = jrpc_server
         self.methods: List[Tuple[str, Union[List, Dict, None]]] = []
 
+    def init_app(self, app, *, notify_flush_timeout: float = None):
+        """
+        在sanic关闭时发送后台队列中剩余的通知并关闭client
+
+        before_server_stop中执行,在aio_requests的after_server_stop关闭session之前
+        Args:
+            app: app应用
+            notify_flush_timeout: 关闭时等待后台通知发送完毕的最长时间,单位秒,默认5秒
+        Returns:
+
+        """
+        self.__class__.notify_flush_timeout = (notify_flush_timeout or app.config.get(
+            "ACLIENTS_JRPC_NOTIFY_FLUSH_TIMEOUT", None) or self.notify_flush_timeout)
+
+        @app.listener('before_server_stop')
+        async def flush_notifications(app_, loop):
+            """
+
+            Args:
+
+            Returns:
+
+            """
+            await self.flush(self.notify_flush_timeout)
+            await self.aclose()
+
     def __getitem__(self, jrpc_server) -> 'AIOJRPClient':
         """
         获取jrpc server
@@ -87,7 +181,7 @@ class AIOJRPClient(object):
         """
         jrpc_body, jrpc_ids = [], []
         for method, params in self.methods:
-            _jrpc_id = uuid.uuid4().hex
+            _jrpc_id = next(self._id_counter)
             _body = {'jsonrpc': '2.0', 'method': method, 'id': _jrpc_id}
             if params:
                 _body['params'] = params
@@ -95,7 +189,12 @@ class AIOJRPClient(object):
             jrpc_body.append(_body)
         jrpc_body = jrpc_body[0] if len(jrpc_body) == 1 else jrpc_body
 
-        rpc_result = await self._jrpc_post(jrpc_body=jrpc_body)
+        if len(self.methods) == 1 and self.batch_window is not None:
+            rpc_result = await self._get_batcher().submit(jrpc_body)
+        elif self.split_batch_size is not None and len(self.methods) > self.split_batch_size:
+            rpc_result = await self._split_dispatch(jrpc_body)
+        else:
+            rpc_result = await self._dispatch(jrpc_body)
 
         if "error" in rpc_result:
             raise JsonRPCError(rpc_result["error"])
@@ -105,29 +204,352 @@ class AIOJRPClient(object):
             rpc_result = {val["id"]: val for val in rpc_result}
             return [rpc_result[jrpc_id].get("result") or rpc_result[jrpc_id]["error"] for jrpc_id in jrpc_ids]
 
+    def _notify_body(self, ) -> Union[Dict, List[Dict]]:
+        """
+        生成通知的请求体,通知没有id
+        Args:
+
+        Returns:
+
+        """
+        jrpc_body = []
+        for method, params in self.methods:
+            _body = {'jsonrpc': '2.0', 'method': method}
+            if params:
+                _body['params'] = params
+            jrpc_body.append(_body)
+        return jrpc_body[0] if len(jrpc_body) == 1 else jrpc_body
+
+    async def notify(self, ) -> NoReturn:
+        """
+        发送单个或者批量的通知,不等待结果,通知不会对冲和自动合并
+        Args:
+
+        Returns:
+
+        """
+        await self._jrpc_post(jrpc_body=self._notify_body())
+
+    def notify_nowait(self, ) -> bool:
+        """
+        把通知放入后台队列发送,立即返回,需要设置notify_queue_size
+        Args:
+
+        Returns:
+            是否放入了队列,队列满时丢弃通知并返回False
+        """
+        if self.notify_queue_size <= 0:
+            raise FuncArgsError("notify_queue_size must be greater than 0 when using notify_nowait")
+        cls = self.__class__
+        if cls._notify_queue is None:
+            # 队列本身不限制大小,每次按照当前的notify_queue_size判断是否已满,修改配置后立即生效
+            cls._notify_queue = asyncio.Queue()
+        if cls._notify_worker is None or cls._notify_worker.done():
+            cls._notify_worker = asyncio.ensure_future(cls._notify_loop())
+        if cls._notify_queue.qsize() >= self.notify_queue_size:
+            aelog.warning("jrpc notify queue is full, drop notification to {}".format(self.jrpc_server))
+            return False
+        cls._notify_queue.put_nowait((self.jrpc_server, self._notify_body()))
+        return True
+
+    @classmethod
+    async def _notify_loop(cls, ):
+        """
+        后台发送队列中的通知,队列中已有的通知按照jrpc server合并为批量请求
+        Args:
+
+        Returns:
+
+        """
+        queue = cls._notify_queue
+        while True:
+            items = [await queue.get()]
+            while not queue.empty() and len(items) < cls.batch_max_size:
+                items.append(queue.get_nowait())
+            jrpc_bodies: Dict[str, List[Dict]] = {}
+            for jrpc_server, jrpc_body in items:
+                jrpc_bodies.setdefault(jrpc_server, []).extend(
+                    jrpc_body if isinstance(jrpc_body, list) else [jrpc_body])
+            results = await asyncio.gather(*(
+                AIOJRPClient(cls.aio_requests, jrpc_server)._jrpc_post(
+                    jrpc_body=jrpc_body[0] if len(jrpc_body) == 1 else jrpc_body)
+                for jrpc_server, jrpc_body in jrpc_bodies.items()), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    aelog.exception(result)
+            for _ in items:
+                queue.task_done()
+
+    @classmethod
+    async def flush(cls, timeout: float = None) -> bool:
+        """
+        等待后台队列中的通知发送完毕,应该在关闭aio_requests的session之前调用,比如sanic的before_server_stop
+        Args:
+            timeout: 最多等待的时间,单位秒,默认一直等待
+        Returns:
+            是否全部发送完毕
+        """
+        if cls._notify_queue is None:
+            return True
+        try:
+            await asyncio.wait_for(cls._notify_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            aelog.warning("jrpc notify queue flush timeout, {} left".format(cls._notify_queue.qsize()))
+            return False
+        return True
+
+    async def _dispatch(self, jrpc_body: Union[Dict, List]) -> Union[Dict, List]:
+        """
+        发送jsonrpc请求,有对冲策略时对冲
+        Args:
+            jrpc_body: json rpc request body
+        Returns:
+
+        """
+        if self.hedge_policy is not None:
+            # 对冲请求尽量发送到其他地址
+            used: List[Endpoint] = []
+            return await self.hedge_policy.run(lambda attempt: self._jrpc_post(jrpc_body=jrpc_body, exclude=used))
+        return await self._jrpc_post(jrpc_body=jrpc_body)
+
+    def _get_batcher(self, ) -> MicroBatcher:
+        """
+        获取jrpc server的微批处理,第一次使用时创建,已有的微批处理使用当前的batch_window和batch_max_size
+        Args:
+
+        Returns:
+
+        """
+        batcher = self._batchers.get(self.jrpc_server)
+        if batcher is None:
+            batcher = self._batchers[self.jrpc_server] = MicroBatcher(
+                AIOJRPClient(self.aio_requests, self.jrpc_server)._send_batch, window=self.batch_window,
+                max_size=self.batch_max_size)
+        else:
+            batcher.window, batcher.max_size = self.batch_window, self.batch_max_size
+        return batcher
+
+    async def _send_batch(self, jrpc_bodies: List[Dict]) -> List[Dict]:
+        """
+        把合并的单个调用作为一个批量请求发送,按照id分发响应
+        Args:
+            jrpc_bodies: 单个调用的请求体
+        Returns:
+            和请求体顺序对应的响应
+        """
+        return self._fan_out(jrpc_bodies, await self._dispatch(jrpc_bodies))
+
+    @staticmethod
+    def _fan_out(jrpc_bodies: List[Dict], rpc_result: Union[Dict, List[Dict]]) -> List[Dict]:
+        """
+        按照id把批量请求的响应对应到每个调用
+        Args:
+            jrpc_bodies: 单个调用的请求体
+            rpc_result: 批量请求的响应
+        Returns:
+            和请求体顺序对应的响应
+        """
+        # 整个批量请求错误时,比如解析错误,所有调用都返回这个错误
+        if isinstance(rpc_result, dict):
+            return [rpc_result] * len(jrpc_bodies)
+        rpc_result = {val.get("id"): val for val in rpc_result}
+        missing = {"code": -32603, "message": "Internal error", "data": "missing response in batch"}
+        return [rpc_result.get(body["id"]) or {"jsonrpc": "2.0", "id": body["id"], "error": missing}
+                for body in jrpc_bodies]
+
+    async def _split_dispatch(self, jrpc_body: List[Dict]) -> List[Dict]:
+        """
+        把批量请求按照split_batch_size拆分后并发发送,再按照调用的顺序合并响应,
+        某个子批量请求失败时,其中的每个调用都返回包含子批量序号和异常信息的错误
+        Args:
+            jrpc_body: json rpc request body
+        Returns:
+            和请求体顺序对应的响应
+        """
+        size = self.split_batch_size
+        chunks = [jrpc_body[i:i + size] for i in range(0, len(jrpc_body), size)]
+        results = await asyncio.gather(*(self._dispatch(chunk) for chunk in chunks), return_exceptions=True)
+        rpc_result = []
+        for index, (chunk, result) in enumerate(zip(chunks, results)):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                error = {"code": -32603, "message": "Internal error",
+                         "data": "sub batch {}/{} failed: {!r}".format(index + 1, len(chunks), result)}
+                rpc_result.extend({"jsonrpc": "2.0", "id": body["id"], "error": error} for body in chunk)
+            else:
+                rpc_result.extend(self._fan_out(chunk, result))
+        return rpc_result
+
+    @staticmethod
+    def _parse_address(jrpc_address: Union[str, Tuple[str, int]]) -> Tuple[str, int]:
+        """
+        解析单个地址
+        Args:
+            jrpc_address: (host, port)或者"host:port"
+        Returns:
+            (host, port)
+        """
+        if isinstance(jrpc_address, str):
+            host, _, port = jrpc_address.rpartition(":")
+            if host and port.isdigit():
+                return host, int(port)
+        elif isinstance(jrpc_address, (tuple, list)) and len(jrpc_address) == 2:
+            return jrpc_address[0], jrpc_address[1]
+        raise FuncArgsError("jrpc_address value error")
+
     @classmethod
-    def register(cls, jrpc_server: str, jrpc_address: Tuple[str, int]) -> NoReturn:
+    def register(cls, jrpc_server: str, jrpc_address: Union[Tuple[str, int], Sequence[Tuple[str, int]]], *,
+                 strategy: str = ROUND_ROBIN, **kwargs) -> NoReturn:
         """
         注册jrpc server 名称和地址
         Args:
             jrpc_server: json rpc server name
-            jrpc_address: json rpc server address, eg: 127.0.0.1:8000
+            jrpc_address: json rpc server address, eg: ("127.0.0.1", 8000),
+                多个地址时为地址的列表, eg: [("127.0.0.1", 8000), "127.0.0.1:8001"]
+            strategy: 多个地址的负载均衡策略, round_robin, least_outstanding或者p2c_ewma
+            kwargs: LoadBalancer的异常剔除和健康检查参数, eg: health_check_interval=5, consecutive_errors=5
         Returns:
 
         """
         if not isinstance(jrpc_address, (tuple, list)):
             raise FuncArgsError("jrpc_address value error")
+        # 兼容单个地址的(host, port)形式
+        if len(jrpc_address) == 2 and isinstance(jrpc_address[0], str) and (
+                isinstance(jrpc_address[1], int) or str(jrpc_address[1]).isdigit()):
+            jrpc_address = [jrpc_address]
 
         if jrpc_server not in cls.jrpc_server_maps:
-            cls.jrpc_server_maps[jrpc_server] = f"http://{jrpc_address[0]}:{jrpc_address[1]}{cls.jrpc_router}"
+            endpoints = []
+            for host, port in (cls._parse_address(address) for address in jrpc_address):
+                endpoints.append(Endpoint(f"http://{host}:{port}{cls.jrpc_router}", f"{host}:{port}"))
+            cls.jrpc_server_maps[jrpc_server] = LoadBalancer(endpoints, strategy, **kwargs)
+
+    @classmethod
+    def health(cls, ) -> Dict[str, List[Dict]]:
+        """
+        所有jrpc server地址的健康状态和统计信息
+        Args:
+
+        Returns:
+            {jrpc_server: [地址的状态]}
+        """
+        return {jrpc_server: balancer.snapshot() for jrpc_server, balancer in cls.jrpc_server_maps.items()}
+
+    @classmethod
+    def close(cls, ) -> NoReturn:
+        """
+        停止所有jrpc server的后台健康检查和后台通知队列,只重置状态,不关闭websocket连接,
+        队列中没有发送的通知会被丢弃,需要先调用flush.
+        websocket连接需要使用aclose关闭,或者在关闭aio_requests的session时一起关闭
+        Args:
+
+        Returns:
+
+        """
+        for balancer in cls.jrpc_server_maps.values():
+            balancer.close()
+        if cls._notify_worker is not None:
+            cls._notify_worker.cancel()
+            cls._notify_worker = None
+        cls._notify_queue = None
+        cls._ws_transport = None
+
+    @classmethod
+    async def aclose(cls, ):
+        """
+        和close相同,并关闭websocket连接
+        Args:
+
+        Returns:
+
+        """
+        ws_transport, cls._ws_transport = cls._ws_transport, None
+        cls.close()
+        if ws_transport is not None:
+            await ws_transport.close()
+
+    def _ws_url(self, endpoint: Endpoint) -> str:
+        """
+        地址的websocket URL
+        Args:
+            endpoint: 地址
+        Returns:
+
+        """
+        url = urlsplit(endpoint.url)
+        return "{}://{}{}".format("wss" if url.scheme == "https" else "ws", url.netloc, self.jrpc_ws_router)
+
+    def _get_ws_transport(self, ) -> WSTransport:
+        """
+        获取websocket传输,第一次使用时创建
+        Args:
+
+        Returns:
+
+        """
+        cls = self.__class__
+        if cls._ws_transport is None:
+            cls._ws_transport = WSTransport(self.aio_requests, connections=self.ws_connections)
+        return cls._ws_transport
+
+    @classmethod
+    def _envelope_prefix(cls, method: str) -> bytes:
+        """
+        方法的请求体前缀, eg: b'{"jsonrpc":"2.0","method":"sub"'
+        Args:
+            method: jsonrpc方法名
+        Returns:
+
+        """
+        prefix = cls._envelope_prefixes.get(method)
+        if prefix is None:
+            prefix = b'{"jsonrpc":"2.0","method":' + dumps(method).encode()
+            if len(cls._envelope_prefixes) < cls._envelope_prefixes_max:
+                cls._envelope_prefixes[method] = prefix
+        return prefix
+
+    @classmethod
+    def _encode_body(cls, jrpc_body: Union[Dict, List[Dict]]) -> bytes:
+        """
+        把请求体编码为bytes,只序列化id和params,其余部分使用缓存的前缀
+        Args:
+            jrpc_body: json rpc request body
+        Returns:
+
+        """
+        if isinstance(jrpc_body, list):
+            return b"[" + b",".join(cls._encode_body(body) for body in jrpc_body) + b"]"
+        # 和aio_requests使用相同的json后端
+        backend = None if cls.aio_requests is None else cls.aio_requests.json_backend
+        parts = [cls._envelope_prefix(jrpc_body["method"])]
+        if "id" in jrpc_body:
+            jrpc_id = jrpc_body["id"]
+            parts.append(b',"id":' + (str(jrpc_id) if type(jrpc_id) is int else dumps(
+                jrpc_id, backend=backend)).encode())
+        if "params" in jrpc_body:
+            parts.append(b',"params":' + dumps(jrpc_body["params"], backend=backend).encode())
+        parts.append(b"}")
+        return b"".join(parts)
 
-    async def _jrpc_post(self, *, jrpc_body: Dict) -> Union[Dict, List]:
+    async def _jrpc_post(self, *, jrpc_body: Dict, exclude: List[Endpoint] = None) -> Union[Dict, List]:
         """
         jsonrpc request
         Args:
             jrpc_body: json rpc request body
+            exclude: 尽量不使用的地址,选择的地址会添加到其中
         Returns:
 
         """
-        rpc_result = await self.aio_requests.async_post(self.jrpc_server_maps[self.jrpc_server], json=jrpc_body)
-        return rpc_result.json()
+        balancer = self.jrpc_server_maps[self.jrpc_server]
+        balancer.start_health_check()
+        endpoint = balancer.pick(exclude or ())
+        if exclude is not None:
+            exclude.append(endpoint)
+        with balancer.track(endpoint):
+            if self.transport == "ws":
+                return await self._get_ws_transport().request(self._ws_url(endpoint), jrpc_body)
+            rpc_result = await self.aio_requests.async_post(
+                endpoint.url, data=self._encode_body(jrpc_body), headers={"Content-Type": "application/json"},
+                retry_policy=self.retry_policy)
+            return rpc_result.json()
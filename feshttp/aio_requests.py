@@ -8,20 +8,104 @@
 """
 import asyncio
 import atexit
-from typing import Dict
+import functools
+from typing import (Any, AsyncIterator, BinaryIO, Callable, Coroutine, Dict, Hashable, Iterable, List, Mapping,
+                    Optional, Sequence, Set, Tuple, Union)
 
 import aelog
 import aiohttp
+from aiohttp import payload
 
 from ._err_msg import http_msg
-from ._json import dumps, loads
+from ._breaker import CircuitBreaker
+from ._cache import FRESH, HttpCache, REVALIDATE, STALE
+from ._hedge import HedgePolicy
+from ._json import dumps, get_backend
+from ._payload import is_file, is_path, iter_source, upload_length
 from ._requests import BaseRequestsMixIn
-from ._response import Response
+from ._response import AIOStreamResponse, Response
+from ._retry import RetryPolicy
 from .err import ClientConnectionError, ClientError, ClientResponseError, HttpError
 from .utils import Singleton, _verify_message
 
 __all__ = ("AIORequests",)
 
+# python3.7之前没有SendfileNotAvailableError
+_SendfileNotAvailableError = getattr(asyncio, "SendfileNotAvailableError", NotImplementedError)
+
+
+class _FilePayload(payload.Payload):
+    """
+    文件上传的payload
+
+    非chunked、非压缩的明文连接使用os.sendfile发送,数据不经过用户空间,否则在线程池中按块读取发送
+    """
+
+    def __init__(self, value: BinaryIO, *, size: int, chunk_size: int, **kwargs):
+        """
+
+        Args:
+            value: 打开的文件
+            size: 从当前位置开始上传的字节数,在线程池中获取,避免在事件循环中stat文件
+            chunk_size: 不能使用sendfile时每次读取发送的字节数
+        """
+        super().__init__(value, **kwargs)
+        self._chunk_size = chunk_size
+        self._offset = value.tell()
+        self._size = size
+
+    async def write(self, writer) -> None:
+        loop = asyncio.get_event_loop()
+        transport = writer.transport
+        if (hasattr(loop, "sendfile") and transport is not None and not writer.chunked and
+                getattr(writer, "_compress", None) is None):
+            try:
+                await loop.sendfile(transport, self._value, self._offset, self._size, fallback=False)
+            except _SendfileNotAvailableError:
+                # 不支持sendfile时还没有发送任何数据,比如ssl连接
+                pass
+            else:
+                return
+
+        self._value.seek(self._offset)
+        while True:
+            chunk = await loop.run_in_executor(None, self._value.read, self._chunk_size)
+            if not chunk:
+                break
+            await writer.write(chunk)
+
+
+class _StreamContextManager(object):
+    """
+    流式请求的上下文管理器
+    """
+    __slots__ = ["_send_coro", "_url", "_chunk_size", "_iter_chunks", "_resp"]
+
+    def __init__(self, send_coro: Coroutine, url: str, chunk_size: int, iter_chunks: Callable):
+        """
+
+        Args:
+            send_coro: 发送请求的coroutine
+            url: request url
+            chunk_size: 每次读取的字节数
+            iter_chunks: 按块读取响应体的函数
+        """
+        self._send_coro = send_coro
+        self._url = url
+        self._chunk_size = chunk_size
+        self._iter_chunks = iter_chunks
+        self._resp = None
+
+    async def __aenter__(self, ) -> AIOStreamResponse:
+        self._resp = resp = await self._send_coro
+        return AIOStreamResponse(resp.status, resp.reason, resp.headers, resp.cookies,
+                                 chunks=self._iter_chunks(resp, self._url, self._chunk_size))
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # 响应体读取完毕时连接归还连接池,没有读取完毕时关闭连接
+        if self._resp is not None:
+            self._resp.release()
+
 
 class AIORequests(BaseRequestsMixIn, Singleton):
     """
@@ -29,7 +113,12 @@ class AIORequests(BaseRequestsMixIn, Singleton):
     """
 
     def __init__(self, app=None, *, timeout: int = 5 * 60, verify_ssl: bool = True, message: Dict = None,
-                 use_zh: bool = True, cookiejar_unsafe: bool = False):
+                 use_zh: bool = True, cookiejar_unsafe: bool = False, limit: int = 100, limit_per_host: int = 0,
+                 keepalive_timeout: float = 15, ttl_dns_cache: int = 10, force_close: bool = False,
+                 json_backend: str = None, json_sort_keys: bool = None, cache_maxsize: int = 0,
+                 cache_maxentries: int = 1024, single_flight: bool = False, single_flight_headers: Sequence[str] = (),
+                 single_flight_key: Callable[..., Hashable] = None, retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None, hedge_policy: HedgePolicy = None):
         """
         基于aiohttp的异步封装
         Args:
@@ -39,6 +128,21 @@ class AIORequests(BaseRequestsMixIn, Singleton):
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
             cookiejar_unsafe: 是否打开cookiejar的非严格模式，默认false
+            limit: 连接池总的连接数限制，0为不限制，默认100
+            limit_per_host: 连接池中每个host的连接数限制，0为不限制，默认0
+            keepalive_timeout: 空闲连接保持时间，单位秒，默认15
+            ttl_dns_cache: DNS缓存时间，单位秒，None为永久缓存，默认10
+            force_close: 是否每次请求后关闭连接，打开后keepalive_timeout失效，默认false
+            json_backend: json序列化后端, orjson, ujson, simplejson或者auto, 默认使用进程默认的后端simplejson
+            json_sort_keys: json序列化时是否对key排序，默认true
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存，默认0不开启
+            cache_maxentries: GET请求响应缓存的最大个数，默认1024
+            single_flight: 是否合并同时发起的相同的GET请求，合并后只发起一次请求，所有调用方得到同一个响应，默认false
+            single_flight_headers: 合并请求时key中包含的请求头，默认只使用method、url和params
+            single_flight_key: 自定义合并请求的key, 参数为method, url, params, headers, 返回可hash的值
+            retry_policy: 请求的重试策略，默认不重试，可以和其他client共用同一个策略和重试预算
+            circuit_breaker: 按照host的熔断器，默认不熔断，可以和其他client共用同一个熔断器
+            hedge_policy: 幂等请求的对冲策略，默认不对冲
         """
         self.app = app
         self.session = None
@@ -50,13 +154,43 @@ class AIORequests(BaseRequestsMixIn, Singleton):
         # 默认clientsession使用严格版本的cookiejar, 禁止ip地址的访问共享cookie
         # 如果访问的是ip地址的URL，并且需要保持cookie则需要打开
         self.cookiejar_unsafe = cookiejar_unsafe
+        # 连接池配置
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.force_close = force_close
+        # json序列化配置
+        self.json_backend = json_backend
+        self.json_sort_keys = json_sort_keys
+        # GET请求响应缓存,可以直接设置为HttpCache实例和其他client共用
+        self.cache_maxentries = cache_maxentries
+        self.cache: Optional[HttpCache] = HttpCache(cache_maxsize, cache_maxentries) if cache_maxsize else None
+        # 合并相同的GET请求
+        self.single_flight = single_flight
+        self.single_flight_headers = tuple(single_flight_headers)
+        self.single_flight_key = single_flight_key or self._single_flight_key
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        # stale-while-revalidate后台校验的task,保存引用防止执行中被回收
+        self._revalidate_tasks: Set[asyncio.Future] = set()
+        # 重试策略,请求时也可以通过retry_policy参数单独指定
+        self.retry_policy = retry_policy
+        # 按照host的熔断器
+        self.circuit_breaker = circuit_breaker
+        # 对冲策略,请求时也可以通过hedge_policy参数单独指定
+        self.hedge_policy = hedge_policy
 
         if app is not None:
             self.init_app(app, timeout=self.timeout, verify_ssl=self.verify_ssl, message=self.message,
                           use_zh=self.use_zh)
 
     def init_app(self, app, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                 use_zh: bool = None):
+                 use_zh: bool = None, limit: int = None, limit_per_host: int = None, keepalive_timeout: float = None,
+                 ttl_dns_cache: int = None, force_close: bool = None, json_backend: str = None,
+                 json_sort_keys: bool = None, cache_maxsize: int = None, cache_maxentries: int = None,
+                 single_flight: bool = None, single_flight_headers: Sequence[str] = None,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None,
+                 hedge_policy: HedgePolicy = None):
         """
         基于aiohttp的异步封装
         Args:
@@ -65,6 +199,20 @@ class AIORequests(BaseRequestsMixIn, Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            limit: 连接池总的连接数限制，0为不限制
+            limit_per_host: 连接池中每个host的连接数限制，0为不限制
+            keepalive_timeout: 空闲连接保持时间，单位秒
+            ttl_dns_cache: DNS缓存时间，单位秒
+            force_close: 是否每次请求后关闭连接
+            json_backend: json序列化后端
+            json_sort_keys: json序列化时是否对key排序
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存
+            cache_maxentries: GET请求响应缓存的最大个数
+            single_flight: 是否合并同时发起的相同的GET请求
+            single_flight_headers: 合并请求时key中包含的请求头
+            retry_policy: 请求的重试策略
+            circuit_breaker: 按照host的熔断器
+            hedge_policy: 幂等请求的对冲策略
         Returns:
 
         """
@@ -78,6 +226,32 @@ class AIORequests(BaseRequestsMixIn, Singleton):
         self.message = _verify_message(http_msg, message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
 
+        self.limit = limit or app.config.get("ACLIENTS_HTTP_LIMIT", None) or self.limit
+        self.limit_per_host = limit_per_host or app.config.get(
+            "ACLIENTS_HTTP_LIMIT_PER_HOST", None) or self.limit_per_host
+        self.keepalive_timeout = keepalive_timeout or app.config.get(
+            "ACLIENTS_HTTP_KEEPALIVE_TIMEOUT", None) or self.keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache or app.config.get("ACLIENTS_HTTP_DNS_CACHE_TTL", None) or self.ttl_dns_cache
+        self.force_close = force_close or app.config.get("ACLIENTS_HTTP_FORCE_CLOSE", None) or self.force_close
+        self.json_backend = json_backend or app.config.get("ACLIENTS_HTTP_JSON_BACKEND", None) or self.json_backend
+        if json_sort_keys is None:
+            json_sort_keys = app.config.get("ACLIENTS_HTTP_JSON_SORT_KEYS", None)
+        self.json_sort_keys = self.json_sort_keys if json_sort_keys is None else json_sort_keys
+        # 校验后端是否可用,每个客户端使用自己的后端,不修改进程默认的后端
+        get_backend(self.json_backend)
+        cache_maxsize = cache_maxsize or app.config.get("ACLIENTS_HTTP_CACHE_MAXSIZE", None)
+        self.cache_maxentries = cache_maxentries or app.config.get(
+            "ACLIENTS_HTTP_CACHE_MAXENTRIES", None) or self.cache_maxentries
+        if cache_maxsize and self.cache is None:
+            self.cache = HttpCache(cache_maxsize, self.cache_maxentries)
+        self.single_flight = single_flight or app.config.get("ACLIENTS_HTTP_SINGLE_FLIGHT", None) or self.single_flight
+        self.single_flight_headers = tuple(single_flight_headers or app.config.get(
+            "ACLIENTS_HTTP_SINGLE_FLIGHT_HEADERS", None) or self.single_flight_headers)
+        self.retry_policy = retry_policy or app.config.get("ACLIENTS_HTTP_RETRY_POLICY", None) or self.retry_policy
+        self.circuit_breaker = circuit_breaker or app.config.get(
+            "ACLIENTS_HTTP_CIRCUIT_BREAKER", None) or self.circuit_breaker
+        self.hedge_policy = hedge_policy or app.config.get("ACLIENTS_HTTP_HEDGE_POLICY", None) or self.hedge_policy
+
         @app.listener('before_server_start')
         async def open_connection(app_, loop):
             """
@@ -87,8 +261,7 @@ class AIORequests(BaseRequestsMixIn, Singleton):
             Returns:
 
             """
-            jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
-            self.session = aiohttp.ClientSession(loop=loop, cookie_jar=jar, json_serialize=dumps)
+            self.session = self._create_session(loop=loop)
 
         @app.listener('after_server_stop')
         async def close_connection(app_, loop):
@@ -103,7 +276,12 @@ class AIORequests(BaseRequestsMixIn, Singleton):
                 await self.session.close()
 
     def init_session(self, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                     use_zh: bool = None):
+                     use_zh: bool = None, limit: int = None, limit_per_host: int = None,
+                     keepalive_timeout: float = None, ttl_dns_cache: int = None, force_close: bool = None,
+                     json_backend: str = None, json_sort_keys: bool = None, cache_maxsize: int = None,
+                     cache_maxentries: int = None, single_flight: bool = None,
+                     single_flight_headers: Sequence[str] = None, retry_policy: RetryPolicy = None,
+                     circuit_breaker: CircuitBreaker = None, hedge_policy: HedgePolicy = None):
         """
         基于aiohttp的异步封装
         Args:
@@ -111,6 +289,20 @@ class AIORequests(BaseRequestsMixIn, Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            limit: 连接池总的连接数限制，0为不限制
+            limit_per_host: 连接池中每个host的连接数限制，0为不限制
+            keepalive_timeout: 空闲连接保持时间，单位秒
+            ttl_dns_cache: DNS缓存时间，单位秒
+            force_close: 是否每次请求后关闭连接
+            json_backend: json序列化后端
+            json_sort_keys: json序列化时是否对key排序
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存
+            cache_maxentries: GET请求响应缓存的最大个数
+            single_flight: 是否合并同时发起的相同的GET请求
+            single_flight_headers: 合并请求时key中包含的请求头
+            retry_policy: 请求的重试策略
+            circuit_breaker: 按照host的熔断器
+            hedge_policy: 幂等请求的对冲策略
         Returns:
 
         """
@@ -119,6 +311,23 @@ class AIORequests(BaseRequestsMixIn, Singleton):
         use_zh = use_zh or self.use_zh
         self.message = _verify_message(http_msg, message or self.message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
+        self.limit = limit or self.limit
+        self.limit_per_host = limit_per_host or self.limit_per_host
+        self.keepalive_timeout = keepalive_timeout or self.keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache or self.ttl_dns_cache
+        self.force_close = force_close or self.force_close
+        self.json_backend = json_backend or self.json_backend
+        self.json_sort_keys = self.json_sort_keys if json_sort_keys is None else json_sort_keys
+        # 校验后端是否可用,每个客户端使用自己的后端,不修改进程默认的后端
+        get_backend(self.json_backend)
+        self.cache_maxentries = cache_maxentries or self.cache_maxentries
+        if cache_maxsize and self.cache is None:
+            self.cache = HttpCache(cache_maxsize, self.cache_maxentries)
+        self.single_flight = single_flight or self.single_flight
+        self.single_flight_headers = tuple(single_flight_headers or self.single_flight_headers)
+        self.retry_policy = retry_policy or self.retry_policy
+        self.circuit_breaker = circuit_breaker or self.circuit_breaker
+        self.hedge_policy = hedge_policy or self.hedge_policy
         loop = asyncio.get_event_loop()
 
         async def open_connection():
@@ -129,8 +338,7 @@ class AIORequests(BaseRequestsMixIn, Singleton):
             Returns:
 
             """
-            jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
-            self.session = aiohttp.ClientSession(cookie_jar=jar, json_serialize=dumps)
+            self.session = self._create_session()
 
         async def close_connection():
             """
@@ -146,11 +354,28 @@ class AIORequests(BaseRequestsMixIn, Singleton):
         loop.run_until_complete(open_connection())
         atexit.register(lambda: loop.run_until_complete(close_connection()))
 
-    async def _request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
-                       json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
-                       **kwargs) -> Response:
+    def _create_session(self, loop=None) -> aiohttp.ClientSession:
         """
+        按照连接池配置创建session
+        Args:
+            loop: event loop
+        Returns:
 
+        """
+        jar = aiohttp.CookieJar(unsafe=self.cookiejar_unsafe)
+        # force_close和keepalive_timeout不能同时设置
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=None if self.force_close else self.keepalive_timeout,
+                                         ttl_dns_cache=self.ttl_dns_cache, force_close=self.force_close)
+        return aiohttp.ClientSession(loop=loop, connector=connector, cookie_jar=jar,
+                                     json_serialize=functools.partial(
+                                         dumps, backend=self.json_backend, sort_keys=self.json_sort_keys))
+
+    async def _send(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                    json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                    **kwargs) -> aiohttp.ClientResponse:
+        """
+        发送请求并校验响应状态,异常统一转换为本库的异常,响应体由调用方读取
         Args:
             method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
         Returns:
@@ -216,44 +441,445 @@ class AIORequests(BaseRequestsMixIn, Singleton):
         get_resp = {"GET": _async_get, "POST": _async_post, "PUT": _async_put, "DELETE": _async_delete,
                     "PATCH": _async_patch}
         resp = None
-        try:
-            resp = await get_resp[method.upper()]()
-            resp.raise_for_status()
-        except KeyError as e:
-            raise ClientError(url=url, message="error method {0}".format(str(e)))
-        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
-            raise ClientConnectionError(url=url, message=str(e))
-        except aiohttp.ClientResponseError as e:
+        with self._circuit(url):
+            try:
+                resp = await get_resp[method.upper()]()
+                if resp.status >= 400:
+                    # 新版本的aiohttp在raise_for_status时会释放连接,所以先读取错误的响应体
+                    await resp.read()
+                resp.raise_for_status()
+            except KeyError as e:
+                raise ClientError(url=url, message="error method {0}".format(str(e)))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                raise ClientConnectionError(url=url, message=str(e))
+            except aiohttp.ClientResponseError as e:
+                try:
+                    resp_data = await resp.json() if resp else ""
+                except (ValueError, TypeError, aiohttp.ContentTypeError):
+                    resp_data = await resp.text() if resp else ""
+                raise ClientResponseError(url=url, status_code=e.status, message=e.message, headers=e.headers,
+                                          body=resp_data)
+            except aiohttp.ClientError as e:
+                raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+        return resp
+
+    async def _fetch(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                     json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                     hedge_policy: HedgePolicy = None, **kwargs) -> Response:
+        """
+        发送请求并读取整个响应体,有对冲策略时按照策略对冲,对冲的每个请求单独重试
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            hedge_policy: 本次请求的对冲策略,默认使用全局的对冲策略
+        Returns:
+
+        """
+        hedge_policy = hedge_policy or self.hedge_policy
+        if hedge_policy is None or not hedge_policy.is_hedgeable(method, data):
+            return await self._retry_fetch(method, url, params=params, data=data, json=json, headers=headers,
+                                           timeout=timeout, verify_ssl=verify_ssl, **kwargs)
+        return await hedge_policy.run(lambda attempt: self._retry_fetch(
+            method, url, params=params, data=data, json=json, headers=headers, timeout=timeout,
+            verify_ssl=verify_ssl, **kwargs))
+
+    async def _retry_fetch(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                           json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                           retry_policy: RetryPolicy = None, **kwargs) -> Response:
+        """
+        发送请求并读取整个响应体,有重试策略时按照策略重试
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            retry_policy: 本次请求的重试策略,默认使用全局的重试策略
+        Returns:
+
+        """
+        retry_policy = retry_policy or self.retry_policy
+        if retry_policy is None or not retry_policy.is_replayable(data):
+            return await self._fetch_once(method, url, params=params, data=data, json=json, headers=headers,
+                                          timeout=timeout, verify_ssl=verify_ssl, **kwargs)
+        retry_policy.on_request()
+        attempt = 0
+        while True:
             try:
-                resp_data = await resp.json() if resp else ""
-            except (ValueError, TypeError, aiohttp.ContentTypeError):
-                resp_data = await resp.text() if resp else ""
-            raise ClientResponseError(url=url, status_code=e.status, message=e.message, headers=e.headers,
-                                      body=resp_data)
-        except aiohttp.ClientError as e:
-            raise ClientError(url=url, message="aiohttp.ClientError: {}".format(vars(e)))
+                return await self._fetch_once(method, url, params=params, data=data, json=json, headers=headers,
+                                              timeout=timeout, verify_ssl=verify_ssl, **kwargs)
+            except (ClientConnectionError, ClientResponseError) as e:
+                if not retry_policy.should_retry(method, e, attempt):
+                    raise
+                delay = retry_policy.backoff(attempt, e)
+                attempt += 1
+                aelog.warning("retry {} {} after {:.3f}s, attempt {}: {!r}".format(method, url, delay, attempt, e))
+                await asyncio.sleep(delay)
+
+    async def _fetch_once(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                          json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                          **kwargs) -> Response:
+        """
+        发送一次请求并读取整个响应体
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        resp = await self._send(method, url, params=params, data=data, json=json, headers=headers, timeout=timeout,
+                                verify_ssl=verify_ssl, **kwargs)
 
         async with resp:
             try:
-                resp_json = await resp.json(loads=loads)
-            except (ValueError, TypeError, aiohttp.ContentTypeError):
-                try:
-                    resp_text = await resp.text()
-                except (ValueError, TypeError):
-                    try:
-                        resp_bytes = await resp.read()
-                    except (aiohttp.ClientResponseError, aiohttp.ClientError) as e:
-                        aelog.exception(e)
-                        raise HttpError(e.code, message=self.message[200][self.msg_zh], error=e)
-                    else:
-                        return Response(resp.status, resp.reason, resp.headers, resp.cookies, resp_body="",
-                                        content=resp_bytes)
-                else:
-                    return Response(resp.status, resp.reason, resp.headers, resp.cookies, resp_body=resp_text,
-                                    content=b"")
+                resp_bytes = await resp.read()
+            except (aiohttp.ClientResponseError, aiohttp.ClientError) as e:
+                aelog.exception(e)
+                raise HttpError(e.code, message=self.message[200][self.msg_zh], error=e)
             else:
-                return Response(resp.status, resp.reason, resp.headers, resp.cookies, resp_body=resp_json,
-                                content=b"")
+                return Response(resp.status, resp.reason, resp.headers, resp.cookies, content=resp_bytes,
+                                encoding=resp.charset, json_backend=self.json_backend)
+
+    async def _revalidate(self, key: str, entry, method: str, url: str, *, params: Dict = None,
+                          headers: Dict = None, **kwargs) -> Response:
+        """
+        带条件请求重新校验缓存
+        Args:
+            key: 缓存的key
+            entry: 缓存项
+            method, url, *,  params=None, headers=None, **kwargs
+        Returns:
+
+        """
+        try:
+            resp = await self._fetch(method, url, params=params,
+                                     headers=self.cache.conditional_headers(entry, headers), **kwargs)
+        except Exception:
+            self.cache.revalidate_failed(entry)
+            raise
+        return self.cache.revalidated(key, entry, resp, headers)
+
+    async def _background_revalidate(self, *args, **kwargs):
+        """
+        stale-while-revalidate时在后台重新校验缓存,异常只记录日志
+        Args:
+
+        Returns:
+
+        """
+        try:
+            await self._revalidate(*args, **kwargs)
+        except Exception as e:
+            aelog.exception(e)
+
+    async def _cached_request(self, method: str, url: str, *, params: Dict = None, headers: Dict = None,
+                              **kwargs) -> Response:
+        """
+        使用缓存的请求,缓存新鲜时直接返回,过期时重新校验
+        Args:
+            method, url, *,  params=None, headers=None, **kwargs
+        Returns:
+
+        """
+        key = self.cache.make_key(method, url, params)
+        state, entry = self.cache.lookup(key, headers)
+        if state == FRESH:
+            return entry.response
+        if state == STALE:
+            task = asyncio.ensure_future(self._background_revalidate(key, entry, method, url, params=params,
+                                                                     headers=headers, **kwargs))
+            self._revalidate_tasks.add(task)
+            task.add_done_callback(self._revalidate_tasks.discard)
+            return entry.response
+        if state == REVALIDATE:
+            return await self._revalidate(key, entry, method, url, params=params, headers=headers, **kwargs)
+        resp = await self._fetch(method, url, params=params, headers=headers, **kwargs)
+        return self.cache.store(key, resp, headers)
+
+    def _single_flight_key(self, method: str, url: str, params: Dict = None, headers: Dict = None) -> Hashable:
+        """
+        默认的合并请求的key,由method、url、params和single_flight_headers中指定的请求头组成
+        Args:
+            method, url, params, headers
+        Returns:
+
+        """
+        if isinstance(params, Mapping):
+            params = tuple(sorted((str(k), str(v)) for k, v in params.items()))
+        elif params is not None:
+            params = tuple((str(k), str(v)) for k, v in params)
+        headers = {str(k).lower(): str(v) for k, v in (headers or {}).items()}
+        return (method.upper(), url, params,
+                tuple((name, headers.get(name.lower())) for name in self.single_flight_headers))
+
+    def _in_flight_done(self, key: Hashable, task: asyncio.Future):
+        """
+        合并的请求完成后从正在执行的请求中删除
+        Args:
+            key: 合并请求的key
+            task: 合并的请求
+        Returns:
+
+        """
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # 所有调用方都被取消时,防止出现异常没有被获取的警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                       json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                       retry_policy: RetryPolicy = None, hedge_policy: HedgePolicy = None, **kwargs) -> Response:
+        """
+
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        # 只合并没有请求体和其他参数的幂等请求,合并的请求在单独的task中执行,个别调用方被取消时不影响其他调用方
+        if (self.single_flight and method.upper() in ("GET", "HEAD", "OPTIONS") and data is None and
+                json is None and not kwargs):
+            key = self.single_flight_key(method, url, params, headers)
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._do_request(method, url, params=params, headers=headers,
+                                                              timeout=timeout, verify_ssl=verify_ssl,
+                                                              retry_policy=retry_policy, hedge_policy=hedge_policy))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda fut: self._in_flight_done(key, fut))
+            return await asyncio.shield(task)
+        return await self._do_request(method, url, params=params, data=data, json=json, headers=headers,
+                                      timeout=timeout, verify_ssl=verify_ssl, retry_policy=retry_policy,
+                                      hedge_policy=hedge_policy, **kwargs)
+
+    async def _do_request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
+                          json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                          **kwargs) -> Response:
+        """
+        开启缓存时GET请求先查询缓存,否则直接请求
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        if self.cache is not None and self.cache.is_cacheable_request(method, headers, data=data, json=json,
+                                                                      **kwargs):
+            return await self._cached_request(method, url, params=params, headers=headers, timeout=timeout,
+                                              verify_ssl=verify_ssl, **kwargs)
+        return await self._fetch(method, url, params=params, data=data, json=json, headers=headers, timeout=timeout,
+                                 verify_ssl=verify_ssl, **kwargs)
+
+    @staticmethod
+    async def _iter_chunks(resp: aiohttp.ClientResponse, url: str, chunk_size: int) -> AsyncIterator[bytes]:
+        """
+        按块读取响应体,读取过程中的异常转换为本库的异常
+        Args:
+            resp: aiohttp response
+            url: request url
+            chunk_size: 每次读取的字节数
+        Returns:
+
+        """
+        try:
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            raise ClientConnectionError(url=url, message=str(e))
+
+    def async_stream(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+                     headers: Dict = None, timeout: int = None, verify_ssl: bool = None, chunk_size: int = 64 * 1024,
+                     **kwargs) -> '_StreamContextManager':
+        """
+        流式请求,响应体按块读取,退出上下文后连接归还连接池
+
+        async with requests.async_stream("GET", url, chunk_size=1024 * 1024) as resp:
+            async for chunk in resp:
+                ...
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            timeout: 连接和每次读取的超时时间,不限制整个响应体读取的时间
+            chunk_size: 每次读取的字节数
+        Returns:
+
+        """
+        verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
+        timeout = self.timeout if timeout is None else timeout
+        # 响应体较大时整体的读取时间不可控,所以只限制连接和单次读取的时间
+        if isinstance(timeout, (int, float)):
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        send_coro = self._send(method, url, params=params, data=data, json=json, headers=headers, timeout=timeout,
+                               verify_ssl=verify_ssl, **kwargs)
+        return _StreamContextManager(send_coro, url, chunk_size, self._iter_chunks)
+
+    @staticmethod
+    async def _aiter_source(source: Any, chunk_size: int) -> AsyncIterator[bytes]:
+        """
+        按块迭代文件以外的数据源,同时支持同步和异步的数据源
+        Args:
+            source: 上传的数据源
+            chunk_size: 每块的字节数
+        Returns:
+
+        """
+        if hasattr(source, "__aiter__"):
+            async for chunk in source:
+                yield chunk
+        else:
+            for chunk in iter_source(source, chunk_size):
+                yield chunk
+
+    async def async_upload(self, url: str, source: Any, *, method: str = "POST", params: Dict = None,
+                           headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
+                           chunk_size: int = 64 * 1024, content_length: int = None,
+                           content_type: str = "application/octet-stream", **kwargs) -> Response:
+        """
+        流式上传,数据按块发送,内存占用和上传的大小无关
+
+        数据源可以是文件路径、打开的文件、mmap、bytes等buffer对象、同步或者异步的生成器,
+        能获取大小的数据源使用Content-Length发送,否则使用chunked编码发送
+        Args:
+            url: 上传地址
+            source: 上传的数据源
+            method: 请求方法, POST, PUT或者PATCH
+            timeout: 连接和每次读取的超时时间,不限制整个上传的时间
+            chunk_size: 每次发送的字节数
+            content_length: 生成器等无法获取大小的数据源可以指定总字节数
+            content_type: 上传数据的Content-Type
+        Returns:
+
+        """
+        loop = asyncio.get_event_loop()
+        if is_path(source):
+            # 打开和stat文件可能阻塞,在线程池中执行
+            f = await loop.run_in_executor(None, open, source, "rb")
+            try:
+                return await self.async_upload(url, f, method=method, params=params, headers=headers,
+                                               timeout=timeout, verify_ssl=verify_ssl, chunk_size=chunk_size,
+                                               content_length=content_length, content_type=content_type, **kwargs)
+            finally:
+                f.close()
+
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", content_type)
+        timeout = self.timeout if timeout is None else timeout
+        # 上传较大时整体的发送时间不可控,所以只限制连接和单次读取的时间
+        if isinstance(timeout, (int, float)):
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        if is_file(source):
+            size = await loop.run_in_executor(None, upload_length, source)
+            data = _FilePayload(source, size=size, chunk_size=chunk_size, content_type=headers["Content-Type"])
+        else:
+            length = upload_length(source) if content_length is None else content_length
+            if length is not None:
+                headers.setdefault("Content-Length", str(length))
+            data = self._aiter_source(source, chunk_size)
+        return await self.async_request(method, url, params=params, data=data, headers=headers, timeout=timeout,
+                                        verify_ssl=verify_ssl, **kwargs)
+
+    async def _map_one(self, spec: Union[Mapping, Sequence], timeout: float = None) -> Response:
+        """
+        执行批量请求中的单个请求
+        Args:
+            spec: 请求描述
+            timeout: 单个请求的超时时间,不包括等待并发名额的时间
+        Returns:
+
+        """
+        method, url, kwargs = self._parse_request_spec(spec)
+        if timeout is None:
+            return await self.async_request(method, url, **kwargs)
+        try:
+            return await asyncio.wait_for(self.async_request(method, url, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            raise ClientConnectionError(url=url, message="request timed out after {}s".format(timeout))
+
+    async def async_map(self, requests: Iterable[Union[Mapping, Sequence]], *, concurrency: int = 10,
+                        return_exceptions: bool = True, timeout: float = None) -> List[Union[Response, Exception]]:
+        """
+        并发执行多个请求,同时执行的请求数不超过concurrency,结果和请求的顺序一致
+
+        requests中的单个请求可以是{"method": "GET", "url": url, "params": {...}}的字典形式,
+        或者(method, url)、(method, url, kwargs)的元组形式
+        Args:
+            requests: 请求描述的列表
+            concurrency: 最大并发数
+            return_exceptions: 为true时异常作为对应位置的结果返回,否则第一个异常时取消其他请求并抛出
+            timeout: 单个请求的超时时间,超时后抛出ClientConnectionError
+        Returns:
+
+        """
+        requests = list(requests)
+        results: List[Union[Response, Exception, None]] = [None] * len(requests)
+        pending = iter(enumerate(requests))
+
+        async def worker():
+            """
+            从请求队列中循环取出请求执行
+            Args:
+
+            Returns:
+
+            """
+            for index, spec in pending:
+                try:
+                    results[index] = await self._map_one(spec, timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[index] = e
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(max(concurrency, 1), len(requests)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # 出现异常或者调用方被取消时,取消所有还在执行的请求
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        return results
+
+    async def async_as_completed(self, requests: Iterable[Union[Mapping, Sequence]], *, concurrency: int = 10,
+                                 timeout: float = None) -> AsyncIterator[Tuple[int, Union[Response, Exception]]]:
+        """
+        并发执行多个请求,按照完成的顺序返回结果,同时执行的请求数不超过concurrency
+
+        async for index, result in requests.async_as_completed(specs, concurrency=20):
+            ...
+        Args:
+            requests: 请求描述的列表,格式和async_map一致
+            concurrency: 最大并发数
+            timeout: 单个请求的超时时间,超时后抛出ClientConnectionError
+        Returns:
+            (请求在列表中的位置, 响应或者异常)
+        """
+        requests = list(requests)
+        pending = iter(enumerate(requests))
+        done: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            """
+            从请求队列中循环取出请求执行
+            Args:
+
+            Returns:
+
+            """
+            for index, spec in pending:
+                try:
+                    result = await self._map_one(spec, timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    result = e
+                done.put_nowait((index, result))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(max(concurrency, 1), len(requests)))]
+        try:
+            for _ in range(len(requests)):
+                yield await done.get()
+        finally:
+            # 调用方提前退出迭代或者被取消时,取消所有还在执行的请求
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
     async def async_request(self, method: str, url: str, *, params: Dict = None, data: Dict = None,
                             json: Dict = None, headers: Dict = None, timeout: int = None, verify_ssl: bool = None,
@@ -7,8 +7,8 @@
 @time: 18-12-25 下午2:08
 """
 
-__all__ = ("Error", "HttpError", "ClientError", "ClientResponseError", "ClientConnectionError", "FuncArgsError",
-           "JsonRPCError")
+__all__ = ("Error", "HttpError", "ClientError", "ClientResponseError", "ClientConnectionError", "CircuitOpenError",
+           "FuncArgsError", "JsonRPCError")
 
 
 class Error(Exception):
@@ -87,6 +87,19 @@ class ClientConnectionError(ClientError):
     pass
 
 
+class CircuitOpenError(ClientError):
+    """
+    熔断器打开时快速失败的异常,请求没有发送
+    """
+
+    def __init__(self, url, *, host=None, retry_after=None, message=None):
+        self.url = url
+        self.host = host
+        self.retry_after = retry_after
+        self.message = message
+        super().__init__(self.url, message=self.message)
+
+
 class FuncArgsError(Error):
     """
     处理函数参数不匹配引发的error
@@ -6,38 +6,121 @@
 @software: PyCharm
 @time: 2020/2/21 下午5:00
 """
-from typing import Callable, Optional, Tuple
+import asyncio
+import functools
+import os
+import signal
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import aelog
+
+from ._jrpc_admission import AdmissionController, OverloadedError
+from ._jrpc_cache import JsonRPCCache
+from ._jrpc_metrics import JsonRPCMetrics
+from .err import FuncArgsError
 
 __all__ = ("SanicJsonRPC",)
 
 
+def _init_process():
+    """
+    进程池子进程的初始化,子进程fork自sanic worker,继承了事件循环的signal wakeup fd,
+    子进程收到的信号会通知到worker的事件循环,比如进程池异常时终止其他子进程会让worker也停止,所以恢复默认的信号处理
+    Args:
+
+    Returns:
+
+    """
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+class _ErrorResponse(Exception):
+    """
+    方法返回了jsonrpc错误,错误的结果不缓存
+    """
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
 class SanicJsonRPC(object):
     """
     sanic jsonrpc object
+
+    批量请求中的调用并发执行,设置batch_concurrency后每个批量请求同时执行的调用数不超过这个值.
+    每个方法的调用数、错误数、耗时直方图和正在执行的调用数可以通过metrics获取,设置metrics_route后也可以通过GET请求获取.
+    注册方法时设置cache_ttl_可以按照方法名和参数缓存幂等方法的结果, eg: @jsonrpc.jrpc(cache_ttl_=10).
+    设置max_in_flight或者注册方法时设置max_in_flight_后开启准入控制,超过限制的调用排队,
+    排队超时或者队列满时返回-32000 Server overloaded错误,注册方法时可以使用priority_设置方法的优先级,
+    eg: @jsonrpc.jrpc(priority_="critical").
+    CPU密集的同步方法注册时可以设置executor_在线程池或者进程池中执行,不阻塞事件循环, eg: @jsonrpc.jrpc(executor_="process"),
+    进程池中执行的方法需要是模块级别的函数,参数和返回值需要可以pickle,不能使用sanic request等注入的参数
     """
 
-    def __init__(self, app=None, post_route: str = "/api/jrpc/post", ws_route: str = "/api/jrpc/ws"):
+    def __init__(self, app=None, post_route: str = "/api/jrpc/post", ws_route: str = "/api/jrpc/ws",
+                 batch_concurrency: int = None, metrics_route: str = None, cache_maxsize: int = 1024,
+                 cache_path: str = None, max_in_flight: int = None, max_queue: int = 100,
+                 queue_timeout: float = 1, thread_pool_size: int = None, process_pool_size: int = None,
+                 executor_shutdown_timeout: float = 30):
         """
         jsonrpc 实例初始化
         Args:
             app: app应用
             post_route: post url
             ws_route: websocket url
+            batch_concurrency: 每个批量请求中同时执行的调用数,默认不限制
+            metrics_route: 方法调用统计的url,默认不添加
+            cache_maxsize: 每个缓存的方法在内存中最多缓存的结果数
+            cache_path: 多个worker进程共享的方法结果缓存目录,默认只缓存在内存中
+            max_in_flight: 整个服务同时执行的调用数,默认不限制
+            max_queue: 超过同时执行的调用数时等待队列的长度
+            queue_timeout: 在等待队列中最多等待的时间,单位秒
+            thread_pool_size: 执行方法的线程池大小,默认使用ThreadPoolExecutor的默认值
+            process_pool_size: 执行方法的进程池大小,默认为CPU核数
+            executor_shutdown_timeout: 服务停止时等待线程池和进程池中执行的方法结束的最长时间,单位秒
         """
         self.jrpc = None
         self.post_route: str = post_route
         self.ws_route: str = ws_route
+        self.batch_concurrency: Optional[int] = batch_concurrency
+        self.metrics_route: Optional[str] = metrics_route
+        self.metrics = JsonRPCMetrics()
+        self.cache_maxsize: int = cache_maxsize
+        self.cache_path: Optional[str] = cache_path
+        self.admission = AdmissionController(max_in_flight, max_queue=max_queue, queue_timeout=queue_timeout)
+        self.thread_pool_size: Optional[int] = thread_pool_size
+        self.process_pool_size: Optional[int] = process_pool_size
+        self.executor_shutdown_timeout: float = executor_shutdown_timeout
 
         if app is not None:
             self.init_app(app)
 
-    def init_app(self, app, post_route: str = "/api/jrpc/post", ws_route: str = "/api/jrpc/ws"):
+    def init_app(self, app, post_route: str = "/api/jrpc/post", ws_route: str = "/api/jrpc/ws",
+                 batch_concurrency: int = None, metrics_route: str = None, cache_maxsize: int = None,
+                 cache_path: str = None, max_in_flight: int = None, max_queue: int = None,
+                 queue_timeout: float = None, thread_pool_size: int = None, process_pool_size: int = None,
+                 executor_shutdown_timeout: float = None):
         """
         jsonrpc 实例初始化
         Args:
             app: app应用
             post_route: post url
             ws_route: websocket url
+            batch_concurrency: 每个批量请求中同时执行的调用数,默认不限制
+            metrics_route: 方法调用统计的url,默认不添加
+            cache_maxsize: 每个缓存的方法在内存中最多缓存的结果数
+            cache_path: 多个worker进程共享的方法结果缓存目录,默认只缓存在内存中
+            max_in_flight: 整个服务同时执行的调用数,默认不限制
+            max_queue: 超过同时执行的调用数时等待队列的长度
+            queue_timeout: 在等待队列中最多等待的时间,单位秒
+            thread_pool_size: 执行方法的线程池大小,默认使用ThreadPoolExecutor的默认值
+            process_pool_size: 执行方法的进程池大小,默认为CPU核数
+            executor_shutdown_timeout: 服务停止时等待线程池和进程池中执行的方法结束的最长时间,单位秒
         Returns:
 
         """
@@ -46,6 +129,10 @@ class SanicJsonRPC(object):
             from sanic_jsonrpc import __version__
             # noinspection PyProtectedMember
             from sanic_jsonrpc._routing import Route
+            from sanic_jsonrpc.loggers import logger
+            from sanic_jsonrpc.models import Error, Request, Response
+            from sanic.response import HTTPResponse, json
+            from fashionable import UNSET
 
             if __version__ != "0.2.2":
                 raise ImportError("sanic_jsonrpc version error!")
@@ -57,23 +144,302 @@ class SanicJsonRPC(object):
             """
 
             """
+            metrics: JsonRPCMetrics = None
+            batch_concurrency: int = None
+            cache_maxsize: int = 1024
+            cache_path: str = None
+            _caches: Dict[str, JsonRPCCache] = {}
+            admission: AdmissionController = None
+            thread_pool_size: int = None
+            process_pool_size: int = None
+            executor_shutdown_timeout: float = 30
+            # 每个实例单独的线程池和进程池,在init_app中初始化
+            _executors: Dict[str, Executor] = None
+
+            def _get_executor(self, kind: str) -> Executor:
+                """
+                获取执行方法的线程池或者进程池,第一次使用时创建
+                Args:
+                    kind: thread或者process
+                Returns:
+
+                """
+                executor = self._executors.get(kind)
+                if executor is None:
+                    if kind == "process":
+                        executor = ProcessPoolExecutor(max_workers=self.process_pool_size, initializer=_init_process)
+                    else:
+                        executor = ThreadPoolExecutor(max_workers=self.thread_pool_size)
+                    self._executors[kind] = executor
+                return executor
+
+            def _in_executor(self, kind: str, func: Callable) -> Callable:
+                """
+                把同步方法包装为在线程池或者进程池中执行的协程函数
+                Args:
+                    kind: thread或者process
+                    func: 同步方法
+                Returns:
+
+                """
+
+                async def run(*args, **kwargs):
+                    executor = self._get_executor(kind)
+                    try:
+                        return await asyncio.get_event_loop().run_in_executor(
+                            executor, functools.partial(func, *args, **kwargs))
+                    except BrokenProcessPool:
+                        # 子进程异常退出后进程池不能再使用,下次调用时重新创建
+                        if self._executors.get(kind) is executor:
+                            del self._executors[kind]
+                            executor.shutdown(wait=False)
+                        raise
+
+                return run
+
+            async def _shutdown_executors(self, _app, _loop):
+                """
+                服务停止后关闭线程池和进程池,在默认线程池中等待执行中的方法结束,不阻塞事件循环,
+                超过executor_shutdown_timeout后不再等待
+                Args:
+
+                Returns:
+
+                """
+                executors, self._executors = self._executors, {}
+                if not executors:
+                    return
+                loop = asyncio.get_event_loop()
+                waiters = {loop.run_in_executor(None, functools.partial(executor.shutdown, wait=True)): kind
+                           for kind, executor in executors.items()}
+                _, pending = await asyncio.wait(waiters, timeout=self.executor_shutdown_timeout)
+                for waiter in pending:
+                    aelog.warning("jsonrpc {} pool shutdown timeout".format(waiters[waiter]))
+
+            async def _post(self, sanic_request) -> HTTPResponse:
+                """
+                处理post请求,和sanic_jsonrpc相同,只是批量请求中的调用同时执行的数量不超过batch_concurrency
+                Args:
+                    sanic_request: sanic request
+                Returns:
+
+                """
+                incomings = self._parse_messages(sanic_request.body)
+                single = not isinstance(incomings, list)
+                if single:
+                    incomings = [incomings]
+                semaphore = None
+                if self.batch_concurrency and len(incomings) > self.batch_concurrency:
+                    semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+                responses, futures = [], []
+                for incoming in incomings:
+                    if isinstance(incoming, Response):
+                        responses.append(incoming)
+                        continue
+                    route = self._route(incoming, is_post=True)
+                    if not isinstance(route, Route):
+                        if route:
+                            responses.append(route)
+                        else:
+                            logger.info("Unhandled %r", incoming)
+                        continue
+                    fut = self._register_call(incoming, route, self._customs(sanic_request, incoming), semaphore)
+                    if isinstance(incoming, Request):
+                        futures.append(fut)
+                responses.extend(await asyncio.gather(*futures))
+
+                body = self._serialize_responses(responses, single)
+                return HTTPResponse(body, 207, content_type='application/json' if body else 'text/plain')
+
+            async def _call(self, incoming, route: Route, customs: Dict[type, Any],
+                            semaphore: asyncio.Semaphore = None) -> Optional[Response]:
+                """
+                执行一次调用,有semaphore时等待获取后再执行,开启准入控制时获取执行名额后再执行
+                Args:
+                    incoming: jsonrpc请求或者通知
+                    route: 方法的路由
+                    customs: 按照类型注入的参数
+                    semaphore: 批量请求的并发限制
+                Returns:
+
+                """
+                if semaphore is not None:
+                    async with semaphore:
+                        return await self._call(incoming, route, customs)
+                if self.admission is None:
+                    return await self._metered_call(incoming, route, customs)
+                try:
+                    admission = await self.admission.acquire(route.method)
+                except OverloadedError as e:
+                    # 通知被拒绝时直接丢弃
+                    if isinstance(incoming, Request):
+                        return Response(error=Error(-32000, "Server overloaded", e.reason), id=incoming.id)
+                    return None
+                with admission:
+                    return await self._metered_call(incoming, route, customs)
+
+            async def _metered_call(self, incoming, route: Route, customs: Dict[type, Any]) -> Optional[Response]:
+                """
+                执行一次调用并统计
+                Args:
+                    incoming: jsonrpc请求或者通知
+                    route: 方法的路由
+                    customs: 按照类型注入的参数
+                Returns:
+
+                """
+                if self.metrics is None:
+                    return await self._cached_call(incoming, route, customs)
+                with self.metrics.track(route.method) as call:
+                    response = await self._cached_call(incoming, route, customs)
+                    # 通知没有响应,只能统计调用数和耗时
+                    if response is not None and response.error:
+                        call.fail(response.error.code)
+                return response
+
+            async def _cached_call(self, incoming, route: Route, customs: Dict[type, Any]) -> Optional[Response]:
+                """
+                执行一次调用,方法设置了缓存时请求先查询缓存,通知不使用缓存
+                Args:
+                    incoming: jsonrpc请求或者通知
+                    route: 方法的路由
+                    customs: 按照类型注入的参数
+                Returns:
+
+                """
+                cache = self._caches.get(route.method)
+                if cache is None or not isinstance(incoming, Request):
+                    return await super()._call(incoming, route, customs)
+
+                async def call():
+                    response = await super(JsonRPC, self)._call(incoming, route, customs)
+                    if response.error:
+                        raise _ErrorResponse(response.error)
+                    return response.result
+
+                params = None if incoming.params is UNSET else incoming.params
+                try:
+                    result = await cache.get_or_call(cache.make_key(route.method, params), call)
+                except _ErrorResponse as e:
+                    return Response(error=e.error, id=incoming.id)
+                return Response(result=result, id=incoming.id)
 
             def __call__(self, method_: Optional[str] = None, *,
                          is_post_: Tuple[bool, ...] = (True, False),
                          is_request_: Tuple[bool, ...] = (True, False),
+                         cache_ttl_: float = None, cache_maxsize_: int = None, cache_path_: str = None,
+                         priority_: str = None, max_in_flight_: int = None, executor_: str = None,
                          **annotations: type) -> Callable:
+                """
+                注册方法
+                Args:
+                    method_: 方法名,默认使用函数名
+                    is_post_: 是否可以通过post和websocket调用
+                    is_request_: 是否可以作为请求和通知调用
+                    cache_ttl_: 结果的缓存时间,单位秒,设置后按照方法名和参数缓存结果,只适用于幂等的方法
+                    cache_maxsize_: 内存中最多缓存的结果数,默认使用SanicJsonRPC的cache_maxsize
+                    cache_path_: 多进程共享的缓存目录,默认使用SanicJsonRPC的cache_path
+                    priority_: 准入控制的优先级, critical, high, normal或者low, critical不受限制,默认normal
+                    max_in_flight_: 方法同时执行的调用数,默认不限制
+                    executor_: 同步方法的执行方式, thread在线程池中执行, process在进程池中执行,默认在事件循环中执行
+                    annotations: 参数的类型
+                Returns:
+
+                """
                 if isinstance(method_, Callable):
                     return self.__call__(is_post_=is_post_, is_request_=is_request_)(method_)
 
+                if executor_ not in (None, "thread", "process"):
+                    raise FuncArgsError("executor_ must be thread or process")
+
                 def deco(func: Callable) -> Callable:
                     route = Route.from_inspect(func, method_, annotations)
                     route.result = None  # 不进行返回值的类型校验
+                    if executor_ is not None:
+                        if asyncio.iscoroutinefunction(func):
+                            raise FuncArgsError(f"{route.method} is a coroutine function, can not use executor_")
+                        # 参数校验使用原函数的签名,执行时再放到线程池或者进程池中
+                        route.func = self._in_executor(executor_, func)
                     self._routes.update({(ip, ir, route.method): route for ip in is_post_ for ir in is_request_})
+                    if cache_ttl_:
+                        # 共享目录中每个方法一个子目录,清空缓存时只删除这个方法的结果
+                        cache_path = cache_path_ or self.cache_path
+                        if cache_path:
+                            cache_path = os.path.join(cache_path, route.method.replace(os.sep, "_"))
+                        self._caches[route.method] = JsonRPCCache(
+                            cache_ttl_, cache_maxsize_ or self.cache_maxsize, cache_path)
+                    if self.admission is not None:
+                        self.admission.configure(route.method, priority=priority_, max_in_flight=max_in_flight_)
                     return func
 
                 return deco
 
         self.post_route = post_route or self.post_route
         self.ws_route = ws_route or self.ws_route
+        self.batch_concurrency = batch_concurrency or app.config.get(
+            "JSONRPC_BATCH_CONCURRENCY", None) or self.batch_concurrency
+        self.metrics_route = metrics_route or app.config.get("JSONRPC_METRICS_ROUTE", None) or self.metrics_route
+        self.cache_maxsize = cache_maxsize or app.config.get("JSONRPC_CACHE_MAXSIZE", None) or self.cache_maxsize
+        self.cache_path = cache_path or app.config.get("JSONRPC_CACHE_PATH", None) or self.cache_path
+        self.admission.max_in_flight = max_in_flight or app.config.get(
+            "JSONRPC_MAX_IN_FLIGHT", None) or self.admission.max_in_flight
+        max_queue = app.config.get("JSONRPC_MAX_QUEUE", None) if max_queue is None else max_queue
+        self.admission.max_queue = self.admission.max_queue if max_queue is None else max_queue
+        self.admission.queue_timeout = queue_timeout or app.config.get(
+            "JSONRPC_QUEUE_TIMEOUT", None) or self.admission.queue_timeout
+        self.thread_pool_size = thread_pool_size or app.config.get(
+            "JSONRPC_THREAD_POOL_SIZE", None) or self.thread_pool_size
+        self.process_pool_size = process_pool_size or app.config.get(
+            "JSONRPC_PROCESS_POOL_SIZE", None) or self.process_pool_size
+        self.executor_shutdown_timeout = executor_shutdown_timeout or app.config.get(
+            "JSONRPC_EXECUTOR_SHUTDOWN_TIMEOUT", None) or self.executor_shutdown_timeout
 
         self.jrpc = JsonRPC(app, post_route=self.post_route, ws_route=self.ws_route)
+        self.jrpc.metrics = self.metrics
+        self.jrpc.batch_concurrency = self.batch_concurrency
+        self.jrpc.cache_maxsize = self.cache_maxsize
+        self.jrpc.cache_path = self.cache_path
+        self.jrpc.admission = self.admission
+        self.jrpc.thread_pool_size = self.thread_pool_size
+        self.jrpc.process_pool_size = self.process_pool_size
+        self.jrpc.executor_shutdown_timeout = self.executor_shutdown_timeout
+        self.jrpc._executors = {}
+        app.listener("after_server_stop")(self.jrpc._shutdown_executors)
+
+        if self.metrics_route:
+            async def metrics_view(request):
+                """
+                方法的调用统计
+                Args:
+                    request: sanic request
+                Returns:
+
+                """
+                return json(self.metrics.snapshot(request.args.get("method")))
+
+            app.add_route(metrics_view, self.metrics_route, methods=frozenset({"GET"}))
+
+    def cache_stats(self, ) -> Dict[str, Dict[str, int]]:
+        """
+        设置了缓存的方法的缓存统计信息
+        Args:
+
+        Returns:
+            {method: {"hits": 命中数, "misses": 没有命中数, "entries": 内存中的结果数}}
+        """
+        return {method: cache.stats() for method, cache in self.jrpc._caches.items()} if self.jrpc else {}
+
+    async def clear_cache(self, method: str = None):
+        """
+        清空方法的结果缓存
+        Args:
+            method: jsonrpc方法名,默认清空所有方法的缓存
+        Returns:
+
+        """
+        if self.jrpc is None:
+            return
+        for name, cache in self.jrpc._caches.items():
+            if method is None or name == method:
+                await cache.clear()
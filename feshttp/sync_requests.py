@@ -7,22 +7,33 @@
 @time: 18-7-1 上午10:08
 """
 import atexit
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from http import cookiejar as cookielib
 from io import UnsupportedOperation
-from typing import Dict, Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
 
+import aelog
 import requests
 from requests import PreparedRequest, Session
+from requests.adapters import HTTPAdapter
 from requests.cookies import RequestsCookieJar, cookiejar_from_dict, merge_cookies
-from requests.exceptions import ConnectTimeout, ConnectionError, HTTPError, RequestException, Timeout
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError, RequestException, Timeout
 from requests.sessions import merge_hooks, merge_setting
 from requests.structures import CaseInsensitiveDict
 from requests.utils import get_netrc_auth, super_len
 
 from ._err_msg import http_msg
-from ._json import dumps
+from ._breaker import CircuitBreaker
+from ._cache import FRESH, HttpCache, REVALIDATE, STALE
+from ._json import dumps, get_backend
+from ._payload import SizedIterator, is_file, is_path, iter_source, upload_length
 from ._requests import BaseRequestsMixIn
-from ._response import Response
+from ._response import Response, StreamResponse
+from ._retry import RetryPolicy
 from .err import ClientConnectionError, ClientError, ClientResponseError
 from .utils import Singleton, _verify_message
 
@@ -33,6 +44,8 @@ class CustomPreparedRequest(PreparedRequest):
     """
     自定义prepared类 用于dumps时间使用
     """
+    json_backend: str = None
+    json_sort_keys: bool = None
 
     def prepare_body(self, data, files, json=None):
         """Prepares the given HTTP body data."""
@@ -48,7 +61,7 @@ class CustomPreparedRequest(PreparedRequest):
             # urllib3 requires a bytes-like body. Python 2's json.dumps
             # provides this natively, but Python 3 gives a Unicode string.
             content_type = 'application/json'
-            body = dumps(json)
+            body = dumps(json, backend=self.json_backend, sort_keys=self.json_sort_keys)
             if not isinstance(body, bytes):
                 body = body.encode('utf-8')
 
@@ -108,6 +121,8 @@ class CustomSession(Session):
     """
     自定义session
     """
+    json_backend: str = None
+    json_sort_keys: bool = None
 
     def prepare_request(self, request):
         """Constructs a :class:`PreparedRequest <PreparedRequest>` for
@@ -135,6 +150,7 @@ class CustomSession(Session):
             auth = get_netrc_auth(request.url)
 
         p = CustomPreparedRequest()
+        p.json_backend, p.json_sort_keys = self.json_backend, self.json_sort_keys
         p.prepare(
             method=request.method.upper(),
             url=request.url,
@@ -156,7 +172,10 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
     """
 
     def __init__(self, app=None, *, timeout: int = 5 * 60, verify_ssl: bool = True, message: Dict = None,
-                 use_zh: bool = True):
+                 use_zh: bool = True, pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False,
+                 pool_mounts: Dict[str, Dict] = None, json_backend: str = None, json_sort_keys: bool = None,
+                 max_workers: int = 10, cache_maxsize: int = 0, cache_maxentries: int = 1024,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None):
         """
         基于requests的同步封装
         Args:
@@ -165,6 +184,17 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            pool_connections: 缓存的连接池个数,也就是同时保持连接池的host个数，默认10
+            pool_maxsize: 每个连接池中保存的最大连接数，默认10
+            pool_block: 连接池满时是否阻塞等待空闲连接，默认false
+            pool_mounts: 按照URL前缀单独配置连接池, eg: {"https://api.example.com": {"pool_maxsize": 50}}
+            json_backend: json序列化后端, orjson, ujson, simplejson或者auto, 默认使用进程默认的后端simplejson
+            json_sort_keys: json序列化时是否对key排序，默认true
+            max_workers: map批量请求的线程池大小，默认10, 应该不大于pool_maxsize才能复用连接
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存，默认0不开启
+            cache_maxentries: GET请求响应缓存的最大个数，默认1024
+            retry_policy: 请求的重试策略，默认不重试，可以和其他client共用同一个策略和重试预算
+            circuit_breaker: 按照host的熔断器，默认不熔断，可以和其他client共用同一个熔断器
 
         """
         self.app = app
@@ -174,13 +204,35 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
         self.message = message or {}
         self.use_zh = use_zh
         self.msg_zh = None
+        # 连接池配置
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.pool_mounts: Dict[str, Dict] = dict(pool_mounts or {})
+        # json序列化配置
+        self.json_backend = json_backend
+        self.json_sort_keys = json_sort_keys
+        # map批量请求的线程池,第一次使用时创建
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # GET请求响应缓存,可以直接设置为HttpCache实例和其他client共用
+        self.cache_maxentries = cache_maxentries
+        self.cache: Optional[HttpCache] = HttpCache(cache_maxsize, cache_maxentries) if cache_maxsize else None
+        # 重试策略,请求时也可以通过retry_policy参数单独指定
+        self.retry_policy = retry_policy
+        # 按照host的熔断器
+        self.circuit_breaker = circuit_breaker
 
         if app is not None:
             self.init_app(app, timeout=self.timeout, verify_ssl=self.verify_ssl, message=self.message,
                           use_zh=self.use_zh)
 
     def init_app(self, app, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                 use_zh: bool = None):
+                 use_zh: bool = None, pool_connections: int = None, pool_maxsize: int = None, pool_block: bool = None,
+                 pool_mounts: Dict[str, Dict] = None, json_backend: str = None, json_sort_keys: bool = None,
+                 max_workers: int = None, cache_maxsize: int = None, cache_maxentries: int = None,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None):
         """
         基于aiohttp的异步封装
         Args:
@@ -189,6 +241,17 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            pool_connections: 缓存的连接池个数
+            pool_maxsize: 每个连接池中保存的最大连接数
+            pool_block: 连接池满时是否阻塞等待空闲连接
+            pool_mounts: 按照URL前缀单独配置连接池
+            json_backend: json序列化后端
+            json_sort_keys: json序列化时是否对key排序
+            max_workers: map批量请求的线程池大小
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存
+            cache_maxentries: GET请求响应缓存的最大个数
+            retry_policy: 请求的重试策略
+            circuit_breaker: 按照host的熔断器
         Returns:
 
         """
@@ -202,8 +265,29 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
 
         self.message = _verify_message(http_msg, message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
+
+        self.pool_connections = pool_connections or app.config.get(
+            "ECLIENTS_HTTP_POOL_CONNECTIONS", None) or self.pool_connections
+        self.pool_maxsize = pool_maxsize or app.config.get("ECLIENTS_HTTP_POOL_MAXSIZE", None) or self.pool_maxsize
+        self.pool_block = pool_block or app.config.get("ECLIENTS_HTTP_POOL_BLOCK", None) or self.pool_block
+        self.pool_mounts.update(pool_mounts or app.config.get("ECLIENTS_HTTP_POOL_MOUNTS", None) or {})
+        self.json_backend = json_backend or app.config.get("ECLIENTS_HTTP_JSON_BACKEND", None) or self.json_backend
+        if json_sort_keys is None:
+            json_sort_keys = app.config.get("ECLIENTS_HTTP_JSON_SORT_KEYS", None)
+        self.json_sort_keys = self.json_sort_keys if json_sort_keys is None else json_sort_keys
+        # 校验后端是否可用,每个客户端使用自己的后端,不修改进程默认的后端
+        get_backend(self.json_backend)
+        self.max_workers = max_workers or app.config.get("ECLIENTS_HTTP_MAX_WORKERS", None) or self.max_workers
+        cache_maxsize = cache_maxsize or app.config.get("ECLIENTS_HTTP_CACHE_MAXSIZE", None)
+        self.cache_maxentries = cache_maxentries or app.config.get(
+            "ECLIENTS_HTTP_CACHE_MAXENTRIES", None) or self.cache_maxentries
+        if cache_maxsize and self.cache is None:
+            self.cache = HttpCache(cache_maxsize, self.cache_maxentries)
+        self.retry_policy = retry_policy or app.config.get("ECLIENTS_HTTP_RETRY_POLICY", None) or self.retry_policy
+        self.circuit_breaker = circuit_breaker or app.config.get(
+            "ECLIENTS_HTTP_CIRCUIT_BREAKER", None) or self.circuit_breaker
         # 初始化session
-        self.session = CustomSession()
+        self.session = self._create_session()
 
         @atexit.register
         def close_connection():
@@ -214,11 +298,14 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
             Returns:
 
             """
-            if self.session:
-                self.session.close()
+            self.close()
 
     def init_session(self, *, timeout: int = None, verify_ssl: bool = None, message: Dict = None,
-                     use_zh: bool = None):
+                     use_zh: bool = None, pool_connections: int = None, pool_maxsize: int = None,
+                     pool_block: bool = None, pool_mounts: Dict[str, Dict] = None, json_backend: str = None,
+                     json_sort_keys: bool = None, max_workers: int = None, cache_maxsize: int = None,
+                     cache_maxentries: int = None, retry_policy: RetryPolicy = None,
+                     circuit_breaker: CircuitBreaker = None):
         """
         基于aiohttp的异步封装
         Args:
@@ -226,6 +313,17 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
             verify_ssl:verify ssl
             message: 提示消息
             use_zh: 消息提示是否使用中文，默认中文
+            pool_connections: 缓存的连接池个数
+            pool_maxsize: 每个连接池中保存的最大连接数
+            pool_block: 连接池满时是否阻塞等待空闲连接
+            pool_mounts: 按照URL前缀单独配置连接池
+            json_backend: json序列化后端
+            json_sort_keys: json序列化时是否对key排序
+            max_workers: map批量请求的线程池大小
+            cache_maxsize: GET请求响应缓存的最大字节数，大于0时开启缓存
+            cache_maxentries: GET请求响应缓存的最大个数
+            retry_policy: 请求的重试策略
+            circuit_breaker: 按照host的熔断器
         Returns:
 
         """
@@ -234,8 +332,22 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
         use_zh = use_zh or self.use_zh
         self.message = _verify_message(http_msg, message or self.message)
         self.msg_zh = "msg_zh" if use_zh else "msg_en"
+        self.pool_connections = pool_connections or self.pool_connections
+        self.pool_maxsize = pool_maxsize or self.pool_maxsize
+        self.pool_block = pool_block or self.pool_block
+        self.pool_mounts.update(pool_mounts or {})
+        self.json_backend = json_backend or self.json_backend
+        self.json_sort_keys = self.json_sort_keys if json_sort_keys is None else json_sort_keys
+        # 校验后端是否可用,每个客户端使用自己的后端,不修改进程默认的后端
+        get_backend(self.json_backend)
+        self.max_workers = max_workers or self.max_workers
+        self.cache_maxentries = cache_maxentries or self.cache_maxentries
+        if cache_maxsize and self.cache is None:
+            self.cache = HttpCache(cache_maxsize, self.cache_maxentries)
+        self.retry_policy = retry_policy or self.retry_policy
+        self.circuit_breaker = circuit_breaker or self.circuit_breaker
         # 初始化session
-        self.session = CustomSession()
+        self.session = self._create_session()
 
         @atexit.register
         def close_connection():
@@ -246,13 +358,60 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
             Returns:
 
             """
-            if self.session:
-                self.session.close()
+            self.close()
 
-    def _request(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
-                 headers: Dict = None, verify_ssl: bool = None, timeout: int = None, **kwargs) -> Response:
+    def _create_adapter(self, *, pool_connections: int = None, pool_maxsize: int = None,
+                        pool_block: bool = None) -> HTTPAdapter:
+        """
+        创建连接池adapter,没有指定的配置使用全局配置
+        Args:
+            pool_connections: 缓存的连接池个数
+            pool_maxsize: 每个连接池中保存的最大连接数
+            pool_block: 连接池满时是否阻塞等待空闲连接
+        Returns:
+
+        """
+        return HTTPAdapter(pool_connections=pool_connections or self.pool_connections,
+                           pool_maxsize=pool_maxsize or self.pool_maxsize,
+                           pool_block=self.pool_block if pool_block is None else pool_block)
+
+    def _create_session(self, ) -> CustomSession:
+        """
+        按照连接池配置创建session
+        Args:
+
+        Returns:
+
+        """
+        session = CustomSession()
+        session.json_backend, session.json_sort_keys = self.json_backend, self.json_sort_keys
+        session.mount("http://", self._create_adapter())
+        session.mount("https://", self._create_adapter())
+        for prefix, pool_config in self.pool_mounts.items():
+            session.mount(prefix, self._create_adapter(**pool_config))
+        return session
+
+    def mount(self, prefix: str, *, pool_connections: int = None, pool_maxsize: int = None,
+              pool_block: bool = None):
         """
+        为指定URL前缀单独配置连接池,前缀越长匹配优先级越高
+        Args:
+            prefix: URL前缀, eg: https://api.example.com
+            pool_connections: 缓存的连接池个数
+            pool_maxsize: 每个连接池中保存的最大连接数
+            pool_block: 连接池满时是否阻塞等待空闲连接
+        Returns:
+
+        """
+        pool_config = {"pool_connections": pool_connections, "pool_maxsize": pool_maxsize, "pool_block": pool_block}
+        self.pool_mounts[prefix] = pool_config
+        if self.session is not None:
+            self.session.mount(prefix, self._create_adapter(**pool_config))
 
+    def _send(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+              headers: Dict = None, verify_ssl: bool = None, timeout: int = None, **kwargs) -> requests.Response:
+        """
+        发送请求并校验响应状态,异常统一转换为本库的异常,响应体由调用方读取
         Args:
             method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
         Returns:
@@ -316,40 +475,339 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
                                        timeout=timeout, **kwargs)
 
         get_resp = {"GET": _get, "POST": _post, "PUT": _put, "DELETE": _delete, "PATCH": _patch}
-        try:
-            resp = get_resp[method.upper()]()
-            resp.raise_for_status()
-        except KeyError as e:
-            raise ClientError(url=url, message="error method {0}".format(str(e)))
-        except (ConnectionError, ConnectTimeout) as e:
-            raise ClientConnectionError(url=url, message=str(e))
-        except (Timeout, HTTPError) as e:
-            resp = e.response
+        with self._circuit(url):
             try:
-                resp_data = resp.json()
-            except (ValueError, TypeError):
-                resp_data = resp.text
-            raise ClientResponseError(url=url, status_code=resp.status_code, message=resp.reason, headers=resp.headers,
-                                      body=resp_data)
-        except RequestException as e:
-            raise ClientError(url=url, message="ClientError: {}".format(vars(e)))
+                resp = get_resp[method.upper()]()
+                resp.raise_for_status()
+            except KeyError as e:
+                raise ClientError(url=url, message="error method {0}".format(str(e)))
+            except (ConnectionError, Timeout) as e:
+                raise ClientConnectionError(url=url, message=str(e))
+            except HTTPError as e:
+                resp = e.response
+                try:
+                    resp_data = resp.json()
+                except (ValueError, TypeError):
+                    resp_data = resp.text
+                raise ClientResponseError(url=url, status_code=resp.status_code, message=resp.reason,
+                                          headers=resp.headers, body=resp_data)
+            except RequestException as e:
+                raise ClientError(url=url, message="ClientError: {}".format(vars(e)))
+        return resp
+
+    def _fetch(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+               headers: Dict = None, verify_ssl: bool = None, timeout: int = None, retry_policy: RetryPolicy = None,
+               **kwargs) -> Response:
+        """
+        发送请求并读取整个响应体,有重试策略时按照策略重试
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            retry_policy: 本次请求的重试策略,默认使用全局的重试策略
+        Returns:
 
-        with resp:
+        """
+        retry_policy = retry_policy or self.retry_policy
+        if retry_policy is None or not retry_policy.is_replayable(data):
+            return self._fetch_once(method, url, params=params, data=data, json=json, headers=headers,
+                                    verify_ssl=verify_ssl, timeout=timeout, **kwargs)
+        retry_policy.on_request()
+        attempt = 0
+        while True:
             try:
-                resp_json = resp.json()
-            except (ValueError, TypeError):
-                context_type = resp.headers.get("Content-Type", "")
-                if "text" in context_type:
-                    resp_text = resp.text
-                    return Response(resp.status_code, resp.reason, resp.headers, resp.cookies, resp_body=resp_text,
-                                    content=b"")
-                else:
-                    resp_bytes = resp.content
-                    return Response(resp.status_code, resp.reason, resp.headers, resp.cookies, resp_body="",
-                                    content=resp_bytes)
+                return self._fetch_once(method, url, params=params, data=data, json=json, headers=headers,
+                                        verify_ssl=verify_ssl, timeout=timeout, **kwargs)
+            except (ClientConnectionError, ClientResponseError) as e:
+                if not retry_policy.should_retry(method, e, attempt):
+                    raise
+                delay = retry_policy.backoff(attempt, e)
+                attempt += 1
+                aelog.warning("retry {} {} after {:.3f}s, attempt {}: {!r}".format(method, url, delay, attempt, e))
+                time.sleep(delay)
+
+    def _fetch_once(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+                    headers: Dict = None, verify_ssl: bool = None, timeout: int = None, **kwargs) -> Response:
+        """
+        发送一次请求并读取整个响应体
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        resp = self._send(method, url, params=params, data=data, json=json, headers=headers, verify_ssl=verify_ssl,
+                          timeout=timeout, **kwargs)
+
+        with resp:
+            return Response(resp.status_code, resp.reason, resp.headers, resp.cookies, content=resp.content,
+                            encoding=resp.encoding, json_backend=self.json_backend)
+
+    def _revalidate(self, key: str, entry, method: str, url: str, *, params: Dict = None, headers: Dict = None,
+                    **kwargs) -> Response:
+        """
+        带条件请求重新校验缓存
+        Args:
+            key: 缓存的key
+            entry: 缓存项
+            method, url, *,  params=None, headers=None, **kwargs
+        Returns:
+
+        """
+        try:
+            resp = self._fetch(method, url, params=params, headers=self.cache.conditional_headers(entry, headers),
+                               **kwargs)
+        except Exception:
+            self.cache.revalidate_failed(entry)
+            raise
+        return self.cache.revalidated(key, entry, resp, headers)
+
+    def _background_revalidate(self, *args, **kwargs):
+        """
+        stale-while-revalidate时在后台重新校验缓存,异常只记录日志
+        Args:
+
+        Returns:
+
+        """
+        try:
+            self._revalidate(*args, **kwargs)
+        except Exception as e:
+            aelog.exception(e)
+
+    def _cached_request(self, method: str, url: str, *, params: Dict = None, headers: Dict = None,
+                        **kwargs) -> Response:
+        """
+        使用缓存的请求,缓存新鲜时直接返回,过期时重新校验
+        Args:
+            method, url, *,  params=None, headers=None, **kwargs
+        Returns:
+
+        """
+        key = self.cache.make_key(method, url, params)
+        state, entry = self.cache.lookup(key, headers)
+        if state == FRESH:
+            return entry.response
+        if state == STALE:
+            self._get_executor().submit(self._background_revalidate, key, entry, method, url, params=params,
+                                        headers=headers, **kwargs)
+            return entry.response
+        if state == REVALIDATE:
+            return self._revalidate(key, entry, method, url, params=params, headers=headers, **kwargs)
+        resp = self._fetch(method, url, params=params, headers=headers, **kwargs)
+        return self.cache.store(key, resp, headers)
+
+    def _request(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+                 headers: Dict = None, verify_ssl: bool = None, timeout: int = None, **kwargs) -> Response:
+        """
+
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+        Returns:
+
+        """
+        if self.cache is not None and self.cache.is_cacheable_request(method, headers, data=data, json=json,
+                                                                      **kwargs):
+            return self._cached_request(method, url, params=params, headers=headers, verify_ssl=verify_ssl,
+                                        timeout=timeout, **kwargs)
+        return self._fetch(method, url, params=params, data=data, json=json, headers=headers, verify_ssl=verify_ssl,
+                           timeout=timeout, **kwargs)
+
+    @staticmethod
+    def _iter_chunks(resp: requests.Response, url: str, chunk_size: int) -> Iterator[bytes]:
+        """
+        按块读取响应体,读取过程中的异常转换为本库的异常,读取结束后释放连接
+        Args:
+            resp: requests response
+            url: request url
+            chunk_size: 每次读取的字节数
+        Returns:
+
+        """
+        try:
+            for chunk in resp.iter_content(chunk_size):
+                yield chunk
+        except (ConnectionError, ChunkedEncodingError, Timeout) as e:
+            raise ClientConnectionError(url=url, message=str(e))
+        finally:
+            resp.close()
+
+    def stream(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
+               headers: Dict = None, verify_ssl: bool = None, timeout: int = None, chunk_size: int = 64 * 1024,
+               **kwargs) -> StreamResponse:
+        """
+        流式请求,响应体按块读取,读取结束或者关闭后连接归还连接池
+
+        with requests.stream("GET", url, chunk_size=1024 * 1024) as resp:
+            for chunk in resp:
+                ...
+        Args:
+            method, url, *,  params=None, data=None, json=None, headers=None, **kwargs
+            chunk_size: 每次读取的字节数
+        Returns:
+
+        """
+        verify_ssl = self.verify_ssl if verify_ssl is None else verify_ssl
+        timeout = self.timeout if timeout is None else timeout
+        resp = self._send(method, url, params=params, data=data, json=json, headers=headers, verify_ssl=verify_ssl,
+                          timeout=timeout, stream=True, **kwargs)
+        return StreamResponse(resp.status_code, resp.reason, resp.headers, resp.cookies,
+                              chunks=self._iter_chunks(resp, url, chunk_size), close=resp.close)
+
+    def download(self, url: str, path: str, *, params: Dict = None, headers: Dict = None, verify_ssl: bool = None,
+                 timeout: int = None, chunk_size: int = 1024 * 1024, **kwargs) -> int:
+        """
+        下载文件,响应体按块写入磁盘,内存占用和文件大小无关
+
+        先写入临时文件,下载完成后再重命名为目标文件,下载失败时删除临时文件
+        Args:
+            url: 下载地址
+            path: 文件保存的路径
+            chunk_size: 每次读取和写入的字节数
+        Returns:
+            写入的字节数
+        """
+        tmp_path = f"{path}.part"
+        written = 0
+        try:
+            with self.stream("GET", url, params=params, headers=headers, verify_ssl=verify_ssl, timeout=timeout,
+                             chunk_size=chunk_size, **kwargs) as resp, open(tmp_path, "wb") as f:
+                for chunk in resp:
+                    f.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return written
+
+    def upload(self, url: str, source: Any, *, method: str = "POST", params: Dict = None, headers: Dict = None,
+               verify_ssl: bool = None, timeout: int = None, chunk_size: int = 64 * 1024, content_length: int = None,
+               content_type: str = "application/octet-stream", **kwargs) -> Response:
+        """
+        流式上传,数据按块发送,内存占用和上传的大小无关
+
+        数据源可以是文件路径、打开的文件、mmap、bytes等buffer对象或者同步的生成器,
+        能获取大小的数据源使用Content-Length发送,否则使用chunked编码发送
+        Args:
+            url: 上传地址
+            source: 上传的数据源
+            method: 请求方法, POST, PUT或者PATCH
+            chunk_size: 每次发送的字节数,打开的文件由底层连接按块读取
+            content_length: 生成器等无法获取大小的数据源可以指定总字节数
+            content_type: 上传数据的Content-Type
+        Returns:
+
+        """
+        if is_path(source):
+            with open(source, "rb") as f:
+                return self.upload(url, f, method=method, params=params, headers=headers, verify_ssl=verify_ssl,
+                                   timeout=timeout, chunk_size=chunk_size, content_length=content_length,
+                                   content_type=content_type, **kwargs)
+
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", content_type)
+        if is_file(source):
+            # 文件对象可以在重定向时回退到开始的位置重新发送
+            data = source
+        else:
+            length = upload_length(source) if content_length is None else content_length
+            chunks = iter_source(source, chunk_size)
+            data = chunks if length is None else SizedIterator(chunks, length)
+        return self.request(method, url, params=params, data=data, headers=headers, verify_ssl=verify_ssl,
+                            timeout=timeout, **kwargs)
+
+    def _get_executor(self, ) -> ThreadPoolExecutor:
+        """
+        获取map批量请求的线程池,所有的批量请求共用同一个线程池和session的连接池
+        Args:
+
+        Returns:
+
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="feshttp")
+            return self._executor
+
+    def _map_one(self, spec: Union[Mapping, Sequence], deadline: float = None) -> Response:
+        """
+        执行批量请求中的单个请求
+        Args:
+            spec: 请求描述
+            deadline: 批量请求的截止时间,请求的timeout不超过开始执行时距离截止时间的剩余时间,
+                避免截止后还在共享的线程池中长时间运行
+        Returns:
+
+        """
+        method, url, kwargs = self._parse_request_spec(spec)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ClientConnectionError(url=url, message="batch deadline exceeded")
+            timeout = kwargs.get("timeout")
+            timeout = self.timeout if timeout is None else timeout
+            if isinstance(timeout, tuple):
+                # requests的(connect, read)形式的超时分别限制
+                timeout = tuple(remaining if value is None else min(value, remaining) for value in timeout)
             else:
-                return Response(resp.status_code, resp.reason, resp.headers, resp.cookies, resp_body=resp_json,
-                                content=b"")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            kwargs = dict(kwargs, timeout=timeout)
+        return self.request(method, url, **kwargs)
+
+    def map(self, requests: Iterable[Union[Mapping, Sequence]], *, max_workers: int = None,
+            return_exceptions: bool = True, timeout: float = None) -> List[Union[Response, Exception]]:
+        """
+        在线程池中并发执行多个请求,结果和请求的顺序一致,总耗时取决于最慢的请求而不是所有请求耗时的和
+
+        requests中的单个请求可以是{"method": "GET", "url": url, "params": {...}}的字典形式,
+        或者(method, url)、(method, url, kwargs)的元组形式
+        Args:
+            requests: 请求描述的列表
+            max_workers: 本次批量请求的最大并发数,默认为线程池的大小
+            return_exceptions: 为true时异常作为对应位置的结果返回,否则第一个异常时取消没有开始的请求并抛出
+            timeout: 整个批量请求的截止时间,单位秒,到期时没有完成的请求的结果为ClientConnectionError
+        Returns:
+
+        """
+        requests = list(requests)
+        max_workers = max_workers or self.max_workers
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results: List[Union[Response, Exception, None]] = [None] * len(requests)
+        pending = iter(enumerate(requests))
+        running: Dict[Future, int] = {}
+        executor = self._get_executor()
+
+        try:
+            while True:
+                for index, spec in itertools.islice(pending, max(max_workers - len(running), 0)):
+                    running[executor.submit(self._map_one, spec, deadline)] = index
+                if not running:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                done, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        results[index] = e
+        finally:
+            # 出现异常或者到达截止时间时,取消还没有开始的请求,已经开始的请求由不超过截止时间的timeout结束
+            for future in running:
+                future.cancel()
+
+        # 到达截止时间时没有完成的请求
+        unfinished = list(running.values()) + [index for index, _ in pending]
+        for index in sorted(unfinished):
+            url = self._parse_request_spec(requests[index])[1]
+            error = ClientConnectionError(url=url, message="batch deadline of {}s exceeded".format(timeout))
+            if not return_exceptions:
+                raise error
+            results[index] = error
+        return results
 
     def request(self, method: str, url: str, *, params: Dict = None, data: Dict = None, json: Dict = None,
                 headers: Dict = None, verify_ssl: bool = None, timeout: int = None, **kwargs) -> Response:
@@ -443,4 +901,9 @@ class SyncRequests(BaseRequestsMixIn, Singleton):
         Returns:
 
         """
-        self.session.close()
+        if self.session:
+            self.session.close()
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
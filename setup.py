@@ -44,6 +44,7 @@ setup(name='feshttp',
                         'aiodns',
                         'simplejson',
                         'requests>=2.21.0'],
+      extras_require={'orjson': ['orjson'], 'ujson': ['ujson>=5.0']},
       python_requires=">=3.5",
       keywords="http, asyncio, crud, session",
       license='MIT',
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午10:20
+jrpc请求体编码的基准测试,对比uuid加整体序列化和递增id加缓存前缀两种方式
+"""
+import itertools
+import timeit
+import uuid
+
+from feshttp import AIOJRPClient
+from feshttp._json import dumps, get_backend, use_backend
+
+NUMBER = 100000
+
+
+def old_envelope(method: str, params):
+    """
+    原来的方式, uuid作为id, 整个请求体序列化时对key排序
+    Args:
+
+    Returns:
+
+    """
+    body = {'jsonrpc': '2.0', 'method': method, 'id': uuid.uuid4().hex}
+    if params:
+        body['params'] = params
+    return dumps(body, sort_keys=True).encode()
+
+
+def new_envelope(method: str, params, counter=itertools.count(1)):
+    """
+    现在的方式,递增的整数id, 使用缓存的方法前缀拼接bytes
+    Args:
+
+    Returns:
+
+    """
+    body = {'jsonrpc': '2.0', 'method': method, 'id': next(counter)}
+    if params:
+        body['params'] = params
+    return AIOJRPClient._encode_body(body)
+
+
+def bench(backend: str):
+    """
+
+    Args:
+
+    Returns:
+
+    """
+    use_backend(backend, sort_keys=True)
+    cases = {
+        "no params": ("test", None),
+        "positional": ("sub", (5, 2)),
+        "keyword": ("query", {"name": "feshttp", "page": 1, "size": 20, "tags": ["a", "b", "c"]}),
+    }
+    print(f"backend: {get_backend()}, number: {NUMBER}")
+    for name, (method, params) in cases.items():
+        old = timeit.timeit(lambda: old_envelope(method, params), number=NUMBER)
+        new = timeit.timeit(lambda: new_envelope(method, params), number=NUMBER)
+        print(f"  {name:<12} old: {old / NUMBER * 1e6:6.2f}us  new: {new / NUMBER * 1e6:6.2f}us  "
+              f"speedup: {old / new:4.1f}x")
+    batch = [("sub", (i, 2)) for i in range(100)]
+    old = timeit.timeit(lambda: [old_envelope(m, p) for m, p in batch], number=NUMBER // 100)
+    new = timeit.timeit(lambda: AIOJRPClient._encode_body(
+        [{'jsonrpc': '2.0', 'method': m, 'id': i, 'params': p} for i, (m, p) in enumerate(batch)]),
+        number=NUMBER // 100)
+    print(f"  {'batch(100)':<12} old: {old / (NUMBER // 100) * 1e6:6.2f}us  "
+          f"new: {new / (NUMBER // 100) * 1e6:6.2f}us  speedup: {old / new:4.1f}x")
+
+
+if __name__ == '__main__':
+    for backend_name in ("simplejson", "auto"):
+        bench(backend_name)
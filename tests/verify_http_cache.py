@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午3:05
+GET响应缓存的检查,新鲜度、ETag重新校验、stale-while-revalidate和带认证信息的请求
+"""
+
+import asyncio
+import atexit
+
+import aiohttp
+from aiohttp import web
+
+from feshttp import AIORequests
+
+PORT = 18762
+URL = "http://127.0.0.1:{}/cached".format(PORT)
+requests = AIORequests()
+counts = {"requests": 0, "not_modified": 0}
+
+
+async def cached(request):
+    """
+    Cache-Control由查询参数cc指定, If-None-Match匹配时返回304
+    Args:
+
+    Returns:
+
+    """
+    counts["requests"] += 1
+    headers = {"ETag": '"v1"', "Cache-Control": request.query.get("cc", "max-age=0")}
+    if request.headers.get("If-None-Match") == '"v1"':
+        counts["not_modified"] += 1
+        return web.Response(status=304, headers=headers)
+    return web.json_response({"n": counts["requests"]}, headers=headers)
+
+
+async def start_server():
+    """
+    启动本地的测试服务
+    Args:
+
+    Returns:
+
+    """
+    app = web.Application()
+    app.router.add_get("/cached", cached)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+async def get_twice(params, **kwargs):
+    """
+    同样的参数请求两次,返回两次的响应体和服务端收到的请求数
+    Args:
+
+    Returns:
+
+    """
+    counts["requests"] = counts["not_modified"] = 0
+    first = await requests.async_get(URL, params=params, **kwargs)
+    second = await requests.async_get(URL, params=params, **kwargs)
+    return first.json(), second.json(), counts["requests"]
+
+
+async def verify_fresh():
+    """
+    max-age内直接使用缓存,不请求服务端; no-store不缓存
+    Args:
+
+    Returns:
+
+    """
+    first, second, received = await get_twice({"cc": "max-age=60"})
+    assert first == second == {"n": 1} and received == 1
+    # 参数不同时是不同的缓存
+    assert (await requests.async_get(URL, params={"cc": "max-age=60", "k": 1})).json() == {"n": 2}
+
+    first, second, received = await get_twice({"cc": "no-store"})
+    assert first == {"n": 1} and second == {"n": 2} and received == 2
+
+
+async def verify_revalidate():
+    """
+    过期后带If-None-Match重新校验, 304时返回缓存的响应
+    Args:
+
+    Returns:
+
+    """
+    first, second, received = await get_twice({"cc": "max-age=0"})
+    assert first == second == {"n": 1} and received == 2 and counts["not_modified"] == 1
+    stats = requests.cache.stats()
+    assert stats["revalidations"] >= 1 and stats["not_modified"] >= 1
+
+
+async def verify_stale_while_revalidate():
+    """
+    stale-while-revalidate时间内先返回过期的响应,在后台重新校验
+    Args:
+
+    Returns:
+
+    """
+    params = {"cc": "max-age=0, stale-while-revalidate=60"}
+    first, second, received = await get_twice(params)
+    assert first == second == {"n": 1}
+    # 后台校验的task完成后服务端才收到第二个请求
+    assert requests._revalidate_tasks
+    await asyncio.gather(*requests._revalidate_tasks)
+    assert not requests._revalidate_tasks
+    assert counts["requests"] == 2 and counts["not_modified"] == 1
+    # 304更新了新鲜度,仍然在stale-while-revalidate时间内,继续返回缓存并在后台校验
+    assert (await requests.async_get(URL, params=params)).json() == {"n": 1}
+    await asyncio.gather(*requests._revalidate_tasks)
+    assert counts["requests"] == 3 and counts["not_modified"] == 2
+
+
+async def verify_private_requests():
+    """
+    带认证信息或者cookie的请求不使用缓存,防止不同用户之间共享响应
+    Args:
+
+    Returns:
+
+    """
+    params = {"cc": "max-age=60", "k": "private"}
+    private_kwargs = [{"headers": {"Authorization": "Bearer a"}}, {"headers": {"cookie": "sid=a"}},
+                      {"auth": aiohttp.BasicAuth("user", "password")}, {"cookies": {"sid": "a"}}]
+    for kwargs in private_kwargs:
+        first, second, received = await get_twice(params, **kwargs)
+        assert first == {"n": 1} and second == {"n": 2} and received == 2, kwargs
+    # 没有认证信息的请求正常缓存
+    first, second, received = await get_twice(params)
+    assert first == second and received == 1
+
+
+async def verify_cache():
+    """
+    启动本地服务后执行所有检查
+    Args:
+
+    Returns:
+
+    """
+    runner = await start_server()
+    try:
+        await verify_fresh()
+        await verify_revalidate()
+        await verify_stale_while_revalidate()
+        await verify_private_requests()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    requests.init_session(cache_maxsize=1024 * 1024)
+    loop.run_until_complete(verify_cache())
+    print("http cache ok", requests.cache.stats())
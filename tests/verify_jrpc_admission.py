@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午3:30
+jsonrpc服务端准入控制的检查,排队、拒绝、优先级挤占和critical方法
+"""
+
+import asyncio
+import atexit
+
+from feshttp._jrpc_admission import AdmissionController, OverloadedError
+
+
+async def hold(controller, method, release: asyncio.Event):
+    """
+    获取执行名额后一直占用到release
+    Args:
+
+    Returns:
+
+    """
+    with await controller.acquire(method):
+        await release.wait()
+        return method
+
+
+async def expect_overloaded(awaitable, reason):
+    """
+    调用应该因为reason被拒绝
+    Args:
+
+    Returns:
+
+    """
+    try:
+        await awaitable
+    except OverloadedError as e:
+        assert e.reason == reason, e
+    else:
+        raise AssertionError("call should be rejected: {}".format(reason))
+
+
+async def verify_queue():
+    """
+    超过max_in_flight的调用排队,名额释放后按顺序执行,队列满时拒绝
+    Args:
+
+    Returns:
+
+    """
+    controller = AdmissionController(1, max_queue=1, queue_timeout=1)
+    release = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, "a", release))
+    await asyncio.sleep(0)
+    queued = asyncio.ensure_future(hold(controller, "b", release))
+    await asyncio.sleep(0)
+    assert controller.snapshot()["in_flight"] == 1 and controller.snapshot()["queued"] == 1
+
+    await expect_overloaded(controller.acquire("c"), "queue full")
+    release.set()
+    assert await asyncio.gather(running, queued) == ["a", "b"]
+    snapshot = controller.snapshot()
+    assert snapshot["in_flight"] == 0 and snapshot["queued"] == 0
+    assert snapshot["admitted"] == 2 and snapshot["total_queued"] == 1 and snapshot["rejected"] == {"c": 1}
+
+
+async def verify_queue_timeout():
+    """
+    在队列中等待超过queue_timeout时拒绝
+    Args:
+
+    Returns:
+
+    """
+    controller = AdmissionController(1, queue_timeout=0.02)
+    release = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, "a", release))
+    await asyncio.sleep(0)
+    await expect_overloaded(controller.acquire("b"), "queue timeout")
+    assert controller.snapshot()["queued"] == 0
+    release.set()
+    await running
+
+
+async def verify_priority():
+    """
+    队列满时高优先级挤掉低优先级, critical不受限制, 方法单独的限制
+    Args:
+
+    Returns:
+
+    """
+    controller = AdmissionController(1, max_queue=1, queue_timeout=1)
+    controller.configure("low", priority="low")
+    controller.configure("high", priority="high")
+    controller.configure("health", priority="critical")
+    release = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, "normal", release))
+    await asyncio.sleep(0)
+    low = asyncio.ensure_future(hold(controller, "low", release))
+    await asyncio.sleep(0)
+    high = asyncio.ensure_future(hold(controller, "high", release))
+    await asyncio.sleep(0)
+    await expect_overloaded(low, "evicted by higher priority call")
+    # 同样优先级的调用不能挤掉已经排队的调用
+    await expect_overloaded(controller.acquire("high"), "queue full")
+
+    with await controller.acquire("health"):
+        assert controller.snapshot()["in_flight"] == 2
+    release.set()
+    assert await asyncio.gather(running, high) == ["normal", "high"]
+
+    try:
+        controller.configure("x", priority="urgent")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown priority should raise ValueError")
+
+    # 方法单独的限制不影响其他方法
+    controller = AdmissionController(max_queue=0)
+    controller.configure("slow", max_in_flight=1)
+    release = asyncio.Event()
+    running = asyncio.ensure_future(hold(controller, "slow", release))
+    await asyncio.sleep(0)
+    await expect_overloaded(controller.acquire("slow"), "queue full")
+    with await controller.acquire("fast"):
+        pass
+    release.set()
+    await running
+    assert controller.snapshot()["methods"]["slow"]["in_flight"] == 0
+
+
+async def verify_disabled():
+    """
+    没有设置限制时不做任何处理
+    Args:
+
+    Returns:
+
+    """
+    controller = AdmissionController()
+    assert not controller.enabled
+    with await controller.acquire("a"), await controller.acquire("a"):
+        assert controller.in_flight == 0
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    loop.run_until_complete(verify_queue())
+    loop.run_until_complete(verify_queue_timeout())
+    loop.run_until_complete(verify_priority())
+    loop.run_until_complete(verify_disabled())
+    print("jrpc admission ok")
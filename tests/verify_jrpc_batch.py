@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午3:50
+jsonrpc批量调用的检查,批量请求的拆分、自动合并的分发和微批处理的取消
+"""
+
+import asyncio
+import atexit
+
+from aiohttp import web
+
+from feshttp import AIOJRPClient, AIORequests
+from feshttp._batcher import MicroBatcher
+
+PORT = 18763
+requests = AIORequests()
+batch_sizes = []
+
+
+async def jrpc(request):
+    """
+    返回[方法名, 参数], 批量请求中有boom方法时整个请求返回500
+    Args:
+
+    Returns:
+
+    """
+    body = await request.json()
+    bodies = body if isinstance(body, list) else [body]
+    batch_sizes.append(len(bodies))
+    if any(item["method"] == "boom" for item in bodies):
+        return web.json_response({"error": "boom"}, status=500)
+    # 批量响应的顺序和请求不一致,客户端需要按照id对应
+    results = [{"jsonrpc": "2.0", "id": item["id"], "result": [item["method"], item.get("params")]}
+               for item in reversed(bodies)]
+    return web.json_response(results if isinstance(body, list) else results[0])
+
+
+async def start_server():
+    """
+    启动本地的测试服务
+    Args:
+
+    Returns:
+
+    """
+    app = web.Application()
+    app.router.add_post("/api/jrpc/post", jrpc)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+async def verify_split_batch(client: AIOJRPClient):
+    """
+    超过split_batch_size的批量调用拆分为多个请求,结果按照调用的顺序返回,失败的子批量只影响其中的调用
+    Args:
+
+    Returns:
+
+    """
+    batch_sizes.clear()
+    call = client["local"]
+    for i in range(7):
+        call = call.add(i)
+    assert await call.done() == [["add", [i]] for i in range(7)]
+    assert sorted(batch_sizes) == [1, 3, 3]
+
+    # 没有超过split_batch_size时不拆分
+    batch_sizes.clear()
+    assert await client["local"].add(1).add(2).done() == [["add", [1]], ["add", [2]]]
+    assert batch_sizes == [2]
+
+    batch_sizes.clear()
+    results = await client["local"].a().b().c().boom().e().done()
+    assert results[:3] == [["a", None], ["b", None], ["c", None]]
+    for error in results[3:]:
+        assert error["code"] == -32603 and error["data"].startswith("sub batch 2/2 failed"), error
+    assert sorted(batch_sizes) == [2, 3]
+
+
+async def verify_batch_window(client: AIOJRPClient):
+    """
+    batch_window内不同协程的单个调用合并为一个批量请求,再按照id分发结果
+    Args:
+
+    Returns:
+
+    """
+    AIOJRPClient.batch_window = 0.01
+    try:
+        batch_sizes.clear()
+        results = await asyncio.gather(*(client["local"].add(i).done() for i in range(5)))
+        assert results == [["add", [i]] for i in range(5)]
+        assert batch_sizes == [5]
+        batcher = AIOJRPClient._batchers["local"]
+        assert batcher.calls == 5 and batcher.batches == 1
+    finally:
+        AIOJRPClient.batch_window = None
+
+
+async def verify_micro_batcher():
+    """
+    达到max_size时立即发送,发送前取消的调用不发送,发送失败或者被取消时所有调用方都收到异常
+    Args:
+
+    Returns:
+
+    """
+    sent = []
+
+    async def send(items):
+        sent.append(list(items))
+        if "fail" in items:
+            raise ValueError("fail")
+        if "cancel" in items:
+            raise asyncio.CancelledError()
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(send, window=10, max_size=3)
+    assert await asyncio.gather(*(batcher.submit(i) for i in range(3))) == [0, 2, 4]
+    assert sent == [[0, 1, 2]]
+
+    batcher = MicroBatcher(send, window=0.01)
+    first, second = asyncio.ensure_future(batcher.submit("a")), asyncio.ensure_future(batcher.submit("b"))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "bb" and sent[-1] == ["b"]
+
+    for item, error in (("fail", ValueError), ("cancel", asyncio.CancelledError)):
+        futures = [asyncio.ensure_future(batcher.submit(value)) for value in (item, "c")]
+        for future in futures:
+            try:
+                await future
+            except error:
+                pass
+            else:
+                raise AssertionError("all callers should get {}".format(error.__name__))
+
+
+async def verify_batch():
+    """
+    启动本地服务后执行所有检查
+    Args:
+
+    Returns:
+
+    """
+    runner = await start_server()
+    client = AIOJRPClient(requests, split_batch_size=3)
+    client.register("local", ("127.0.0.1", PORT))
+    try:
+        await verify_split_batch(client)
+        await verify_batch_window(client)
+        await verify_micro_batcher()
+    finally:
+        await AIOJRPClient.aclose()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    requests.init_session()
+    loop.run_until_complete(verify_batch())
+    print("jrpc batch ok")
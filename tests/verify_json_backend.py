@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午2:10
+json后端的行为检查,默认后端、超过64位的整数、Decimal和每个客户端单独的后端
+"""
+from decimal import Decimal
+
+from feshttp import AIORequests, SyncRequests
+from feshttp._json import _backends, dumps, get_backend, loads
+from feshttp._response import Response
+
+BIG_INT = 123456789012345678901234567890
+BIG_INT_BODY = b'{"n": 123456789012345678901234567890}'
+
+
+def verify_default_backend():
+    """
+    默认使用simplejson,创建客户端不修改进程默认的后端
+    Args:
+
+    Returns:
+
+    """
+    assert get_backend() == "simplejson"
+    AIORequests(json_backend="auto")
+    SyncRequests(json_backend="auto")
+    assert get_backend() == "simplejson"
+    assert Response(200, "OK", {}, {}, content=BIG_INT_BODY).resp_body == {"n": BIG_INT}
+
+
+def verify_big_int():
+    """
+    所有后端解析和序列化超过64位的整数时都保持精度
+    Args:
+
+    Returns:
+
+    """
+    for name in _backends:
+        body = Response(200, "OK", {}, {}, content=BIG_INT_BODY, json_backend=name).resp_body
+        assert body == {"n": BIG_INT} and type(body["n"]) is int, (name, body)
+        assert loads(BIG_INT_BODY.decode(), backend=name) == {"n": BIG_INT}, name
+        assert loads(dumps({"n": BIG_INT}, backend=name), backend=name) == {"n": BIG_INT}, name
+        # 64位以内的整数不受影响
+        assert loads(b'{"n": 18446744073709551615}', backend=name) == {"n": 18446744073709551615}, name
+
+
+def verify_decimal():
+    """
+    快速后端不支持Decimal时交给simplejson,输出和快速后端一样是紧凑格式,不随内容变化
+    Args:
+
+    Returns:
+
+    """
+    for name in _backends:
+        if name == "simplejson":
+            continue
+        plain = dumps({"a": 1, "b": [1, 2]}, backend=name)
+        with_decimal = dumps({"a": Decimal("1.10"), "b": [1, 2]}, backend=name)
+        assert plain == '{"a":1,"b":[1,2]}', (name, plain)
+        # ujson本身把Decimal序列化为float, orjson交给simplejson时保持Decimal原样的数字
+        expected = '{"a":1.1,"b":[1,2]}' if name == "ujson" else '{"a":1.10,"b":[1,2]}'
+        assert with_decimal == expected, (name, with_decimal)
+    assert dumps({"b": Decimal("1.10"), "a": 1}) == '{"a": 1, "b": 1.10}'
+
+
+def verify_sort_keys():
+    """
+    每次调用可以单独指定是否排序, None使用默认值
+    Args:
+
+    Returns:
+
+    """
+    for name in _backends:
+        assert loads(dumps({"b": 1, "a": 2}, backend=name, sort_keys=False), backend=name) == {"b": 1, "a": 2}
+        assert dumps({"b": 1, "a": 2}, backend=name, sort_keys=None).index('"a"') < dumps(
+            {"b": 1, "a": 2}, backend=name, sort_keys=None).index('"b"'), name
+    try:
+        get_backend("not-installed")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown backend should raise ValueError")
+
+
+if __name__ == '__main__':
+    verify_default_backend()
+    verify_big_int()
+    verify_decimal()
+    verify_sort_keys()
+    print("json backend ok, backends: {}".format(", ".join(_backends)))
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午2:40
+重试预算、重试策略、熔断器和对冲策略的状态变化检查
+"""
+
+import asyncio
+import atexit
+import time
+
+from aiohttp import web
+
+from feshttp import AIORequests
+from feshttp._breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from feshttp._hedge import HedgePolicy
+from feshttp._retry import RetryBudget, RetryPolicy
+from feshttp.err import CircuitOpenError, ClientConnectionError, ClientResponseError
+
+PORT = 18761
+URL = "http://127.0.0.1:{}".format(PORT)
+hits = {"flaky": 0}
+
+
+async def flaky(request):
+    """
+    前两次返回503,之后返回200
+    Args:
+
+    Returns:
+
+    """
+    hits["flaky"] += 1
+    if hits["flaky"] <= 2:
+        return web.json_response({"n": hits["flaky"]}, status=503)
+    return web.json_response({"n": hits["flaky"]})
+
+
+async def start_server():
+    """
+    启动本地的测试服务
+    Args:
+
+    Returns:
+
+    """
+    app = web.Application()
+    app.router.add_get("/flaky", flaky)
+    app.router.add_post("/flaky", flaky)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+def verify_retry_budget():
+    """
+    没有令牌时不再重试,每个请求存入ratio个令牌
+    Args:
+
+    Returns:
+
+    """
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw() and not budget.withdraw()
+    # 按照时间补充令牌,不超过容量
+    budget = RetryBudget(ratio=0, min_per_second=1000, max_tokens=1)
+    assert budget.withdraw() and not budget.withdraw()
+    time.sleep(0.01)
+    assert budget.withdraw() and budget.tokens <= 1
+
+
+def verify_retry_policy():
+    """
+    只重试幂等的方法、连接异常和retry_statuses中的状态码,遵守max_retries和Retry-After
+    Args:
+
+    Returns:
+
+    """
+    policy = RetryPolicy(max_retries=2, budget=RetryBudget(min_per_second=0, max_tokens=100))
+    unavailable = ClientResponseError(URL, status_code=503)
+    assert policy.should_retry("GET", ClientConnectionError(URL), 0)
+    assert policy.should_retry("get", unavailable, 1)
+    assert not policy.should_retry("GET", unavailable, 2)
+    assert not policy.should_retry("POST", unavailable, 0)
+    assert not policy.should_retry("GET", ClientResponseError(URL, status_code=500), 0)
+    assert not policy.should_retry("GET", ClientResponseError(URL, status_code=404), 0)
+    assert RetryPolicy(methods=("POST",)).should_retry("POST", unavailable, 0)
+
+    limited = ClientResponseError(URL, status_code=429, headers={"Retry-After": "2"})
+    assert policy.retry_after(limited) == 2 and policy.backoff(0, limited) == 2
+    assert not RetryPolicy(retry_after_max=1).should_retry("GET", limited, 0)
+    assert 0 <= policy.backoff(3) <= policy.backoff_base * 2 ** 3
+    # 流式的请求体不能重复发送
+    assert policy.is_replayable(b"data") and policy.is_replayable({"a": 1})
+    assert not policy.is_replayable(iter([b"data"]))
+
+    # 预算耗尽时不再重试
+    exhausted = RetryPolicy(budget=RetryBudget(min_per_second=0, max_tokens=1))
+    assert exhausted.should_retry("GET", unavailable, 0)
+    assert not exhausted.should_retry("GET", unavailable, 1)
+
+
+async def verify_retry_request():
+    """
+    503的GET请求按照策略重试后成功, POST不重试
+    Args:
+
+    Returns:
+
+    """
+    requests = AIORequests(retry_policy=RetryPolicy(max_retries=3, backoff_base=0.01))
+    requests.session = requests._create_session()
+    try:
+        hits["flaky"] = 0
+        resp = await requests.async_get(URL + "/flaky")
+        assert resp.status_code == 200 and resp.json() == {"n": 3} and hits["flaky"] == 3
+
+        hits["flaky"] = 0
+        try:
+            await requests.async_post(URL + "/flaky")
+        except ClientResponseError as e:
+            assert e.status_code == 503 and hits["flaky"] == 1
+        else:
+            raise AssertionError("POST should not be retried")
+    finally:
+        await requests.session.close()
+
+
+def _fail(breaker: CircuitBreaker, url: str):
+    """
+    记录一次失败的调用
+    Args:
+
+    Returns:
+
+    """
+    try:
+        with breaker.call(url):
+            raise ClientConnectionError(url)
+    except ClientConnectionError:
+        pass
+
+
+def _succeed(breaker: CircuitBreaker, url: str):
+    """
+    记录一次成功的调用
+    Args:
+
+    Returns:
+
+    """
+    with breaker.call(url):
+        pass
+
+
+def verify_circuit_breaker():
+    """
+    关闭 -> 打开 -> 半开 -> 关闭, 半开时探测失败重新打开, 4xx不算失败
+    Args:
+
+    Returns:
+
+    """
+    breaker = CircuitBreaker(minimum_calls=4, window_size=4, open_duration=0.05, half_open_max_calls=2)
+    url = URL + "/flaky"
+    _succeed(breaker, url)
+    _succeed(breaker, url)
+    _fail(breaker, url)
+    assert breaker.state(url) == CLOSED
+    _fail(breaker, url)
+    assert breaker.state(url) == OPEN
+
+    try:
+        _succeed(breaker, url)
+    except CircuitOpenError as e:
+        assert e.host == "127.0.0.1:{}".format(PORT) and 0 < e.retry_after <= 0.05
+    else:
+        raise AssertionError("open circuit should reject calls")
+    snapshot = breaker.snapshot()[breaker.host_of(url)]
+    assert snapshot["rejected"] == 1 and snapshot["open_count"] == 1
+
+    # 打开时间过后进入半开,探测成功后关闭
+    time.sleep(0.06)
+    assert breaker.state(url) == HALF_OPEN
+    _succeed(breaker, url)
+    _succeed(breaker, url)
+    assert breaker.state(url) == CLOSED
+
+    # 半开时探测失败重新打开
+    for _ in range(4):
+        _fail(breaker, url)
+    assert breaker.state(url) == OPEN
+    time.sleep(0.06)
+    _fail(breaker, url)
+    _succeed(breaker, url)
+    assert breaker.state(url) == OPEN and breaker.snapshot()[breaker.host_of(url)]["open_count"] == 3
+
+    # 4xx是调用方的问题,不算失败
+    breaker.reset()
+    for _ in range(4):
+        try:
+            with breaker.call(url):
+                raise ClientResponseError(url, status_code=404)
+        except ClientResponseError:
+            pass
+    assert breaker.state(url) == CLOSED
+
+
+async def verify_hedge():
+    """
+    主请求超过delay没有返回时发起对冲请求,使用先返回的结果并取消主请求
+    Args:
+
+    Returns:
+
+    """
+    cancelled = []
+
+    async def attempt(index):
+        try:
+            await asyncio.sleep(0.5 if index == 0 else 0)
+            return index
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    policy = HedgePolicy(delay=0.01)
+    assert await policy.run(attempt) == 1
+    await asyncio.sleep(0)
+    stats = policy.stats()
+    assert stats["requests"] == 1 and stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert cancelled == [0]
+
+    # 主请求在delay内返回时不对冲
+    async def fast(index):
+        return index
+
+    assert await policy.run(fast) == 0 and policy.stats()["hedges"] == 1
+
+    # 没有对冲预算时只等待主请求
+    policy = HedgePolicy(delay=0.01, budget=RetryBudget(ratio=0, min_per_second=0, max_tokens=0))
+    assert await policy.run(attempt) == 0 and policy.stats()["hedges"] == 0
+    assert not policy.is_hedgeable("POST") and not policy.is_hedgeable("GET", iter([b"data"]))
+
+
+async def verify_async():
+    """
+    需要本地服务和事件循环的检查
+    Args:
+
+    Returns:
+
+    """
+    runner = await start_server()
+    try:
+        await verify_retry_request()
+        await verify_hedge()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    atexit.register(loop.close)
+    verify_retry_budget()
+    verify_retry_policy()
+    verify_circuit_breaker()
+    loop.run_until_complete(verify_async())
+    print("retry, circuit breaker and hedge ok")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/19 上午4:15
+同步批量请求map的检查,结果顺序、异常处理和整个批量请求的截止时间
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from feshttp import SyncRequests
+from feshttp.err import ClientConnectionError, ClientResponseError
+
+requests = SyncRequests()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /sleep按照查询参数s等待后返回查询参数, /err返回500
+    """
+
+    def do_GET(self, ):
+        parts = urlsplit(self.path)
+        query = {key: value[0] for key, value in parse_qs(parts.query).items()}
+        time.sleep(float(query.get("s", 0)))
+        body = json.dumps(query).encode()
+        try:
+            self.send_response(500 if parts.path == "/err" else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端超时后已经关闭了连接
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def verify_order(url):
+    """
+    结果和请求的顺序一致,支持字典和元组形式的请求描述, 异常作为对应位置的结果返回
+    Args:
+
+    Returns:
+
+    """
+    results = requests.map([("GET", url + "/sleep", {"params": {"s": "0.1", "i": "0"}}),
+                            {"method": "GET", "url": url + "/sleep", "params": {"i": "1"}},
+                            ("GET", url + "/err"),
+                            ("GET", url + "/sleep?i=3")])
+    assert [result.json()["i"] for result in results[:2]] == ["0", "1"]
+    assert isinstance(results[2], ClientResponseError) and results[2].status_code == 500
+    assert results[3].json() == {"i": "3"}
+
+    try:
+        requests.map([("GET", url + "/sleep"), ("GET", url + "/err")], return_exceptions=False)
+    except ClientResponseError as e:
+        assert e.status_code == 500
+    else:
+        raise AssertionError("map should raise when return_exceptions is false")
+
+
+def verify_deadline(url):
+    """
+    到达截止时间时返回,没有完成的请求的结果为ClientConnectionError,
+    已经开始的请求的timeout不超过截止时间,包括(connect, read)形式的timeout
+    Args:
+
+    Returns:
+
+    """
+    start = time.monotonic()
+    results = requests.map([("GET", url + "/sleep"),
+                            ("GET", url + "/sleep?s=2"),
+                            ("GET", url + "/sleep?s=2", {"timeout": (5, None)}),
+                            ("GET", url + "/sleep?s=2", {"timeout": (5, 10)})], timeout=0.3)
+    elapsed = time.monotonic() - start
+    assert elapsed < 1, elapsed
+    assert results[0].status_code == 200
+    for result in results[1:]:
+        assert isinstance(result, ClientConnectionError), result
+
+    # 并发数为1时,截止时间之后的请求不再开始
+    start = time.monotonic()
+    results = requests.map([("GET", url + "/sleep?s=0.5"), ("GET", url + "/sleep"), ("GET", url + "/sleep")],
+                           max_workers=1, timeout=0.2)
+    assert time.monotonic() - start < 1
+    assert all(isinstance(result, ClientConnectionError) for result in results)
+    assert "deadline" in results[2].message
+
+    try:
+        requests.map([("GET", url + "/sleep?s=2")], timeout=0.1, return_exceptions=False)
+    except ClientConnectionError:
+        pass
+    else:
+        raise AssertionError("map should raise when the deadline is exceeded")
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    requests.init_session(timeout=5)
+    try:
+        base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+        verify_order(base_url)
+        verify_deadline(base_url)
+    finally:
+        server.shutdown()
+    print("sync map ok")